@@ -0,0 +1,95 @@
+"""Sustained packets/sec and memory per flow: dict-of-dicts vs FlowTable.
+
+    python bench_flow_table.py --packets 1000000 --flows 100000
+"""
+import argparse
+import time
+import tracemalloc
+from collections import defaultdict
+
+import numpy as np
+
+from fast_capture import format_ip
+from flow_table import FlowTable
+
+
+def synthetic_batch(packets, flows, seed=42):
+    rng = np.random.default_rng(seed)
+    flow_ids = rng.integers(0, flows, packets)
+    src = np.zeros((packets, 16), dtype=np.uint8)
+    dst = np.zeros((packets, 16), dtype=np.uint8)
+    src[:, 10:12] = dst[:, 10:12] = 0xFF
+    src[:, 12] = 10
+    src[:, 13:16] = (flow_ids[:, None] >> np.array([16, 8, 0]) & 0xFF).astype(np.uint8)
+    dst[:, 12:14] = (192, 168)
+    dst[:, 14:16] = (flow_ids[:, None] * 7 >> np.array([8, 0]) & 0xFF).astype(np.uint8)
+    return {
+        "ts": np.sort(rng.uniform(0, 5, packets)),
+        "src": src,
+        "dst": dst,
+        "proto": np.where(flow_ids % 3 == 0, 17, 6).astype(np.uint8),
+        "size": rng.integers(60, 1500, packets),
+    }
+
+
+def as_packet_dicts(batch):
+    src = [format_ip(r) for r in batch["src"]]
+    dst = [format_ip(r) for r in batch["dst"]]
+    return [
+        {"ts": t, "src": s, "dst": d, "proto": p, "size": z}
+        for t, s, d, p, z in zip(batch["ts"].tolist(), src, dst,
+                                 batch["proto"].tolist(), batch["size"].tolist())
+    ]
+
+
+def run_dict(packets):
+    """The original packet_agent aggregation loop."""
+    flows = defaultdict(lambda: {"bytes": 0, "packets": 0})
+    for p in packets:
+        key = (p["src"], p["dst"], p["proto"])
+        flows[key]["bytes"] += p["size"]
+        flows[key]["packets"] += 1
+    return flows
+
+
+def run_table(batch, batch_size):
+    table = FlowTable()
+    n = len(batch["size"])
+    for i in range(0, n, batch_size):
+        table.add_batch({k: v[i:i + batch_size] for k, v in batch.items()})
+    return table
+
+
+def measure(fn, *args):
+    """Run once for wall time, then again under tracemalloc for retained memory."""
+    start = time.perf_counter()
+    fn(*args)
+    secs = time.perf_counter() - start
+
+    tracemalloc.start()
+    result = fn(*args)
+    mem = tracemalloc.get_traced_memory()[0]
+    tracemalloc.stop()
+    return result, secs, mem
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--packets", type=int, default=1_000_000)
+    parser.add_argument("--flows", type=int, default=100_000)
+    parser.add_argument("--batch-size", type=int, default=65536)
+    args = parser.parse_args()
+
+    batch = synthetic_batch(args.packets, args.flows)
+    packets = as_packet_dicts(batch)
+
+    flows, dict_secs, dict_mem = measure(run_dict, packets)
+    table, table_secs, table_mem = measure(run_table, batch, args.batch_size)
+
+    print(f"dict : {args.packets / dict_secs:>12,.0f} pkts/s  "
+          f"{dict_mem / len(flows):>6.0f} B/flow  ({len(flows)} flows)")
+    print(f"table: {args.packets / table_secs:>12,.0f} pkts/s  "
+          f"{table_mem / len(table):>6.0f} B/flow  ({len(table)} flows)")
+
+    expected = sorted((s, d, p, v["bytes"], v["packets"]) for (s, d, p), v in flows.items())
+    print("results match:", expected == sorted(r[:5] for r in table.rows()))
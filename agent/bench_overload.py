@@ -0,0 +1,105 @@
+"""Drive packet_agent's capture -> aggregator path with a flood of unique flows.
+
+    python bench_overload.py --memory-mb 64 --seconds 20
+
+A capture thread offers synthetic batches (every packet a new flow, like a
+SYN flood from spoofed sources) as fast as it can, the real aggregator
+expires flows into a throwaway CSV sink, and the process RSS is sampled
+alongside the sampling rate and drop counters.
+
+Before the flood, the flow-hash sampler is checked on flows that differ
+only in destination port: at every rate it has to keep about 1 in N.
+"""
+import argparse
+import os
+import resource
+import tempfile
+import threading
+import time
+
+import numpy as np
+
+import packet_agent
+from flow_table import flow_hash
+from sinks import CsvSink
+
+
+def flood_batch(rng, packets, start):
+    src = np.zeros((packets, 16), dtype=np.uint8)
+    dst = np.zeros((packets, 16), dtype=np.uint8)
+    src[:, 10:12] = dst[:, 10:12] = 0xFF
+    src[:, 12:16] = rng.integers(0, 256, (packets, 4), dtype=np.uint8)
+    dst[:, 12:16] = (10, 0, 0, 1)
+    return {
+        "ts": np.full(packets, time.time()),
+        "src": src,
+        "dst": dst,
+        "proto": np.full(packets, 6, dtype=np.uint8),
+        "size": np.full(packets, 60, dtype=np.int64),
+        "sport": rng.integers(1024, 65536, packets).astype(np.uint16),
+        "dport": np.full(packets, 80, dtype=np.uint16),
+        "flags": np.full(packets, 0x02, dtype=np.uint8),
+    }
+
+
+def rss_mb():
+    with open("/proc/self/statm") as f:
+        return int(f.read().split()[1]) * resource.getpagesize() / (1024 * 1024)
+
+
+def check_port_sampling(flows=4096):
+    """Flows from one host to one host, ports 1..flows: each rate keeps ~1/N."""
+    src = np.zeros((flows, 16), dtype=np.uint8)
+    dst = np.zeros((flows, 16), dtype=np.uint8)
+    src[:, 10:12] = dst[:, 10:12] = 0xFF
+    src[:, 12:16] = (10, 0, 0, 5)
+    dst[:, 12:16] = (10, 0, 0, 9)
+    h = flow_hash({
+        "src": src,
+        "dst": dst,
+        "proto": np.full(flows, 6, dtype=np.uint8),
+        "size": np.full(flows, 60, dtype=np.int64),
+        "sport": np.full(flows, 40000, dtype=np.uint16),
+        "dport": np.arange(1, flows + 1).astype(np.uint16),
+    })
+    for rate in (2, 4, 8, 16, 64):
+        kept = int(((h & np.uint64(rate - 1)) == 0).sum())
+        print(f"port-only flows 1-in-{rate:<3} kept {kept:>5} of {flows} (expected ~{flows // rate})")
+        assert abs(kept - flows / rate) < 5 * (flows / rate) ** 0.5 + 1, "sampling ignores the ports"
+
+
+def flood(stop, batch_size):
+    rng = np.random.default_rng(0)
+    while not stop.is_set():
+        batch = packet_agent.overload.sample_batch(flood_batch(rng, batch_size, time.time()))
+        packet_agent.enqueue(batch, len(batch["size"]))
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--memory-mb", type=int, default=64)
+    parser.add_argument("--seconds", type=float, default=20)
+    parser.add_argument("--batch-size", type=int, default=16384)
+    args = parser.parse_args()
+
+    check_port_sampling()
+    baseline = rss_mb()
+    packet_agent.configure(args.memory_mb, "batch")
+    sink = CsvSink(os.path.join(tempfile.mkdtemp(), "flows.csv"))
+    threading.Thread(target=packet_agent.flow_aggregator, args=(sink,), daemon=True).start()
+
+    stop = threading.Event()
+    threading.Thread(target=flood, args=(stop, args.batch_size), daemon=True).start()
+
+    peak = 0.0
+    end = time.time() + args.seconds
+    while time.time() < end:
+        time.sleep(1)
+        peak = max(peak, rss_mb() - baseline)
+        s = packet_agent.overload.stats(packet_agent.flows)
+        print(f"rss +{rss_mb() - baseline:6.1f} MB  1-in-{s['sampling']:<4} received {s['received']:>10,}  "
+              f"sampled out {s['sampled_out']:>10,}  queue drops {s['queue_drops']:>9,}  "
+              f"flows {s['open_flows']:>7,}/{s['max_flows']:,}  evicted {s['evicted_flows']:,}")
+    stop.set()
+
+    print(f"peak rss above baseline: {peak:.1f} MB (ceiling {args.memory_mb} MB)")
@@ -0,0 +1,477 @@
+import socket
+
+import numpy as np
+
+from fast_capture import V4_MAPPED_PREFIX, format_ip
+
+# proto (1) + lower endpoint (16 addr + 2 port) + higher endpoint (16 addr + 2 port)
+KEY_BYTES = 37
+ENDPOINT_BYTES = 18
+
+TCP = 6
+TCP_FIN = 0x01
+TCP_SYN = 0x02
+TCP_RST = 0x04
+TCP_ACK = 0x10
+
+# flow lifecycle; a flow is exported when it finishes rather than on a fixed tick
+MAX_FLOWS = 262144    # beyond this the smallest flows are folded into the "other" record
+IDLE_TIMEOUT = 15.0   # no packets for this long: the flow is over
+ACTIVE_TIMEOUT = 5.0  # long-lived flows still report at least this often
+CLOSE_LINGER = 1.0    # after RST, or FIN from both sides, wait this long for stragglers
+
+# TCP teardown seen so far, kept across active-timeout exports
+CLOSED_FIN_FWD = 1
+CLOSED_FIN_REV = 2
+CLOSED_RST = 4
+
+FLOW_FIELDS = (
+    "src", "dst", "proto", "bytes", "packets", "src_port", "dst_port",
+    "rev_bytes", "rev_packets", "first_seen", "last_seen", "syn", "fin", "rst", "sampling",
+)
+
+# `weight` sums each packet's sampling rate; weight / packets is the record's rate
+COUNTERS = ("bytes", "packets", "rev_bytes", "rev_packets", "syn", "fin", "rst", "weight")
+
+# evicted flows are accumulated under this address
+OTHER = "other"
+
+
+def encode_ip(addr):
+    """Printable address -> 16 bytes (IPv4 as IPv4-mapped), matching fast_capture."""
+    if ":" in addr:
+        return socket.inet_pton(socket.AF_INET6, addr)
+    return V4_MAPPED_PREFIX + socket.inet_pton(socket.AF_INET, addr)
+
+
+def batch_from_packets(packets):
+    """Turn a list of per-packet dicts (scapy path) into a decoded batch."""
+    n = len(packets)
+    src = np.frombuffer(b"".join(encode_ip(p["src"]) for p in packets), dtype=np.uint8).reshape(n, 16)
+    dst = np.frombuffer(b"".join(encode_ip(p["dst"]) for p in packets), dtype=np.uint8).reshape(n, 16)
+    return {
+        "ts": np.fromiter((p["ts"] for p in packets), dtype=np.float64, count=n),
+        "src": src,
+        "dst": dst,
+        "proto": np.fromiter((p["proto"] for p in packets), dtype=np.uint8, count=n),
+        "size": np.fromiter((p["size"] for p in packets), dtype=np.int64, count=n),
+        "sport": np.fromiter((p.get("sport", 0) for p in packets), dtype=np.uint16, count=n),
+        "dport": np.fromiter((p.get("dport", 0) for p in packets), dtype=np.uint16, count=n),
+        "flags": np.fromiter((p.get("flags", 0) for p in packets), dtype=np.uint8, count=n),
+        "sampling": np.fromiter((p.get("sampling", 1) for p in packets), dtype=np.int64, count=n),
+    }
+
+
+KEY_DTYPE = np.dtype((np.void, KEY_BYTES))
+
+
+def _endpoints(addr, port):
+    n = len(addr)
+    out = np.empty((n, ENDPOINT_BYTES), dtype=np.uint8)
+    out[:, :16] = addr
+    port = np.zeros(n, dtype=np.uint16) if port is None else port.astype(np.uint16)
+    # big-endian, so byte order sorts like the port number
+    out[:, 16] = port >> 8
+    out[:, 17] = port & 0xFF
+    return out
+
+
+def canonical_keys(batch):
+    """(n x KEY_BYTES keys, from_lo) for a batch.
+
+    Both directions of a conversation get the same key: the lower
+    (address, port) endpoint comes first. `from_lo` is True for packets sent
+    by that lower endpoint.
+    """
+    n = len(batch["size"])
+    a = _endpoints(batch["src"], batch.get("sport"))
+    b = _endpoints(batch["dst"], batch.get("dport"))
+
+    diff = a != b
+    first = diff.argmax(axis=1)
+    rows = np.arange(n)
+    from_lo = ~(diff[rows, first] & (a[rows, first] > b[rows, first]))
+
+    keys = np.empty((n, KEY_BYTES), dtype=np.uint8)
+    keys[:, 0] = batch["proto"]
+    lo = from_lo[:, None]
+    keys[:, 1:1 + ENDPOINT_BYTES] = np.where(lo, a, b)
+    keys[:, 1 + ENDPOINT_BYTES:] = np.where(lo, b, a)
+    return keys, from_lo
+
+
+def flow_hash(batch):
+    """64-bit hash of every packet's canonical flow key; equal for both directions."""
+    keys, _ = canonical_keys(batch)
+    h = keys[:, 0].astype(np.uint64)
+    with np.errstate(over="ignore"):
+        for word in np.ascontiguousarray(keys[:, 1:]).view(np.uint32).T:
+            h = h * np.uint64(0x100000001B3) ^ word.astype(np.uint64)
+        # splitmix64 finalizer: without it the low bits only see the low bits
+        # of each word, and `h & (N - 1)` sampling would ignore the ports
+        h ^= h >> np.uint64(30)
+        h *= np.uint64(0xBF58476D1CE4E5B9)
+        h ^= h >> np.uint64(27)
+        h *= np.uint64(0x94D049BB133111EB)
+        h ^= h >> np.uint64(31)
+    return h
+
+
+def format_rows(part, start=0, stop=None):
+    """FLOW_FIELDS tuples for flows [start:stop] of an `export()`/`expire()` dict."""
+    out = []
+    for i in range(start, min(len(part["bytes"]), stop or len(part["bytes"]))):
+        raw = part["keys"][i].tobytes()
+        lo, hi = raw[1:1 + ENDPOINT_BYTES], raw[1 + ENDPOINT_BYTES:]
+        init, resp = (lo, hi) if part["init_lo"][i] else (hi, lo)
+        packets = int(part["packets"][i])
+        out.append((
+            format_ip(init[:16]),
+            format_ip(resp[:16]),
+            raw[0],
+            int(part["bytes"][i]),
+            packets,
+            int.from_bytes(init[16:], "big"),
+            int.from_bytes(resp[16:], "big"),
+            int(part["rev_bytes"][i]),
+            int(part["rev_packets"][i]),
+            round(float(part["first_seen"][i]), 3),
+            round(float(part["last_seen"][i]), 3),
+            int(part["syn"][i]),
+            int(part["fin"][i]),
+            int(part["rst"][i]),
+            round(int(part["weight"][i]) / packets, 3) if packets else 1.0,
+        ))
+    return out
+
+
+def other_rows(other):
+    """The "other" record (flows evicted from a full table) as zero or one rows."""
+    if not other["packets"]:
+        return []
+    return [(
+        OTHER, OTHER, 0, other["bytes"], other["packets"], 0, 0, other["rev_bytes"], other["rev_packets"],
+        round(other["first_seen"], 3), round(other["last_seen"], 3), other["syn"], other["fin"], other["rst"],
+        round(other["weight"] / other["packets"], 3),
+    )]
+
+
+class FlowTable:
+    """Bidirectional flow records in preallocated NumPy arrays with a sorted-key index.
+
+    Keys are the raw canonical 5-tuple (proto, lower endpoint, higher endpoint),
+    so no per-packet strings or dicts are built; addresses are only formatted
+    when flows are exported. Each flow remembers which endpoint sent its first
+    packet (the initiator): `bytes`/`packets` count both directions and
+    `rev_bytes`/`rev_packets` the responder's share. Updates are applied a
+    batch at a time: the batch is reduced to its distinct flows, looked up in
+    the index with one searchsorted, and the counters are updated with fancy
+    indexing, so there is no per-packet or per-flow Python.
+
+    `expire()` exports flows as they finish (TCP teardown, idle timeout) and
+    long-lived ones every `active_timeout`. At most `max_flows` are held; when
+    a burst of new flows (a SYN flood, a scan) would exceed that, the
+    smallest flows are folded into a single "other" record instead of the
+    table growing without bound. The table is owned by a single aggregator
+    thread and needs no locking.
+    """
+
+    def __init__(self, capacity=4096, max_flows=MAX_FLOWS, idle_timeout=IDLE_TIMEOUT,
+                 active_timeout=ACTIVE_TIMEOUT):
+        self.size = 0
+        self.max_flows = max_flows
+        self.idle_timeout = idle_timeout
+        self.active_timeout = active_timeout
+        self.evictions = 0
+        self._reset_other()
+        self._allocate(min(capacity, max_flows))
+        self._reset_index()
+
+    def _reset_other(self):
+        self.other = dict.fromkeys(COUNTERS, 0)
+        self.other.update(first_seen=np.inf, last_seen=-np.inf)
+
+    def _reset_index(self):
+        # known keys in sorted order, and the slot each one lives in
+        self.index_keys = np.empty(0, dtype=KEY_DTYPE)
+        self.index_slots = np.empty(0, dtype=np.int64)
+
+    def _allocate(self, capacity):
+        self.capacity = capacity
+        self.keys = np.zeros((capacity, KEY_BYTES), dtype=np.uint8)
+        self.init_lo = np.zeros(capacity, dtype=bool)
+        self.closed = np.zeros(capacity, dtype=np.uint8)
+        for name in COUNTERS:
+            setattr(self, name, np.zeros(capacity, dtype=np.int64))
+        self.first_seen = np.zeros(capacity, dtype=np.float64)
+        self.last_seen = np.zeros(capacity, dtype=np.float64)
+
+    def _arrays(self):
+        return [self.keys, self.init_lo, self.closed, self.first_seen, self.last_seen] + \
+            [getattr(self, name) for name in COUNTERS]
+
+    def _grow(self, needed):
+        capacity = self.capacity
+        while capacity < needed:
+            capacity *= 2
+        old = self._arrays()
+        self._allocate(min(capacity, max(needed, self.max_flows)))
+        for new, prev in zip(self._arrays(), old):
+            new[:self.size] = prev[:self.size]
+
+    def __len__(self):
+        return self.size
+
+    def add_batch(self, batch):
+        n = len(batch["size"])
+        if n == 0:
+            return
+
+        keys, from_lo = canonical_keys(batch)
+        packed = keys.view(KEY_DTYPE).ravel()
+
+        uniq, first, inverse = np.unique(packed, return_index=True, return_inverse=True)
+        m = len(uniq)
+        inverse = inverse.ravel()
+
+        size = batch["size"]
+        flags = batch.get("flags")
+        if flags is None:
+            flags = np.zeros(n, dtype=np.uint8)
+        flags = np.where(batch["proto"] == TCP, flags, 0)
+        fin = (flags & TCP_FIN) > 0
+        rst = (flags & TCP_RST) > 0
+
+        # a new flow's initiator is whoever sent a bare SYN, else its first packet in this batch
+        bare_syn = (flags & (TCP_SYN | TCP_ACK)) == TCP_SYN
+        syns = np.bincount(inverse, weights=bare_syn, minlength=m)
+        syns_lo = np.bincount(inverse, weights=bare_syn & from_lo, minlength=m)
+        init_lo = np.where(syns > 0, syns_lo > 0, from_lo[first])
+
+        slots = self._slots(uniq, keys[first], init_lo)
+        pkt_slot = slots[inverse]
+        rev = from_lo != self.init_lo[pkt_slot]
+
+        counts = {
+            "bytes": np.bincount(inverse, weights=size, minlength=m),
+            "packets": np.bincount(inverse, minlength=m),
+            "rev_bytes": np.bincount(inverse, weights=size * rev, minlength=m),
+            "rev_packets": np.bincount(inverse, weights=rev, minlength=m),
+            "syn": np.bincount(inverse, weights=(flags & TCP_SYN) > 0, minlength=m),
+            "fin": np.bincount(inverse, weights=fin, minlength=m),
+            "rst": np.bincount(inverse, weights=rst, minlength=m),
+            "weight": np.bincount(inverse, weights=batch.get("sampling", np.ones(n)), minlength=m),
+        }
+        ts = batch["ts"]
+        lo = np.full(m, np.inf)
+        hi = np.full(m, -np.inf)
+        np.minimum.at(lo, inverse, ts)
+        np.maximum.at(hi, inverse, ts)
+        self._accumulate(slots, counts, lo, hi)
+
+        ended = fin | rst
+        if ended.any():
+            bits = np.where(rst, CLOSED_RST, np.where(rev, CLOSED_FIN_REV, CLOSED_FIN_FWD)).astype(np.uint8)
+            np.bitwise_or.at(self.closed, pkt_slot[ended], bits[ended])
+
+    def add_partial(self, part):
+        """Merge another table's `export()` into this one."""
+        self._fold_other(part["other"])
+        if len(part["bytes"]) == 0:
+            return
+
+        packed = np.ascontiguousarray(part["keys"]).view(KEY_DTYPE).ravel()
+        order = np.argsort(packed, kind="stable")
+        slots = self._slots(packed[order], part["keys"][order], part["init_lo"][order])
+
+        counts = {name: part[name][order] for name in COUNTERS}
+        # the other table may have seen the conversation start from the other end
+        flip = self.init_lo[slots] != part["init_lo"][order]
+        if flip.any():
+            counts["rev_bytes"] = np.where(flip, counts["bytes"] - counts["rev_bytes"], counts["rev_bytes"])
+            counts["rev_packets"] = np.where(flip, counts["packets"] - counts["rev_packets"], counts["rev_packets"])
+        self._accumulate(slots, counts, part["first_seen"][order], part["last_seen"][order])
+
+        closed = part["closed"][order]
+        swapped = (closed & CLOSED_RST) | ((closed & CLOSED_FIN_FWD) << 1) | ((closed & CLOSED_FIN_REV) >> 1)
+        self.closed[slots] |= np.where(flip, swapped, closed).astype(np.uint8)
+
+    def _lookup(self, uniq):
+        pos = np.searchsorted(self.index_keys, uniq)
+        known = np.zeros(len(uniq), dtype=bool)
+        inside = pos < len(self.index_keys)
+        known[inside] = self.index_keys[pos[inside]] == uniq[inside]
+        return pos, known
+
+    def _slots(self, uniq, raw_keys, init_lo):
+        # uniq: sorted, distinct packed keys; the other arrays are aligned with it.
+        # Returns the slot of every key, allocating slots for unseen ones.
+        pos, known = self._lookup(uniq)
+        n_new = int((~known).sum())
+
+        overflow = self.size + n_new - self.max_flows
+        if overflow > 0:
+            self._evict(overflow)
+            pos, known = self._lookup(uniq)
+            n_new = int((~known).sum())
+        fresh = ~known
+
+        slots = np.empty(len(uniq), dtype=np.int64)
+        slots[known] = self.index_slots[pos[known]]
+        slots[fresh] = np.arange(self.size, self.size + n_new)
+
+        size = self.size + n_new
+        if size > self.capacity:
+            self._grow(size)
+        self.size = size
+
+        if n_new:
+            # uniq is sorted, so inserting at the searchsorted positions keeps the index sorted
+            self.index_keys = np.insert(self.index_keys, pos[fresh], uniq[fresh])
+            self.index_slots = np.insert(self.index_slots, pos[fresh], slots[fresh])
+
+        new = slots[fresh]
+        self.keys[new] = raw_keys[fresh]
+        self.init_lo[new] = init_lo[fresh]
+        self.closed[new] = 0
+        self.first_seen[new] = np.inf
+        self.last_seen[new] = -np.inf
+        return slots
+
+    def _accumulate(self, slots, counts, lo, hi):
+        for name in COUNTERS:
+            getattr(self, name)[slots] += counts[name].astype(np.int64)
+        self.first_seen[slots] = np.minimum(self.first_seen[slots], lo)
+        self.last_seen[slots] = np.maximum(self.last_seen[slots], hi)
+
+    def _evict(self, count):
+        """Fold at least `count` of the smallest flows into the "other" record to make room."""
+        n = self.size
+        # evict a sixteenth of the table at a time so a flood doesn't pay for a selection per batch
+        count = min(max(count, self.max_flows // 16), n)
+        if count <= 0:
+            return
+
+        # fewest packets first, least recently seen among equals
+        last = self.last_seen[:n]
+        recency = (last - last.min()) / (np.ptp(last) + 1.0)
+        score = self.packets[:n] + np.nan_to_num(recency)
+        victims = np.argpartition(score, count - 1)[:count]
+
+        folded = {name: int(getattr(self, name)[victims].sum()) for name in COUNTERS}
+        folded["first_seen"] = float(self.first_seen[victims].min())
+        folded["last_seen"] = float(last[victims].max())
+        self._fold_other(folded)
+        self.evictions += count
+
+        drop = np.zeros(n, dtype=bool)
+        drop[victims] = True
+        self._remove(drop)
+
+    def _fold_other(self, other):
+        for name in COUNTERS:
+            self.other[name] += other[name]
+        self.other["first_seen"] = min(self.other["first_seen"], other["first_seen"])
+        self.other["last_seen"] = max(self.other["last_seen"], other["last_seen"])
+
+    def take_other(self):
+        """The "other" record (all evicted flows) as a list of zero or one rows, then reset it."""
+        rows = other_rows(self.other)
+        self._reset_other()
+        return rows
+
+    def _remove(self, drop):
+        """Compact the live flows not in the `drop` mask and rebuild the index."""
+        n = self.size
+        keep = ~drop
+        k = int(keep.sum())
+        for arr in self._arrays():
+            arr[:k] = arr[:n][keep]
+            # freed slots are handed out again with counters expected at zero
+            arr[k:n] = 0
+        self.size = k
+
+        packed = self.keys[:k].view(KEY_DTYPE).ravel()
+        order = np.argsort(packed, kind="stable")
+        self.index_keys = packed[order].copy()
+        self.index_slots = order.astype(np.int64)
+
+    def _reset_counters(self, idx):
+        for name in COUNTERS:
+            getattr(self, name)[idx] = 0
+        self.first_seen[idx] = np.inf
+
+    def expire(self, now):
+        """Every flow that finished or hit the active timeout since the last call.
+
+        Returned as an `export()`-style dict (format it with `format_rows`),
+        so a burst of thousands of finished flows costs arrays, not Python
+        tuples, until the caller writes them out in chunks. Finished flows
+        (TCP closed, idle) are removed; long-lived ones stay in the table
+        with their counters reset, so each record covers
+        first_seen..last_seen. Flows evicted under memory pressure since the
+        last call are in `other`.
+        """
+        n = self.size
+        last = self.last_seen[:n]
+        closed = self.closed[:n]
+        torn_down = ((closed & CLOSED_RST) > 0) | ((closed & (CLOSED_FIN_FWD | CLOSED_FIN_REV)) ==
+                                                   (CLOSED_FIN_FWD | CLOSED_FIN_REV))
+        has = self.packets[:n] > 0
+        done = (now - last >= self.idle_timeout) | (torn_down & (now - last >= CLOSE_LINGER))
+        active = has & ~done & (now - self.first_seen[:n] >= self.active_timeout)
+
+        part = self._select(np.flatnonzero((done & has) | active))
+        part["other"] = self.other
+        self._reset_other()
+
+        self._reset_counters(np.flatnonzero(active))
+        if done.any():
+            self._remove(done)
+        return part
+
+    def add_packets(self, packets):
+        if packets:
+            self.add_batch(batch_from_packets(packets))
+
+    def rows(self, slots=None):
+        """One tuple per flow in FLOW_FIELDS order, initiator first.
+
+        Defaults to every flow with packets since its last export, in
+        insertion order.
+        """
+        if slots is None:
+            slots = np.flatnonzero(self.packets[:self.size] > 0)
+        return format_rows(self._select(slots))
+
+    def _select(self, slots):
+        # fancy indexing copies, so the result outlives later updates
+        part = {
+            "keys": self.keys[slots],
+            "init_lo": self.init_lo[slots],
+            "closed": self.closed[slots],
+            "first_seen": self.first_seen[slots],
+            "last_seen": self.last_seen[slots],
+        }
+        for name in COUNTERS:
+            part[name] = getattr(self, name)[slots]
+        return part
+
+    def export(self):
+        """Copy of the live counters as plain arrays (picklable, for merging elsewhere)."""
+        part = self._select(np.arange(self.size))
+        part["other"] = dict(self.other)
+        return part
+
+    def clear(self):
+        # counters are zeroed in place so the arrays are reused across windows
+        n = self.size
+        for arr in self._arrays():
+            arr[:n] = 0
+        self.size = 0
+        self._reset_index()
+        self._reset_other()
+
+    def nbytes(self):
+        arrays = self._arrays() + [self.index_keys, self.index_slots]
+        return sum(a.nbytes for a in arrays)
@@ -0,0 +1,107 @@
+import os
+import queue
+
+import numpy as np
+
+from flow_table import FlowTable, KEY_BYTES, flow_hash
+
+# memory the agent may use for queued packets and open flows (the kernel
+# capture ring is extra and fixed in size)
+MEMORY_MB = int(os.environ.get("AGENT_MEMORY_MB", "256"))
+
+# of the budget; the rest is headroom for decoding batches and formatting exported rows
+QUEUE_SHARE = 0.25
+TABLE_SHARE = 0.5
+# rough upper bound on one queued item: a scapy packet dict, or a decoded ring block
+ITEM_BYTES = {"scapy": 1024, "batch": 1 << 20}
+# one flow slot plus its index entry, doubled for the copies made while growing
+FLOW_BYTES = 2 * (FlowTable(capacity=1).nbytes() + KEY_BYTES + 8)
+
+MAX_SAMPLING = 1024     # powers of two: the flows kept at 1-in-2N are a subset of those at 1-in-N
+HIGH_WATER = 0.5        # queue or table fuller than this: sample twice as sparsely
+LOW_WATER = 0.1         # both emptier than this: sample twice as densely
+
+class OverloadControl:
+    """Keep the agent inside a memory ceiling at any packet rate.
+
+    The capture -> aggregator queue and the flow table are sized from
+    `memory_mb`. Capture never blocks: when the queue is full the packets are
+    dropped and counted. When the queue or the table runs hot, flow-hash
+    sampling kicks in (keep a flow if hash % N == 0), doubling N each tick
+    until the pressure eases and halving it back afterwards. Sampling whole
+    flows keeps their TCP flags and ports intact; every kept packet carries
+    the rate, which ends up in each flow record's `sampling` field so the
+    backend can scale counts back up.
+
+    Counters for the capture side (`received`, `sampled_out`, `queue_drops`,
+    `kernel_drops`) are only written by the capture thread.
+    """
+
+    def __init__(self, memory_mb=MEMORY_MB, capture="scapy"):
+        budget = memory_mb * 1024 * 1024
+        self.memory_mb = memory_mb
+        self.queue = queue.Queue(maxsize=max(4, int(budget * QUEUE_SHARE) // ITEM_BYTES[capture]))
+        self.max_flows = max(1024, int(budget * TABLE_SHARE) // FLOW_BYTES)
+        self.rate = 1
+        self.received = 0
+        self.sampled_out = 0
+        self.queue_drops = 0
+        self.kernel_drops = 0
+
+    def make_table(self):
+        return FlowTable(max_flows=self.max_flows)
+
+    def keep_flow(self, key):
+        """Sampling decision for one scapy packet; `key` must be equal for both directions."""
+        self.received += 1
+        rate = self.rate
+        if rate > 1 and hash(key) & (rate - 1):
+            self.sampled_out += 1
+            return False
+        return True
+
+    def sample_batch(self, batch):
+        """The packets of `batch` that belong to sampled flows, tagged with the rate."""
+        n = len(batch["size"])
+        self.received += n
+        rate = self.rate
+        if rate > 1:
+            keep = (flow_hash(batch) & np.uint64(rate - 1)) == 0
+            batch = {k: v[keep] for k, v in batch.items()}
+            self.sampled_out += n - len(batch["size"])
+        batch["sampling"] = np.full(len(batch["size"]), rate, dtype=np.int64)
+        return batch
+
+    def offer(self, item, packets=1):
+        """Queue `item` without blocking the capture thread; count it as dropped if full."""
+        try:
+            self.queue.put_nowait(item)
+        except queue.Full:
+            self.queue_drops += packets
+
+    def pressure(self, table):
+        return max(self.queue.qsize() / self.queue.maxsize, len(table) / table.max_flows)
+
+    def adjust(self, table):
+        """Called once per aggregator tick: move the sampling rate with the pressure."""
+        pressure = self.pressure(table)
+        if pressure > HIGH_WATER and self.rate < MAX_SAMPLING:
+            self.rate *= 2
+        elif pressure < LOW_WATER and self.rate > 1:
+            self.rate //= 2
+
+    def stats(self, table):
+        return {
+            "sampling": self.rate,
+            "received": self.received,
+            "sampled_out": self.sampled_out,
+            "queue_drops": self.queue_drops,
+            "kernel_drops": self.kernel_drops,
+            "evicted_flows": table.evictions,
+            "queue_depth": self.queue.qsize(),
+            "queue_capacity": self.queue.maxsize,
+            "open_flows": len(table),
+            "max_flows": table.max_flows,
+            "table_mb": round(table.nbytes() / (1024 * 1024), 1),
+            "memory_mb": self.memory_mb,
+        }
@@ -1,10 +1,42 @@
-from scapy.all import sniff, IP
+from scapy.all import sniff, IP, TCP, UDP
 import time
 import queue
-from collections import defaultdict
 import threading
 
-packet_queue = queue.Queue()
+from sinks import make_sink
+from flow_table import format_rows, other_rows
+from overload import OverloadControl, MEMORY_MB
+from fast_capture import RingCapture, read_pcap_batches, batch_capture_available
+
+# how often finished flows are looked for; a flow's own timeouts decide when it is written
+EXPIRE_INTERVAL = 1
+EXPORT_CHUNK = 8192
+
+# bounded handoff between capture and aggregation: items are either one
+# packet dict (scapy path) or one decoded batch (batched capture path).
+# Both it and the flow table are sized by the memory ceiling; see configure().
+overload = OverloadControl()
+packet_queue = overload.queue
+flows = overload.make_table()
+
+# offline reads wait for the aggregator instead of dropping
+blocking_queue = False
+
+
+def configure(memory_mb=MEMORY_MB, capture="scapy", offline=False):
+    global overload, packet_queue, flows, blocking_queue
+    overload = OverloadControl(memory_mb, capture)
+    packet_queue = overload.queue
+    flows = overload.make_table()
+    blocking_queue = offline
+
+
+def enqueue(item, packets=1):
+    if blocking_queue:
+        packet_queue.put(item)
+    else:
+        overload.offer(item, packets)
+
 
 def handle_packet(pkt):
     if IP not in pkt:
@@ -17,75 +49,121 @@ def handle_packet(pkt):
         "proto": pkt[IP].proto,
         "size": len(pkt)
     }
+    if TCP in pkt:
+        packet.update(sport=pkt[TCP].sport, dport=pkt[TCP].dport, flags=int(pkt[TCP].flags))
+    elif UDP in pkt:
+        packet.update(sport=pkt[UDP].sport, dport=pkt[UDP].dport)
+
+    a = (packet["src"], packet.get("sport", 0))
+    b = (packet["dst"], packet.get("dport", 0))
+    if not overload.keep_flow((packet["proto"],) + ((a, b) if a <= b else (b, a))):
+        return
+    packet["sampling"] = overload.rate
 
-    packet_queue.put(packet)
-
-flows = defaultdict(lambda: {
-    "bytes": 0,
-    "packets": 0
-})
-import csv
-import os
-
-CSV_PATH = os.path.join(
-    os.path.dirname(__file__),
-    "..",
-    "data",
-    "flows.csv"
-)
-
-def flow_aggregator():
-    last_flush = time.time()
-
-    # Create CSV file + header once
-    file_exists = os.path.isfile(CSV_PATH)
-    with open(CSV_PATH, "a", newline="") as f:
-        writer = csv.writer(f)
-        if not file_exists:
-            writer.writerow([
-                "timestamp",
-                "src_ip",
-                "dst_ip",
-                "protocol",
-                "bytes",
-                "packets"
-            ])
+    enqueue(packet)
 
-    while True:
-        while not packet_queue.empty():
-            p = packet_queue.get()
-            key = (p["src"], p["dst"], p["proto"])
-            flows[key]["bytes"] += p["size"]
-            flows[key]["packets"] += 1
+def drain_queue(first, deadline, max_items=5000):
+    """Apply `first` plus whatever else is already queued, batching scapy packets."""
+    pending = []
+    item = first
+    for _ in range(max_items):
+        if isinstance(item["src"], str):
+            pending.append(item)
+        else:
+            flows.add_batch(item)
 
-        if time.time() - last_flush >= 5:
-            ts = int(time.time())
+        if time.time() >= deadline:
+            break
+        try:
+            item = packet_queue.get_nowait()
+        except queue.Empty:
+            break
 
-            if flows:
-                with open(CSV_PATH, "a", newline="") as f:
-                    writer = csv.writer(f)
-                    for (src, dst, proto), stats in flows.items():
-                        writer.writerow([
-                            ts,
-                            src,
-                            dst,
-                            proto,
-                            stats["bytes"],
-                            stats["packets"]
-                        ])
+    flows.add_packets(pending)
 
-                print(f"\n--- SAVED {len(flows)} FLOWS TO CSV ---")
-                flows.clear()
 
-            last_flush = time.time()
+def flow_aggregator(sink=None):
+    sink = sink or make_sink()
+    next_expire = time.time() + EXPIRE_INTERVAL
+
+    while True:
+        # wake on data or on the expiry tick, whichever comes first
+        try:
+            item = packet_queue.get(timeout=max(0.0, next_expire - time.time()))
+            drain_queue(item, next_expire)
+        except queue.Empty:
+            pass
+
+        now = time.time()
+        if now >= next_expire:
+            finished = flows.expire(now)
+            count = len(finished["bytes"])
+            # formatted a chunk at a time: a burst of finished flows must not
+            # turn into one huge list of Python tuples
+            for start in range(0, count, EXPORT_CHUNK):
+                sink.write(int(now), format_rows(finished, start, start + EXPORT_CHUNK))
+            other = other_rows(finished["other"])
+            if other:
+                sink.write(int(now), other)
+            if count or other:
+                print(f"\n--- SAVED {count + len(other)} FLOWS ({len(flows)} open) ---")
+
+            overload.adjust(flows)
+            stats = overload.stats(flows)
+            sink.write_stats(stats)
+            if stats["sampling"] > 1 or stats["queue_drops"] or stats["kernel_drops"]:
+                print(f"overload: 1-in-{stats['sampling']} sampling, {stats['queue_drops']} queue drops, "
+                      f"{stats['kernel_drops']} kernel drops, {stats['evicted_flows']} flows evicted")
+
+            next_expire = now + EXPIRE_INTERVAL
+
+
+def start_capture(mode="scapy", iface=None, pcap=None):
+    if mode == "batch" and pcap:
+        for batch in read_pcap_batches(pcap):
+            batch = overload.sample_batch(batch)
+            enqueue(batch, len(batch["size"]))
+        return
 
-        time.sleep(0.2)
+    if mode == "batch" and batch_capture_available():
+        ring = RingCapture(iface)
+        try:
+            for batch in ring.batches():
+                batch = overload.sample_batch(batch)
+                enqueue(batch, len(batch["size"]))
+                overload.kernel_drops += ring.stats()[1]
+        finally:
+            ring.close()
+        return
 
+    if mode == "batch":
+        print("Batched capture needs AF_PACKET; falling back to scapy")
 
-def start_capture():
-    sniff(prn=handle_packet, store=False)
+    if pcap:
+        sniff(offline=pcap, prn=handle_packet, store=False)
+    else:
+        sniff(iface=iface, prn=handle_packet, store=False)
 
 if __name__ == "__main__":
-    print("Packet agent started...")
+    import argparse
+
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--capture", choices=["scapy", "batch"], default="scapy",
+                        help="per-packet scapy callback, or batched AF_PACKET ring decoding")
+    parser.add_argument("--iface", default=None)
+    parser.add_argument("--pcap", default=None, help="read packets from a pcap file instead of live")
+    parser.add_argument("--memory-mb", type=int, default=MEMORY_MB,
+                        help="ceiling for queued packets and open flows (AGENT_MEMORY_MB)")
+    args = parser.parse_args()
+
+    configure(args.memory_mb, args.capture, offline=bool(args.pcap))
+    print(f"Packet agent started (memory ceiling {args.memory_mb} MB, "
+          f"queue {packet_queue.maxsize} items, {flows.max_flows} flows)...")
     threading.Thread(target=flow_aggregator, daemon=True).start()
-    start_capture()
+    start_capture(args.capture, args.iface, args.pcap)
+
+    if args.pcap:
+        # let the aggregator drain the queue and time out the remaining flows
+        while not packet_queue.empty():
+            time.sleep(0.2)
+        time.sleep(flows.idle_timeout + 2 * EXPIRE_INTERVAL)
@@ -0,0 +1,176 @@
+"""Multi-process capture agent: N workers with their own flow tables, merged per window.
+
+    python sharded_agent.py --workers 4 --iface eth0
+    python sharded_agent.py --workers 4 --pcap capture.pcap
+
+Live capture uses AF_PACKET fanout so the kernel spreads flows across the
+workers' rings (one per NIC queue / core); with --pcap every worker reads the
+file and keeps its hash partition of the flows. At each flush boundary every
+worker ships its partial table to the parent, which merges them and writes one
+window through the same sink packet_agent uses. Here every flow is reported
+once per window (the window is its active timeout) rather than when it ends.
+
+Each worker keeps its share of --memory-mb (AGENT_MEMORY_MB) with its own
+OverloadControl: a flow table sized from it, flow-hash sampling when the
+table runs hot, and counters the parent sums into the agent stats. Workers
+have no capture queue; their kernel ring is the buffer, and its drops are
+counted as kernel drops.
+"""
+import argparse
+import multiprocessing as mp
+import os
+import queue
+import time
+
+import numpy as np
+
+from fast_capture import RingCapture, read_pcap_batches
+from flow_table import FlowTable, flow_hash
+from overload import MEMORY_MB, OverloadControl
+from sinks import make_sink
+
+FLUSH_INTERVAL = 5
+# how often a worker moves its sampling rate, as packet_agent's expiry tick
+ADJUST_INTERVAL = 1
+
+
+def window_end(now):
+    # aligned to the wall clock so every worker agrees on window boundaries
+    return (int(now) // FLUSH_INTERVAL + 1) * FLUSH_INTERVAL
+
+
+def flow_shard(batch, workers):
+    """Stable worker id for every packet in a batch, from its canonical flow key.
+
+    Both directions of a conversation hash alike, so one worker sees the whole
+    bidirectional flow (the kernel's fanout hash is symmetric too).
+    """
+    return (flow_hash(batch) % np.uint64(workers)).astype(np.int64)
+
+
+def worker_overload(workers, memory_mb=MEMORY_MB):
+    """One worker's OverloadControl: an equal share of the agent's memory ceiling."""
+    return OverloadControl(max(1, memory_mb // workers), "batch")
+
+
+def worker(worker_id, workers, partials, iface=None, pcap=None, fanout_group=None, memory_mb=MEMORY_MB):
+    overload = worker_overload(workers, memory_mb)
+    table = overload.make_table()
+    deadline = window_end(time.time())
+    next_adjust = time.time() + ADJUST_INTERVAL
+
+    def flush_due(now):
+        nonlocal deadline, next_adjust
+        if now >= next_adjust:
+            overload.adjust(table)
+            next_adjust = now + ADJUST_INTERVAL
+        # one partial per window, empty or not, so the merger can tell when a window is complete
+        while now >= deadline:
+            partials.put((worker_id, deadline, table.export(), overload.stats(table)))
+            table.clear()
+            deadline += FLUSH_INTERVAL
+
+    if pcap:
+        for batch in read_pcap_batches(pcap):
+            mine = flow_shard(batch, workers) == worker_id
+            table.add_batch(overload.sample_batch({k: v[mine] for k, v in batch.items()}))
+            flush_due(time.time())
+
+        partials.put((worker_id, deadline, table.export(), overload.stats(table)))
+        partials.put((worker_id, None, None, None))
+        return
+
+    ring = RingCapture(iface, fanout_group=fanout_group)
+    for batch in ring.batches(idle_ms=200):
+        if batch is not None:
+            table.add_batch(overload.sample_batch(batch))
+            overload.kernel_drops += ring.stats()[1]
+        flush_due(time.time())
+
+
+def combined_stats(stats):
+    """The agent's overload stats from every worker's: counters add up, sampling is the sparsest."""
+    out = {}
+    for s in stats:
+        for key, value in s.items():
+            out[key] = max(out.get(key, 1), value) if key == "sampling" else out.get(key, 0) + value
+    if "table_mb" in out:
+        out["table_mb"] = round(out["table_mb"], 1)
+    out["workers"] = len(stats)
+    return out
+
+
+def merge_windows(partials, workers, sink, max_flows=None):
+    pending = {}
+    worker_stats = {}
+    done = 0
+    latest = 0
+    # room for every worker's flows, so the merge never folds what they kept
+    max_flows = max_flows or workers * worker_overload(workers).max_flows
+
+    def write(window):
+        table, _ = pending.pop(window)
+        rows = table.rows() + table.take_other()
+        if rows:
+            sink.write(window, rows)
+            print(f"\n--- SAVED {len(rows)} FLOWS (window {window}) ---")
+        if worker_stats:
+            stats = combined_stats(list(worker_stats.values()))
+            sink.write_stats(stats)
+            if stats["sampling"] > 1 or stats["kernel_drops"]:
+                print(f"overload: 1-in-{stats['sampling']} sampling, {stats['kernel_drops']} kernel drops, "
+                      f"{stats['evicted_flows']} flows evicted")
+
+    while done < workers:
+        try:
+            worker_id, window, part, stats = partials.get(timeout=FLUSH_INTERVAL)
+        except queue.Empty:
+            window = None
+        else:
+            if window is None:
+                done += 1
+            else:
+                worker_stats[worker_id] = stats
+                entry = pending.setdefault(window, [FlowTable(max_flows=max_flows), 0])
+                entry[0].add_partial(part)
+                entry[1] += 1
+                latest = max(latest, window)
+
+        # write complete windows in order; give up waiting on a window once it
+        # is two flushes behind (a worker died or stalled)
+        for w in sorted(pending):
+            if pending[w][1] >= workers or w <= latest - 2 * FLUSH_INTERVAL:
+                write(w)
+            else:
+                break
+
+    for w in sorted(pending):
+        write(w)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--workers", type=int, default=os.cpu_count())
+    parser.add_argument("--iface", default=None)
+    parser.add_argument("--pcap", default=None)
+    parser.add_argument("--memory-mb", type=int, default=MEMORY_MB,
+                        help="ceiling for all workers' open flows, split evenly (AGENT_MEMORY_MB)")
+    args = parser.parse_args()
+
+    partials = mp.Queue()
+    fanout_group = os.getpid() & 0xFFFF
+    procs = [
+        mp.Process(
+            target=worker,
+            args=(i, args.workers, partials, args.iface, args.pcap, fanout_group, args.memory_mb),
+            daemon=True,
+        )
+        for i in range(args.workers)
+    ]
+    for p in procs:
+        p.start()
+
+    share = worker_overload(args.workers, args.memory_mb)
+    print(f"Sharded agent started with {args.workers} workers "
+          f"({share.memory_mb} MB, {share.max_flows} flows each)...")
+    merge_windows(partials, args.workers, make_sink(), args.workers * share.max_flows)
@@ -0,0 +1,244 @@
+import csv
+import json
+import os
+import socket
+import time
+
+try:
+    import pyarrow as pa
+except ImportError:
+    pa = None
+
+DATA_DIR = os.path.join(os.path.dirname(__file__), "..", "data")
+
+CSV_PATH = os.path.join(DATA_DIR, "flows.csv")
+SEGMENT_DIR = os.path.join(DATA_DIR, "flow_segments")
+STATS_PATH = os.path.join(DATA_DIR, "agent_stats.json")
+
+# names this capture point; the backend partitions flows by it
+AGENT_ID = os.environ.get("AGENT_ID", socket.gethostname())
+
+# one row per exported flow record; the fields after `packets` follow
+# FlowTable.rows() (initiator -> responder, responder's share in rev_*).
+# Counts are as captured: under sampling each row stands for `sampling` times
+# as much traffic. `sensor` is the AGENT_ID of the agent that wrote the row.
+FLOW_COLUMNS = [
+    "timestamp", "src_ip", "dst_ip", "protocol", "bytes", "packets",
+    "src_port", "dst_port", "rev_bytes", "rev_packets",
+    "first_seen", "last_seen", "syn", "fin", "rst", "sampling", "sensor",
+]
+
+
+# rows of flows the arrow sink keeps: older segments are deleted once newer
+# ones hold this many (the backend reads no more than its storage.MAX_ROWS)
+SEGMENT_ROWS_KEPT = int(os.environ.get("SEGMENT_ROWS_KEPT", "5000"))
+
+# Windows refuses to replace a file another process has open; readers only
+# hold the small JSON files for a moment, so the rename is retried briefly
+REPLACE_RETRIES = 5
+
+
+def replace_file(tmp, path):
+    for attempt in range(REPLACE_RETRIES):
+        try:
+            os.replace(tmp, path)
+            return
+        except PermissionError:
+            if attempt == REPLACE_RETRIES - 1:
+                raise
+            time.sleep(0.05 * (attempt + 1))
+
+
+def write_stats_file(stats, path=STATS_PATH):
+    """Replace the agent's overload counters file (read by the backend for /api/agent)."""
+    tmp = path + ".tmp"
+    with open(tmp, "w") as f:
+        json.dump(stats, f)
+    replace_file(tmp, path)
+
+
+class CsvSink:
+    """Append each batch of exported flows to flows.csv."""
+
+    def __init__(self, path=CSV_PATH, sensor=AGENT_ID):
+        self.path = path
+        self.sensor = sensor
+
+        # a file written with an older column set is moved aside rather than
+        # appended to; readers treat the new file as a rotation
+        if os.path.isfile(self.path):
+            with open(self.path, newline="") as f:
+                header = next(csv.reader(f), None)
+            if header != FLOW_COLUMNS:
+                os.replace(self.path, f"{self.path}.{int(time.time())}.old")
+
+        # Create CSV file + header once
+        file_exists = os.path.isfile(self.path)
+        with open(self.path, "a", newline="") as f:
+            writer = csv.writer(f)
+            if not file_exists:
+                writer.writerow(FLOW_COLUMNS)
+
+    def write(self, ts, rows):
+        with open(self.path, "a", newline="") as f:
+            writer = csv.writer(f)
+            for row in rows:
+                writer.writerow((ts,) + tuple(row) + (self.sensor,))
+
+    def write_stats(self, stats):
+        write_stats_file(dict(stats, sensor=self.sensor))
+
+
+class ArrowSink:
+    """Write flows as typed Arrow IPC segments, one file per time partition.
+
+    Every flush appends a record batch to the current partition's segment, an
+    Arrow IPC stream kept open until the partition ends, so a segment is never
+    rewritten or renamed (Windows cannot replace a file the backend has open).
+    `manifest.json` lists each segment with its partition's time range, so
+    readers prune without opening the files; it is replaced atomically only
+    when a segment is added or deleted, and readers read a stream up to its
+    last complete batch. Segments beyond SEGMENT_ROWS_KEPT rows are deleted
+    as new ones start. A restart mid-partition starts a new segment for it.
+    """
+
+    def __init__(self, directory=SEGMENT_DIR, partition_seconds=60, sensor=AGENT_ID, rows_kept=SEGMENT_ROWS_KEPT):
+        if pa is None:
+            raise RuntimeError("pyarrow is required for the arrow flow sink")
+
+        self.directory = directory
+        self.sensor = sensor
+        self.partition_seconds = partition_seconds
+        self.rows_kept = rows_kept
+        self.schema = pa.schema([
+            ("timestamp", pa.int64()),
+            ("src_ip", pa.string()),
+            ("dst_ip", pa.string()),
+            ("protocol", pa.int16()),
+            ("bytes", pa.int64()),
+            ("packets", pa.int64()),
+            ("src_port", pa.int32()),
+            ("dst_port", pa.int32()),
+            ("rev_bytes", pa.int64()),
+            ("rev_packets", pa.int64()),
+            ("first_seen", pa.float64()),
+            ("last_seen", pa.float64()),
+            ("syn", pa.int32()),
+            ("fin", pa.int32()),
+            ("rst", pa.int32()),
+            ("sampling", pa.float64()),
+            ("sensor", pa.string()),
+        ])
+        self.manifest_path = os.path.join(directory, "manifest.json")
+        self.boot = int(time.time() * 1000)
+        self.partition = None
+        self.segment = None
+        self.rows = 0
+        self.file = None
+        self.writer = None
+        # deleted from the manifest but still open in a reader (Windows)
+        self.expired = []
+
+        os.makedirs(directory, exist_ok=True)
+        self.manifest = self._load_manifest()
+
+    def _load_manifest(self):
+        if not os.path.exists(self.manifest_path):
+            return {"version": 3, "partition_seconds": self.partition_seconds, "segments": []}
+        with open(self.manifest_path) as f:
+            return json.load(f)
+
+    def _save_manifest(self):
+        self.manifest["version"] = 3
+        tmp = self.manifest_path + ".tmp"
+        with open(tmp, "w") as f:
+            json.dump(self.manifest, f)
+        replace_file(tmp, self.manifest_path)
+
+    def _segment_name(self, partition):
+        # the boot id keeps a restarted agent off the segment it left behind
+        return f"flows-{partition}-{self.boot}.arrows"
+
+    def _start_partition(self, partition):
+        if self.segment is not None:
+            # sealed: its row count is final, and is what retention weighs
+            for seg in self.manifest["segments"]:
+                if seg["file"] == self.segment:
+                    seg["rows"] = self.rows
+        self.close()
+        self.partition = partition
+        self.segment = self._segment_name(partition)
+        self.rows = 0
+        self.file = pa.OSFile(os.path.join(self.directory, self.segment), "wb")
+        self.writer = pa.ipc.new_stream(self.file, self.schema)
+        self.manifest["segments"].append({
+            "file": self.segment,
+            "min_ts": partition,
+            "max_ts": partition + self.partition_seconds - 1,
+        })
+
+    def _retain(self):
+        # newest first, keep segments until they hold rows_kept rows; one left
+        # open by a crashed agent has no count and weighs nothing
+        kept = []
+        rows = 0
+        for seg in reversed(self.manifest["segments"]):
+            if rows < self.rows_kept:
+                kept.append(seg)
+                rows += self.rows if seg["file"] == self.segment else seg.get("rows", 0)
+            else:
+                self.expired.append(seg["file"])
+        kept.reverse()
+        self.manifest["segments"] = kept
+
+    def _delete_expired(self):
+        expired, self.expired = self.expired, []
+        for name in expired:
+            try:
+                os.remove(os.path.join(self.directory, name))
+            except FileNotFoundError:
+                pass
+            except PermissionError:
+                # the backend is reading it (Windows); tried again at the next partition
+                self.expired.append(name)
+
+    def close(self):
+        """End the current segment's stream."""
+        if self.writer is not None:
+            self.writer.close()
+            self.file.close()
+            self.writer = self.file = None
+
+    def write(self, ts, rows):
+        partition = ts - ts % self.partition_seconds
+        started = partition != self.partition
+        if started:
+            self._start_partition(partition)
+
+        columns = [[ts] * len(rows)] + [list(c) for c in zip(*rows)] + [[self.sensor] * len(rows)]
+        self.writer.write_batch(pa.record_batch([
+            pa.array(values, field.type) for values, field in zip(columns, self.schema)
+        ], schema=self.schema))
+        self.file.flush()
+        self.rows += len(rows)
+
+        # listed once its first batch is on disk; later appends leave the manifest alone
+        if started:
+            self._retain()
+            self._save_manifest()
+            self._delete_expired()
+
+    def write_stats(self, stats):
+        write_stats_file(dict(stats, sensor=self.sensor))
+
+
+def make_sink(kind=None):
+    kind = kind or os.environ.get("FLOW_FORMAT", "csv")
+    if kind == "csv":
+        return CsvSink()
+    if kind == "arrow":
+        return ArrowSink()
+    if kind == "push":
+        from transport import PushSink
+        return PushSink()
+    raise ValueError(f"unknown flow sink: {kind}")
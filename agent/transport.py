@@ -0,0 +1,223 @@
+import json
+import os
+import struct
+import threading
+import time
+import urllib.error
+import urllib.request
+import zlib
+from collections import deque
+
+import numpy as np
+
+from sinks import AGENT_ID, DATA_DIR, FLOW_COLUMNS
+
+INGEST_URL = os.environ.get("INGEST_URL", "http://127.0.0.1:8000/api/ingest")
+SPOOL_DIR = os.path.join(DATA_DIR, "spool")
+SPOOL_MB = int(os.environ.get("AGENT_SPOOL_MB", "64"))
+# must match the backend's INGEST_TOKEN when it sets one
+INGEST_TOKEN = os.environ.get("INGEST_TOKEN")
+
+MEDIA_TYPE = "application/vnd.nop.flows"
+MAGIC = b"NOPF"
+VERSION = 1
+
+# wire type of every column between `timestamp` and `sensor`; both are one
+# value per frame and travel in the header (`ts` and `agent`)
+WIRE_TYPES = {
+    "src_ip": "dict", "dst_ip": "dict", "protocol": "<u1", "bytes": "<i8", "packets": "<i8",
+    "src_port": "<u2", "dst_port": "<u2", "rev_bytes": "<i8", "rev_packets": "<i8",
+    "first_seen": "<f8", "last_seen": "<f8", "syn": "<i4", "fin": "<i4", "rst": "<i4",
+    "sampling": "<f8",
+}
+
+SEND_BYTES = 1 << 20     # frames per request are capped at about this much
+PENDING_MB = 16          # frames waiting for the sender; beyond this the oldest are dropped
+TIMEOUT = 5.0
+MAX_BACKOFF = 30.0
+
+
+def encode_frame(header, rows):
+    """One flow window as a compressed binary frame.
+
+    Layout: MAGIC, VERSION byte, then zlib(u32 header length, JSON header,
+    column buffers). The header carries the column names and types, and the
+    distinct values of string columns, which are sent as uint32 codes into
+    them. Numeric columns are raw little-endian arrays, `rows` long.
+    """
+    names = FLOW_COLUMNS[1:-1]
+    columns = list(zip(*rows)) if rows else [()] * len(names)
+    header = dict(header, rows=len(rows), columns=[[n, WIRE_TYPES[n]] for n in names], dictionaries={})
+
+    body = []
+    for name, values in zip(names, columns):
+        if WIRE_TYPES[name] == "dict":
+            values = list(values)
+            uniques = list(dict.fromkeys(values))
+            index = {v: i for i, v in enumerate(uniques)}
+            header["dictionaries"][name] = uniques
+            body.append(np.fromiter((index[v] for v in values), dtype="<u4", count=len(values)).tobytes())
+        else:
+            body.append(np.asarray(values, dtype=WIRE_TYPES[name]).tobytes())
+
+    meta = json.dumps(header, separators=(",", ":")).encode()
+    return MAGIC + bytes([VERSION]) + zlib.compress(struct.pack("!I", len(meta)) + meta + b"".join(body), 6)
+
+
+class PushSink:
+    """Push flow windows to the backend's ingest endpoint instead of a shared file.
+
+    `write` encodes the rows into a frame tagged with this agent's id, a boot
+    id and a sequence number, and hands it to a sender thread, so the
+    aggregator never waits on the network. The sender POSTs frames in order,
+    several per request; when the backend is unreachable the frames go to an
+    on-disk spool (at most AGENT_SPOOL_MB, oldest dropped first) that is
+    drained, oldest first, before anything new is sent. The backend drops
+    frames it has already seen, so a retry after a lost response is harmless.
+    INGEST_TOKEN, when set, is sent as a bearer token; a refused token keeps
+    the frames spooled rather than dropping them.
+    """
+
+    def __init__(self, url=INGEST_URL, agent_id=AGENT_ID, spool_dir=SPOOL_DIR, spool_mb=SPOOL_MB, token=INGEST_TOKEN):
+        self.url = url
+        self.headers = {"Content-Type": MEDIA_TYPE}
+        if token:
+            self.headers["Authorization"] = f"Bearer {token}"
+        self.agent_id = agent_id
+        self.boot = int(time.time() * 1000)
+        self.seq = 0
+        self.spool_dir = spool_dir
+        self.spool_bytes = spool_mb * 1024 * 1024
+        self.stats = None
+        self.sent_since_stats = False
+
+        self.pending = deque()
+        self.pending_bytes = 0
+        self.lock = threading.Lock()
+        self.ready = threading.Event()
+        self.counters = {"sent": 0, "spooled": 0, "dropped": 0, "failures": 0}
+
+        os.makedirs(spool_dir, exist_ok=True)
+        threading.Thread(target=self._sender, daemon=True).start()
+
+    def write(self, ts, rows):
+        self.seq += 1
+        header = {"agent": self.agent_id, "boot": self.boot, "seq": self.seq, "ts": ts, "stats": self.stats}
+        frame = encode_frame(header, rows)
+        self.sent_since_stats = True
+
+        with self.lock:
+            self.pending.append((self.seq, frame))
+            self.pending_bytes += len(frame)
+            while self.pending_bytes > PENDING_MB * 1024 * 1024:
+                _, old = self.pending.popleft()
+                self.pending_bytes -= len(old)
+                self.counters["dropped"] += 1
+        self.ready.set()
+
+    def write_stats(self, stats):
+        # rides on the next frame; a tick with no flows sends an empty frame as a heartbeat
+        self.stats = dict(stats, transport=dict(self.counters))
+        if not self.sent_since_stats:
+            self.write(int(time.time()), [])
+        self.sent_since_stats = False
+
+    def _post(self, frames):
+        body = b"".join(struct.pack("!I", len(f)) + f for f in frames)
+        req = urllib.request.Request(self.url, data=body, headers=self.headers)
+        with urllib.request.urlopen(req, timeout=TIMEOUT) as resp:
+            resp.read()
+
+    def _take_pending(self):
+        frames = []
+        size = 0
+        with self.lock:
+            while self.pending and size < SEND_BYTES:
+                seq, frame = self.pending.popleft()
+                self.pending_bytes -= len(frame)
+                frames.append((seq, frame))
+                size += len(frame)
+        return frames
+
+    def _spooled(self):
+        return sorted(f for f in os.listdir(self.spool_dir) if f.endswith(".nopf"))
+
+    def _spool(self, frames):
+        for seq, frame in frames:
+            path = os.path.join(self.spool_dir, f"{self.boot}-{seq:012d}.nopf")
+            with open(path + ".tmp", "wb") as f:
+                f.write(frame)
+            os.replace(path + ".tmp", path)
+            self.counters["spooled"] += 1
+
+        # bounded: the oldest spooled windows go first
+        files = self._spooled()
+        sizes = [os.path.getsize(os.path.join(self.spool_dir, f)) for f in files]
+        total = sum(sizes)
+        for name, size in zip(files, sizes):
+            if total <= self.spool_bytes:
+                break
+            os.remove(os.path.join(self.spool_dir, name))
+            total -= size
+            self.counters["dropped"] += 1
+
+    def _send(self, frames):
+        """POST `frames`; False if they should be retried later."""
+        try:
+            self._post(frames)
+        except urllib.error.HTTPError as e:
+            if e.code in (401, 403):
+                # a token mismatch is fixed by configuration, not by dropping the data
+                print(f"ingest refused the agent's token: HTTP {e.code}")
+                return False
+            if 400 <= e.code < 500:
+                # the backend will never accept these; retrying would wedge the spool
+                print(f"ingest rejected {len(frames)} frames: HTTP {e.code}")
+                self.counters["dropped"] += len(frames)
+                return True
+            return False
+        except OSError:
+            return False
+        self.counters["sent"] += len(frames)
+        return True
+
+    def _sender(self):
+        backoff = 0.5
+        while True:
+            spooled = self._spooled()
+            if spooled:
+                names, frames, size = [], [], 0
+                for name in spooled:
+                    with open(os.path.join(self.spool_dir, name), "rb") as f:
+                        frames.append(f.read())
+                    names.append(name)
+                    size += len(frames[-1])
+                    if size >= SEND_BYTES:
+                        break
+                if self._send(frames):
+                    for name in names:
+                        os.remove(os.path.join(self.spool_dir, name))
+                    backoff = 0.5
+                else:
+                    self._fail(self._take_pending(), backoff)
+                    backoff = min(backoff * 2, MAX_BACKOFF)
+                continue
+
+            batch = self._take_pending()
+            if not batch:
+                self.ready.wait(1.0)
+                self.ready.clear()
+                continue
+
+            if self._send([frame for _, frame in batch]):
+                backoff = 0.5
+            else:
+                self._fail(batch, backoff)
+                backoff = min(backoff * 2, MAX_BACKOFF)
+
+    def _fail(self, batch, backoff):
+        # keep ordering: whatever was in flight joins the spool behind older frames
+        self.counters["failures"] += 1
+        if batch:
+            self._spool(batch)
+        time.sleep(backoff)
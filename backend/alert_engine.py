@@ -1,8 +1,20 @@
+import numpy as np
+
+# thresholds for the rules that need per-flow ports and flags
+PORT_SCAN_PORTS = 100
+HALF_OPEN_FLOWS = 200
+
+# per-entity anomaly alerts per window at most, highest scores first
+MAX_ENTITY_ALERTS = 20
+FEATURE_LABELS = {"total_bytes": "bytes", "dst_ip_entropy": "destination entropy", "avg_fan_out": "fan-out"}
+
+
 def generate_alert(metrics, score):
     """Generate a list of alert dicts and attach metric snapshot (timestamp, bytes, throughput).
 
-    `metrics` should be a dict produced by `compute_metrics()` containing keys like
-    `timestamp`, `total_bytes`, `throughput_mbps`, `dst_ip_entropy`, `avg_fan_out`.
+    `metrics` should be a dict produced by `partitions.metrics_view()` containing keys like
+    `timestamp`, `total_bytes`, `throughput_mbps`, `dst_ip_entropy`, `avg_fan_out`, and
+    `max_dst_ports` / `half_open_flows` when the flows carry ports and flags.
     """
     alerts = []
 
@@ -51,4 +63,75 @@ def generate_alert(metrics, score):
             "throughput_mbps": metrics.get("throughput_mbps", None),
         })
 
+    # only present when the agent reports ports and TCP flags
+    if metrics.get("max_dst_ports", 0) > PORT_SCAN_PORTS:
+        alerts.append({
+            "severity": "high",
+            "reason": "Port scan",
+            "explanation": f"One source probed {metrics['max_dst_ports']} ports on a single host",
+            "timestamp": ts,
+            "total_bytes": bytes_,
+            "throughput_mbps": metrics.get("throughput_mbps", None),
+        })
+
+    if metrics.get("half_open_flows", 0) > HALF_OPEN_FLOWS:
+        alerts.append({
+            "severity": "high",
+            "reason": "Half-open connections",
+            "explanation": f"{metrics['half_open_flows']} TCP flows sent SYN with no reply (SYN flood or scan)",
+            "timestamp": ts,
+            "total_bytes": bytes_,
+            "throughput_mbps": metrics.get("throughput_mbps", None),
+        })
+
+    return alerts
+
+
+def explain_metrics(m):
+    """Plain-language reasons a window's metrics look suspicious, for /api/alerts/details."""
+    reasons = []
+    if m.get("dst_ip_entropy", 0) > 3.5:
+        reasons.append("High destination IP entropy suggests scanning or distributed sources.")
+    if m.get("avg_fan_out", 0) > 5:
+        reasons.append("High fan-out indicates many destinations from few sources (possible lateral spread).")
+    if m.get("throughput_mbps", 0) > 50:
+        reasons.append("Large throughput spike observed (possible exfiltration or bulk transfer).")
+    if m.get("max_dst_ports", 0) > PORT_SCAN_PORTS:
+        reasons.append("One source probed many ports on a single host (port scan).")
+    if m.get("half_open_flows", 0) > HALF_OPEN_FLOWS:
+        reasons.append("Many TCP flows sent SYN without any reply (SYN flood or scan).")
+    if not reasons:
+        reasons.append("No single clear cause; review top talkers and protocol mix.")
+    return reasons
+
+
+def entity_alerts(keys, kinds, X, scores, baselines, features, ts=None, limit=MAX_ENTITY_ALERTS):
+    """Alerts for the hosts and subnets that left their own baseline (score > 0.8).
+
+    Each names its entity and the feature furthest from that entity's usual
+    value; `baselines.baseline(key)` gives the (median, MAD) to compare with.
+    """
+    flagged = np.flatnonzero(np.asarray(scores) > 0.8)
+    flagged = flagged[np.argsort(-np.asarray(scores)[flagged], kind="stable")][:limit]
+
+    alerts = []
+    for i in flagged:
+        key, kind, x = keys[i], kinds[i], X[i]
+        usual = baselines.baseline(key)
+        if usual is None:
+            continue
+        median, mad = usual
+        worst = int(np.argmax(np.abs(x - median) / mad))
+        label = FEATURE_LABELS.get(features[worst], features[worst])
+        alerts.append({
+            "severity": "high",
+            "reason": f"Anomalous {kind} {key}",
+            "explanation": f"{label} {x[worst]:.4g}, usually {median[worst]:.4g} (score={scores[i]})",
+            "entity": key,
+            "entity_type": kind,
+            "score": float(scores[i]),
+            "timestamp": ts,
+            "total_bytes": int(x[features.index("total_bytes")]),
+            "throughput_mbps": float(round(x[features.index("total_bytes")] / 5 / (1024 * 1024), 3)),
+        })
     return alerts
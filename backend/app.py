@@ -1,17 +1,40 @@
-from fastapi import FastAPI, Depends
-from sqlalchemy.orm import Session
+from contextlib import asynccontextmanager
+from datetime import datetime
+from typing import List, Optional
+import json
+import os
+
+from fastapi import FastAPI, HTTPException, Query, Response
+from fastapi.encoders import jsonable_encoder
+from fastapi.responses import StreamingResponse
+from sqlalchemy import and_, or_, select
 from fastapi.middleware.cors import CORSMiddleware
 
 
 from database import SessionLocal, engine
 import models
 from ml_pipeline import run_pipeline
+from persistence import ensure_schema
+from offload import Offload
+
+# Create DB tables (and add columns missing from older databases)
+ensure_schema(engine)
+
+# blocking work runs on dedicated executors, never the shared threadpool:
+# a pipeline run cannot starve page reads and vice versa
+pipeline_runs = Offload("pipeline", workers=1)
+db_reads = Offload("db", workers=4, limit=8)
+
+
+@asynccontextmanager
+async def lifespan(app):
+    yield
+    pipeline_runs.shutdown()
+    db_reads.shutdown()
 
-# Create DB tables
-models.Base.metadata.create_all(bind=engine)
 
 # THIS VARIABLE NAME IS CRITICAL
-app = FastAPI(title="Network Observability Platform")
+app = FastAPI(title="Network Observability Platform", lifespan=lifespan)
 
 app.add_middleware(
     CORSMiddleware,
@@ -19,26 +42,186 @@ app.add_middleware(
     allow_credentials=True,
     allow_methods=["*"],
     allow_headers=["*"],
+    expose_headers=["X-Next-Cursor"],
 )
 
 
-# Dependency
-def get_db():
+def run_with_session(refit, streaming, workers):
     db = SessionLocal()
     try:
-        yield db
+        return run_pipeline(db, refit=refit, streaming=streaming, workers=workers)
     finally:
         db.close()
 
+
 @app.post("/run")
-def run(db: Session = Depends(get_db)):
-    run_pipeline(db)
-    return {"status": "pipeline executed"}
+async def run(refit: bool = False, streaming: bool = False,
+              workers: int = Query(1, ge=1, le=os.cpu_count() or 1)):
+    # reuses the saved model unless refit=true; streaming=true for files larger than memory.
+    # one run at a time, and identical concurrent calls wait on the same run
+    stats = await pipeline_runs.run(
+        run_with_session, refit, streaming, workers, key=(refit, streaming, workers)
+    )
+    return {"status": "pipeline executed", **stats}
+
+# ---------------- QUERIES ----------------
+
+PAGE_SIZE = 500
+MAX_PAGE_SIZE = 5000
+EXPORT_BATCH = 2000
+
+
+def columns_for(table, keys, fields):
+    """Selected columns for a comma-separated `fields`; the sort keys are always included."""
+    if not fields:
+        return list(table.columns)
+    names = [f.strip() for f in fields.split(",") if f.strip()]
+    unknown = [n for n in names if n not in table.c]
+    if unknown:
+        raise HTTPException(status_code=400, detail=f"unknown fields: {', '.join(unknown)}")
+    return [k for k in keys if k.name not in names] + [table.c[n] for n in names]
+
+
+def encode_cursor(row, keys):
+    return "|".join(str(row[k.name].isoformat() if k.name == "timestamp" else row[k.name]) for k in keys)
+
+
+def after_cursor(cursor, keys):
+    """Keyset condition: rows strictly after `cursor` in (timestamp[, id]) order."""
+    parts = cursor.split("|")
+    if len(parts) != len(keys):
+        raise HTTPException(status_code=400, detail="malformed cursor")
+    try:
+        values = [datetime.fromisoformat(p) if k.name == "timestamp" else int(p) for k, p in zip(keys, parts)]
+    except ValueError:
+        raise HTTPException(status_code=400, detail="malformed cursor")
+
+    if len(keys) == 1:
+        return keys[0] > values[0]
+    return or_(keys[0] > values[0], and_(keys[0] == values[0], keys[1] > values[1]))
+
+
+def split_values(values):
+    # accepts repeated params and comma-separated lists alike
+    return [v for item in values or [] for v in item.split(",") if v]
+
+
+def fetch_page(stmt, keys, limit):
+    """One keyset page as plain rows plus the cursor for the next page, on its own session."""
+    db = SessionLocal()
+    try:
+        rows = [dict(r) for r in db.execute(stmt.limit(limit + 1)).mappings()]
+    finally:
+        db.close()
+
+    next_cursor = None
+    if len(rows) > limit:
+        rows = rows[:limit]
+        next_cursor = encode_cursor(rows[-1], keys)
+    return jsonable_encoder(rows), next_cursor
+
+
+async def query_page(response, table, keys, filters, fields, cursor, limit, export, key):
+    """One keyset page, or the whole range streamed as a JSON array.
+
+    Rows come from a Core select over just the projected columns, so no ORM
+    objects are built. The cursor for the next page is in `X-Next-Cursor`.
+    Concurrent requests with the same `key` share one query.
+    """
+    cols = columns_for(table, keys, fields)
+    stmt = select(*cols).where(*filters).order_by(*keys)
+    if cursor:
+        stmt = stmt.where(after_cursor(cursor, keys))
+
+    if export:
+        return StreamingResponse(export_rows(stmt, keys), media_type="application/json")
+
+    rows, next_cursor = await db_reads.run(fetch_page, stmt, keys, limit, key=key)
+    if next_cursor:
+        response.headers["X-Next-Cursor"] = next_cursor
+    return rows
+
+
+def export_batch(stmt, keys, cursor, first):
+    """One keyset batch of the export as JSON text, plus the cursor after it (None at the end)."""
+    batch_stmt = stmt if cursor is None else stmt.where(after_cursor(cursor, keys))
+    db = SessionLocal()
+    try:
+        rows = [dict(r) for r in db.execute(batch_stmt.limit(EXPORT_BATCH)).mappings()]
+    finally:
+        db.close()
+    text = ",".join(json.dumps(jsonable_encoder(row)) for row in rows)
+    if rows and not first:
+        text = "," + text
+    return text, encode_cursor(rows[-1], keys) if len(rows) == EXPORT_BATCH else None
+
+
+async def export_rows(stmt, keys):
+    """Yield a JSON array in keyset-sized batches, holding one batch at a time.
+
+    Every batch is read on the db_reads executor, like a page, so a long
+    export neither blocks the event loop nor borrows the shared threadpool.
+    """
+    yield "["
+    cursor = None
+    first = True
+    while True:
+        text, cursor = await db_reads.run(export_batch, stmt, keys, cursor, first)
+        if text:
+            yield text
+            first = False
+        if cursor is None:
+            break
+    yield "]"
+
 
 @app.get("/metrics")
-def metrics(db: Session = Depends(get_db)):
-    return db.query(models.FlowWindow).all()
+async def metrics(
+    response: Response,
+    from_: Optional[datetime] = Query(None, alias="from"),
+    to: Optional[datetime] = None,
+    severity: Optional[List[str]] = Query(None),
+    fields: Optional[str] = None,
+    cursor: Optional[str] = None,
+    limit: int = Query(PAGE_SIZE, ge=1, le=MAX_PAGE_SIZE),
+    export: bool = False,
+):
+    table = models.FlowWindow.__table__
+    keys = [table.c.timestamp]
+    filters = []
+    if from_ is not None:
+        filters.append(table.c.timestamp >= from_)
+    if to is not None:
+        filters.append(table.c.timestamp <= to)
+    if severity:
+        filters.append(table.c.severity.in_(split_values(severity)))
+    key = ("metrics", from_, to, tuple(split_values(severity)), fields, cursor, limit)
+    return await query_page(response, table, keys, filters, fields, cursor, limit, export, key)
+
 
 @app.get("/alerts")
-def alerts(db: Session = Depends(get_db)):
-    return db.query(models.Alert).all()
+async def alerts(
+    response: Response,
+    from_: Optional[datetime] = Query(None, alias="from"),
+    to: Optional[datetime] = None,
+    severity: Optional[List[str]] = Query(None),
+    status: Optional[List[str]] = Query(None),
+    fields: Optional[str] = None,
+    cursor: Optional[str] = None,
+    limit: int = Query(PAGE_SIZE, ge=1, le=MAX_PAGE_SIZE),
+    export: bool = False,
+):
+    table = models.Alert.__table__
+    # id breaks timestamp ties so the cursor is unambiguous
+    keys = [table.c.timestamp, table.c.id]
+    filters = []
+    if from_ is not None:
+        filters.append(table.c.timestamp >= from_)
+    if to is not None:
+        filters.append(table.c.timestamp <= to)
+    if severity:
+        filters.append(table.c.severity.in_(split_values(severity)))
+    if status:
+        filters.append(table.c.status.in_(split_values(status)))
+    key = ("alerts", from_, to, tuple(split_values(severity)), tuple(split_values(status)), fields, cursor, limit)
+    return await query_page(response, table, keys, filters, fields, cursor, limit, export, key)
@@ -0,0 +1,101 @@
+"""Decode cost of pushed flow frames, and the limits a request is held to.
+
+    python bench_ingest.py [--rows 5000] [--frames 20]
+
+Frames are built with the agent's own encoder. The script times
+decode_frames on a request of `frames` frames of `rows` flows each, then
+checks that oversized requests are rejected with ValueError (a 400) before
+they cost memory (a decompressed-size budget used up exactly by the earlier
+frames must not let the next one inflate unbounded), and so are frames
+whose column list is not the flow record's. A batch turned away for bringing
+too many sensors must leave the buffer untouched.
+"""
+import argparse
+import json
+import os
+import struct
+import sys
+import time
+import zlib
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "agent"))
+
+from ingest import MAGIC, VERSION, IngestBuffer, decode_frames  # noqa: E402
+from transport import encode_frame  # noqa: E402
+
+
+def frame(seq, rows, agent="bench"):
+    header = {"agent": agent, "boot": 1, "seq": seq, "ts": 1_700_000_000 + seq, "stats": None}
+    row = ("10.0.0.1", f"10.0.{seq % 250}.2", 6, 1500, 3, 40000, 443, 900, 2, 0.0, 1.0, 1, 1, 0, 1.0)
+    return encode_frame(header, [row] * rows)
+
+
+def reframe(encoded, edit):
+    """`encoded` with its header's column list replaced by edit(columns)."""
+    payload = zlib.decompress(encoded[5:])
+    (size,) = struct.unpack_from("!I", payload)
+    header = json.loads(payload[4:4 + size])
+    header["columns"] = edit(header["columns"])
+    meta = json.dumps(header).encode()
+    return MAGIC + bytes([VERSION]) + zlib.compress(struct.pack("!I", len(meta)) + meta + payload[4 + size:])
+
+
+def body(*frames):
+    return b"".join(struct.pack("!I", len(f)) + f for f in frames)
+
+
+def rejected(payload, **kwargs):
+    try:
+        decode_frames(payload, **kwargs)
+    except ValueError as e:
+        return str(e)
+    return None
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--rows", type=int, default=5000)
+    parser.add_argument("--frames", type=int, default=20)
+    args = parser.parse_args()
+
+    request = body(*(frame(seq, args.rows) for seq in range(1, args.frames + 1)))
+    start = time.perf_counter()
+    decoded = decode_frames(request)
+    took = time.perf_counter() - start
+    rows = sum(len(df) for _, df in decoded)
+    print(f"decode: {len(request) / 1024:,.0f} KB, {rows:,} rows in {took * 1000:.1f} ms "
+          f"({rows / took:,.0f} rows/s)")
+
+    # the first frame uses up the budget exactly; the second must not inflate at all
+    first = frame(1, 100)
+    exact = decode_frames(body(first))[0][0]["decoded"]
+    bomb = MAGIC + bytes([VERSION]) + zlib.compress(b"\0" * (10 * 1024 * 1024))
+    reason = rejected(body(first, bomb), max_decoded=exact)
+    assert reason, "a frame after an exhausted budget was decoded without a limit"
+    print(f"budget used up exactly: rejected ({reason})")
+
+    reason = rejected(body(bomb), max_decoded=1024 * 1024)
+    assert reason, "a zip bomb was inflated past the limit"
+    print(f"zip bomb: rejected ({reason})")
+
+    # a header whose column list is not the flow record's
+    for label, edit in [
+        ("missing column", lambda cols: cols[:-1]),
+        ("extra column", lambda cols: cols + [["extra", "<i8"]]),
+        ("wrong type", lambda cols: [[n, "<f8" if n == "bytes" else w] for n, w in cols]),
+        ("repeated column", lambda cols: cols[:-1] + [cols[0]]),
+    ]:
+        reason = rejected(body(reframe(frame(1, 10), edit)))
+        assert reason, f"a frame with a {label} was accepted"
+        print(f"{label}: rejected ({reason})")
+
+    # a batch over MAX_SENSORS is refused whole, not applied up to the failing frame
+    buffer = IngestBuffer(max_sensors=1)
+    batch = decode_frames(body(frame(1, 10, agent="a"), frame(1, 10, agent="b")))
+    try:
+        buffer.accept_many(batch)
+        raise AssertionError("a batch with too many sensors was accepted")
+    except ValueError as e:
+        reason = str(e)
+    assert not buffer.agents and not buffer.partitions, "a refused batch left frames behind"
+    print(f"too many sensors: batch refused whole ({reason})")
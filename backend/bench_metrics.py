@@ -0,0 +1,105 @@
+"""Microbenchmark for the shared metrics kernel, and a cross-module agreement check.
+
+    python bench_metrics.py [--rows 10000 100000 1000000]
+
+The kernel is also run over per-(src, dst) totals weighted by flow count,
+as the dashboard runs it over a partition summary's edges, and must agree
+with the run over the rows.
+"""
+import argparse
+import math
+import time
+
+import numpy as np
+import pandas as pd
+
+from metrics import grouped_window_kernel
+from window_engine import SlidingWindow
+
+
+def reference_metrics(df):
+    """The pre-kernel implementation: value_counts loop and groupby-nunique."""
+    counts = df["dst_ip"].value_counts()
+    total = counts.sum()
+    entropy = 0.0
+    for c in counts:
+        p = c / total
+        entropy -= p * math.log2(p)
+    fanout = df.groupby("src_ip")["dst_ip"].nunique().mean()
+    return {
+        "total_bytes": int(df["bytes"].sum()),
+        "dst_ip_entropy": entropy,
+        "avg_fan_out": fanout,
+    }
+
+
+def reference_grouped(df):
+    """The pre-kernel ml_pipeline feature extraction (groupby + apply per window)."""
+    def entropy(series):
+        probs = series.value_counts(normalize=True)
+        return -np.sum(probs * np.log2(probs + 1e-9))
+
+    fan_out = df.groupby(["window", "src_ip"])["dst_ip"].nunique().groupby("window").mean()
+    dst_entropy = df.groupby("window")["dst_ip"].apply(entropy)
+    return fan_out, dst_entropy
+
+
+def synthetic_flows(rows, seed=3):
+    rng = np.random.default_rng(seed)
+    return pd.DataFrame({
+        "timestamp": np.sort(rng.integers(0, 5, rows)),
+        "src_ip": pd.Series(rng.zipf(1.4, rows) % 5000).map("10.1.{}".format).to_numpy(),
+        "dst_ip": pd.Series(rng.zipf(1.2, rows) % 100000).map("10.2.{}".format).to_numpy(),
+        "protocol": rng.choice([6, 17, 1], rows),
+        "bytes": rng.integers(60, 1500, rows),
+    })
+
+
+def timed(fn, *args):
+    start = time.perf_counter()
+    out = fn(*args)
+    return out, time.perf_counter() - start
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--rows", type=int, nargs="+", default=[10_000, 100_000, 1_000_000])
+    args = parser.parse_args()
+
+    for rows in args.rows:
+        df = synthetic_flows(rows)
+
+        ref, t_ref = timed(reference_metrics, df)
+        g, t_kernel = timed(grouped_window_kernel, np.zeros(rows, dtype=np.int64), df["src_ip"], df["dst_ip"], df["bytes"])
+        edges = df.groupby(["src_ip", "dst_ip"]).agg(bytes=("bytes", "sum"), flows=("bytes", "size")).reset_index()
+        e = grouped_window_kernel(np.zeros(len(edges), dtype=np.int64), edges["src_ip"], edges["dst_ip"],
+                                  edges["bytes"], flows=edges["flows"])
+
+        window = SlidingWindow(window=10)
+        window.add_many(df[["timestamp", "src_ip", "dst_ip", "bytes"]].itertuples(index=False, name=None))
+        w = window.metrics(now=4)
+
+        print(f"{rows:>9} rows | reference {t_ref:7.3f}s  kernel {t_kernel:7.3f}s  "
+              f"speedup {t_ref / t_kernel:5.1f}x")
+        for name, key in (("entropy", "dst_ip_entropy"), ("fan-out", "avg_fan_out")):
+            values = {
+                "reference": ref[key],
+                "kernel": g[key][0],
+                "edges": e[key][0],
+                "sliding": window.entropy() if key == "dst_ip_entropy" else window.fan_out(),
+            }
+            spread = max(values.values()) - min(values.values())
+            print(f"          {name:>8}: " + "  ".join(f"{n}={v:.6f}" for n, v in values.items())
+                  + f"  max diff {spread:.2e}")
+        # many small windows, as in ml_pipeline over a long capture
+        df["window"] = np.arange(rows) // 200
+        (ref_fan, ref_ent), t_ref_g = timed(reference_grouped, df)
+        gk, t_grouped = timed(grouped_window_kernel, df["window"], df["src_ip"], df["dst_ip"], df["bytes"])
+        print(f"          {rows // 200} windows: reference {t_ref_g:7.3f}s  grouped kernel {t_grouped:7.3f}s  "
+              f"speedup {t_ref_g / t_grouped:5.1f}x  "
+              f"max fan-out diff {np.abs(ref_fan.to_numpy() - gk['avg_fan_out']).max():.2e}  "
+              f"max entropy diff {np.abs(ref_ent.to_numpy() - gk['dst_ip_entropy']).max():.2e} (old 1e-9 epsilon)")
+
+        assert ref["total_bytes"] == int(g["total_bytes"][0]) == int(e["total_bytes"][0]) == w["total_bytes"]
+        assert abs(g["dst_ip_entropy"][0] - e["dst_ip_entropy"][0]) < 1e-9 and g["avg_fan_out"][0] == e["avg_fan_out"][0]
+        assert g["conn_count"][0] == e["conn_count"][0] == rows
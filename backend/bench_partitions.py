@@ -0,0 +1,96 @@
+"""Window aggregation cost against the number of sensors.
+
+    python bench_partitions.py [--sensors 1 10 50] [--rows 2000] [--workers 4]
+
+Each sensor contributes `rows` synthetic flows. For every sensor count the
+window is aggregated three ways: all partitions summarized inline, all
+summarized on a process pool, and the steady state where only `--changed`
+sensors sent anything since the last window (the rest come from the cache).
+The merged network-wide metrics are checked against an exact summary of
+all flows at once: equal, or within 5% with METRICS_MODE=sketch, where
+the merged graph summary must also stay within its edge cap.
+"""
+import argparse
+import time
+
+import numpy as np
+import pandas as pd
+
+from metrics import METRICS_MODE
+from partitions import SKETCH_EDGES, WINDOWS, PartitionAggregator, merge, metrics_view, summarize, views
+
+
+def sensor_flows(rng, rows, sensor):
+    return pd.DataFrame({
+        "timestamp": np.full(rows, 1_700_000_000),
+        "src_ip": pd.Series(rng.zipf(1.4, rows) % 500).map(f"10.{sensor % 250}.0.{{}}".format).to_numpy(),
+        "dst_ip": pd.Series(rng.zipf(1.2, rows) % 5000).map("10.200.{}".format).to_numpy(),
+        "protocol": rng.choice([6, 17, 1], rows),
+        "bytes": rng.integers(60, 1500, rows),
+        "packets": rng.integers(1, 20, rows),
+        "src_port": rng.integers(1024, 65536, rows),
+        "dst_port": rng.integers(1, 1024, rows),
+        "rev_bytes": rng.integers(0, 1500, rows),
+        "rev_packets": rng.integers(0, 5, rows),
+        "first_seen": np.zeros(rows),
+        "last_seen": rng.random(rows),
+        "syn": rng.integers(0, 2, rows),
+        "fin": np.zeros(rows, dtype=np.int64),
+        "rst": np.zeros(rows, dtype=np.int64),
+        "sampling": np.ones(rows),
+        "sensor": f"sensor-{sensor}",
+    })
+
+
+def window(aggregator, partitions):
+    sensors, _ = aggregator.run(partitions)
+    merged = {w: merge(s[w] for _, s, _ in sensors.values()) for w in WINDOWS}
+    return views(merged), len(merged["graph"]["edges"])
+
+
+def timed(fn, *args):
+    start = time.perf_counter()
+    out = fn(*args)
+    return out, (time.perf_counter() - start) * 1000
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--sensors", type=int, nargs="+", default=[1, 10, 50])
+    parser.add_argument("--rows", type=int, default=2000)
+    parser.add_argument("--workers", type=int, default=4)
+    parser.add_argument("--changed", type=int, default=5)
+    args = parser.parse_args()
+
+    rng = np.random.default_rng(7)
+    pool = PartitionAggregator(workers=args.workers, pool_min=2)
+    window(pool, {s: (0, sensor_flows(rng, args.rows, s)) for s in range(2)})  # start the workers
+
+    for n in args.sensors:
+        frames = {s: sensor_flows(rng, args.rows, s) for s in range(n)}
+        partitions = {s: (0, df) for s, df in frames.items()}
+
+        (merged, edges), t_inline = timed(window, PartitionAggregator(workers=1), partitions)
+        _, t_pool = timed(window, PartitionAggregator(workers=args.workers, pool_min=2), partitions)
+        pool.cache = {}
+        _, t_pool_warm = timed(window, pool, partitions)
+
+        # steady state: a few sensors have new flows
+        bumped = dict(partitions)
+        for s in range(min(args.changed, n)):
+            bumped[s] = (1, sensor_flows(rng, args.rows, s))
+        _, t_steady = timed(window, pool, bumped)
+
+        flows = pd.concat([df.tail(WINDOWS["metrics"]) for df in frames.values()])
+        ref = metrics_view(summarize(flows, mode="exact"))[0]
+        got = merged["metrics"][0]
+        if METRICS_MODE == "sketch":
+            assert all(abs(ref[k] - got[k]) <= 0.05 * abs(ref[k]) for k in ref if k != "timestamp"), (ref, got)
+            assert edges <= SKETCH_EDGES + 1, edges
+        else:
+            assert all(ref[k] == got[k] for k in ref if k != "timestamp"), (ref, got)
+
+        print(f"{n:>3} sensors  {edges:>6} edges  inline {t_inline:8.1f} ms  pool {t_pool:8.1f} ms (cold)  "
+              f"{t_pool_warm:8.1f} ms (warm)  {min(args.changed, n)} changed {t_steady:8.1f} ms")
+
+    pool.close()
@@ -0,0 +1,79 @@
+"""Time per-row ORM merge against the bulk upsert path for FlowWindow/Alert rows.
+
+    python bench_persistence.py [--windows 100000] [--merge-windows 5000]
+
+Uses a throwaway SQLite database (DATABASE_URL is set before the engine is
+created), so the real observability.db is untouched.
+"""
+import argparse
+import os
+import tempfile
+import time
+from datetime import datetime, timedelta
+
+tmp = tempfile.mkdtemp()
+os.environ["DATABASE_URL"] = f"sqlite:///{os.path.join(tmp, 'bench.db')}"
+
+import models  # noqa: E402
+from database import SessionLocal  # noqa: E402
+from persistence import ensure_schema, upsert_alerts, upsert_windows  # noqa: E402
+
+
+def make_rows(n, offset=0):
+    start = datetime(2024, 1, 1) + timedelta(seconds=5 * offset)
+    windows, alerts = [], []
+    for i in range(n):
+        ts = start + timedelta(seconds=5 * i)
+        severity = "high" if i % 20 == 0 else "normal"
+        windows.append({
+            "timestamp": ts, "total_bytes": 1e6 + i, "conn_count": 100 + i % 50,
+            "avg_fan_out": 2.0, "dst_ip_entropy": 4.0, "anomaly_score": 0.1, "severity": severity,
+        })
+        if severity != "normal":
+            alerts.append({
+                "alert_key": f"pipeline:{ts.isoformat()}", "timestamp": ts,
+                "severity": severity, "reason": "entropy=4.00, fanout=2.0",
+            })
+    return windows, alerts
+
+
+def merge_path(db, windows, alerts):
+    """The previous per-row path from run_pipeline."""
+    for w in windows:
+        db.merge(models.FlowWindow(**w))
+    for a in alerts:
+        db.add(models.Alert(timestamp=a["timestamp"], severity=a["severity"], reason=a["reason"]))
+    db.commit()
+
+
+def bulk_path(db, windows, alerts):
+    upsert_windows(db, windows)
+    upsert_alerts(db, alerts)
+    db.commit()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--windows", type=int, default=100_000)
+    parser.add_argument("--merge-windows", type=int, default=5_000)
+    args = parser.parse_args()
+
+    ensure_schema()
+    db = SessionLocal()
+
+    windows, alerts = make_rows(args.merge_windows, offset=10 ** 7)
+    t = time.perf_counter()
+    merge_path(db, windows, alerts)
+    merge = time.perf_counter() - t
+    print(f"merge: {len(windows)} windows in {merge:.2f}s "
+          f"(~{merge / len(windows) * args.windows:.0f}s for {args.windows})")
+
+    windows, alerts = make_rows(args.windows)
+    for run in ("insert", "rerun"):
+        t = time.perf_counter()
+        bulk_path(db, windows, alerts)
+        print(f"bulk {run}: {len(windows)} windows, {len(alerts)} alerts in {time.perf_counter() - t:.2f}s")
+
+    keyed = db.query(models.Alert).filter(models.Alert.alert_key.isnot(None)).count()
+    print(f"keyed alerts after two runs: {keyed} (expected {len(alerts)})")
+    db.close()
@@ -0,0 +1,95 @@
+"""Compare in-memory and streaming window feature extraction for run_pipeline.
+
+    python bench_pipeline.py [--rows 5000000] [--chunk-rows 500000] [--workers 4]
+
+Writes a synthetic time-ordered flows CSV, then runs each mode in its own
+process so peak RSS is measured separately, and checks that every mode
+produces the same window features.
+"""
+import argparse
+import os
+import subprocess
+import sys
+import tempfile
+import time
+
+import numpy as np
+import pandas as pd
+
+from ml_pipeline import PIPELINE_FEATURES, peak_rss_mb, stream_window_features, window_features
+
+
+def generate_flows(path, rows, flows_per_second=2000, seed=0):
+    rng = np.random.default_rng(seed)
+    written = 0
+    start = 1_700_000_000
+    with open(path, "w") as f:
+        f.write("timestamp,src_ip,dst_ip,protocol,bytes,packets\n")
+        while written < rows:
+            n = min(1_000_000, rows - written)
+            ts = start + (written + np.arange(n)) // flows_per_second
+            src = rng.integers(0, 500, n)
+            dst = rng.zipf(1.3, n) % 20000
+            pd.DataFrame({
+                "timestamp": ts,
+                "src_ip": ["10.0.%d.%d" % (s // 256, s % 256) for s in src],
+                "dst_ip": ["172.16.%d.%d" % (d // 256, d % 256) for d in dst],
+                "protocol": 6,
+                "bytes": rng.integers(40, 1500, n),
+                "packets": 1,
+            }).to_csv(f, header=False, index=False)
+            written += n
+
+
+def run_mode(path, mode, chunk_rows, workers, out):
+    t = time.perf_counter()
+    if mode == "memory":
+        features = window_features(pd.read_csv(path))
+    else:
+        features = stream_window_features(path, chunk_rows=chunk_rows, workers=workers)
+    elapsed = time.perf_counter() - t
+    features.to_pickle(out)
+    print(f"{mode:>10} workers={workers}: {len(features)} windows in {elapsed:.2f}s, peak RSS {peak_rss_mb()} MB")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--rows", type=int, default=5_000_000)
+    parser.add_argument("--chunk-rows", type=int, default=500_000)
+    parser.add_argument("--workers", type=int, default=4)
+    parser.add_argument("--mode", default=None, help=argparse.SUPPRESS)
+    parser.add_argument("--csv", default=None, help=argparse.SUPPRESS)
+    parser.add_argument("--out", default=None, help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.mode == "generate":
+        generate_flows(args.csv, args.rows)
+        sys.exit(0)
+    if args.mode:
+        run_mode(args.csv, args.mode, args.chunk_rows, args.workers, args.out)
+        sys.exit(0)
+
+    with tempfile.TemporaryDirectory() as tmp:
+        path = os.path.join(tmp, "flows.csv")
+        # in a child process too: ru_maxrss carries over from parent to child
+        subprocess.run([sys.executable, __file__, "--mode", "generate", "--csv", path,
+                        "--rows", str(args.rows)], check=True)
+        print(f"{args.rows} rows, {os.path.getsize(path) / 1e6:.0f} MB CSV")
+
+        results = {}
+        for mode, workers in [("memory", 1), ("streaming", 1), ("streaming", args.workers)]:
+            out = os.path.join(tmp, f"{mode}-{workers}.pkl")
+            subprocess.run(
+                [sys.executable, __file__, "--mode", mode, "--csv", path, "--out", out,
+                 "--chunk-rows", str(args.chunk_rows), "--workers", str(workers)],
+                check=True,
+            )
+            results[(mode, workers)] = pd.read_pickle(out)
+
+        reference = results[("memory", 1)]
+        for key, features in results.items():
+            same = features.index.equals(reference.index) and np.allclose(
+                features[PIPELINE_FEATURES].to_numpy(dtype=float),
+                reference[PIPELINE_FEATURES].to_numpy(dtype=float),
+            )
+            print(f"{key[0]} workers={key[1]} matches in-memory: {same}")
@@ -0,0 +1,69 @@
+"""Accuracy and speed of the sketch metrics mode against the exact path.
+
+    python bench_sketches.py [--rows 10000 100000 1000000]
+
+Two traffic shapes are generated: ordinary skewed traffic, and the same
+traffic with a scanner fanning out to many distinct destinations.
+"""
+import argparse
+import time
+
+import numpy as np
+import pandas as pd
+
+from partitions import metrics_view, summarize
+from sketches import TrafficSketch, HLL_ERROR
+
+
+def synthetic_flows(rows, scan=False, seed=1):
+    rng = np.random.default_rng(seed)
+    src = rng.zipf(1.3, rows) % 2000
+    dst = rng.zipf(1.2, rows) % 50000
+    if scan:
+        # a fifth of the rows: one host probing sequential addresses
+        k = rows // 5
+        src[:k] = 99999
+        dst[:k] = 100000 + np.arange(k)
+    return pd.DataFrame({
+        "timestamp": 0,
+        "src_ip": pd.Series(src).map("10.0.{}".format).to_numpy(),
+        "dst_ip": pd.Series(dst).map("172.16.{}".format).to_numpy(),
+        "protocol": 6,
+        "bytes": rng.integers(60, 1500, rows),
+        "packets": 1,
+    })
+
+
+def exact_top(df, n=5):
+    return df.groupby("src_ip")["bytes"].sum().sort_values(ascending=False).head(n).index.tolist()
+
+
+def timed(fn, *args, **kwargs):
+    start = time.perf_counter()
+    out = fn(*args, **kwargs)
+    return out, time.perf_counter() - start
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--rows", type=int, nargs="+", default=[10_000, 100_000, 1_000_000])
+    args = parser.parse_args()
+
+    print(f"HLL target error {HLL_ERROR:.1%}")
+    for scan in (False, True):
+        for rows in args.rows:
+            df = synthetic_flows(rows, scan)
+
+            (exact,), t_exact = timed(lambda: metrics_view(summarize(df, mode="exact")))
+            top_exact, t_top_exact = timed(exact_top, df)
+            sketch, t_sketch = timed(lambda: TrafficSketch().update(df))
+            top_sketch = [t["ip"] for t in sketch.top_talkers(5)["src"]]
+
+            fan_err = abs(sketch.fan_out() - exact["avg_fan_out"]) / max(exact["avg_fan_out"], 1e-9)
+            ent_err = abs(sketch.entropy() - exact["dst_ip_entropy"]) / max(exact["dst_ip_entropy"], 1e-9)
+            print(
+                f"{'scan' if scan else 'normal':>6} {rows:>9} rows | "
+                f"exact {t_exact + t_top_exact:7.3f}s  sketch {t_sketch:7.3f}s | "
+                f"fan-out err {fan_err:6.2%}  entropy err {ent_err:6.2%}  "
+                f"top-5 src overlap {len(set(top_exact) & set(top_sketch))}/5"
+            )
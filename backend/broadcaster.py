@@ -0,0 +1,37 @@
+import asyncio
+
+# queued in place of real messages when a subscriber fell behind; the stream
+# handler answers it with a full snapshot so the client can resync
+RESYNC = None
+
+
+class Broadcaster:
+    """Fan one already-encoded message out to every subscriber.
+
+    Each subscriber has a small bounded queue. A subscriber that cannot keep up
+    has its backlog dropped and replaced by a RESYNC marker instead of slowing
+    down publish or growing memory. Must be used from the event loop thread.
+    """
+
+    def __init__(self, max_queue=8):
+        self.max_queue = max_queue
+        self.subscribers = set()
+        self.dropped = 0
+
+    def subscribe(self):
+        q = asyncio.Queue(maxsize=self.max_queue)
+        self.subscribers.add(q)
+        return q
+
+    def unsubscribe(self, q):
+        self.subscribers.discard(q)
+
+    def publish(self, message):
+        for q in self.subscribers:
+            if q.full():
+                self.dropped += q.qsize()
+                while not q.empty():
+                    q.get_nowait()
+                q.put_nowait(RESYNC)
+                continue
+            q.put_nowait(message)
@@ -1,13 +1,32 @@
-from sqlalchemy import create_engine
+import os
+
+from sqlalchemy import create_engine, event
 from sqlalchemy.orm import sessionmaker, declarative_base
 
-DATABASE_URL = "sqlite:///./observability.db"
+DATABASE_URL = os.environ.get("DATABASE_URL", "sqlite:///./observability.db")
+
+IS_SQLITE = DATABASE_URL.startswith("sqlite")
 
 engine = create_engine(
     DATABASE_URL,
-    connect_args={"check_same_thread": False}
+    connect_args={"check_same_thread": False} if IS_SQLITE else {}
 )
 
+
+if IS_SQLITE:
+    @event.listens_for(engine, "connect")
+    def _sqlite_pragmas(dbapi_conn, _):
+        # WAL lets readers run alongside the pipeline's bulk writes; NORMAL
+        # sync is durable across app crashes and far cheaper than FULL
+        cur = dbapi_conn.cursor()
+        cur.execute("PRAGMA journal_mode=WAL")
+        cur.execute("PRAGMA synchronous=NORMAL")
+        cur.execute("PRAGMA temp_store=MEMORY")
+        cur.execute("PRAGMA cache_size=-65536")  # 64 MB
+        cur.execute("PRAGMA busy_timeout=5000")
+        cur.close()
+
+
 SessionLocal = sessionmaker(
     autocommit=False,
     autoflush=False,
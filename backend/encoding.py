@@ -0,0 +1,138 @@
+import gzip
+import hashlib
+import json
+
+from fastapi import Response
+
+try:
+    import msgpack
+except ImportError:
+    msgpack = None
+
+try:
+    import pyarrow as pa
+except ImportError:
+    pa = None
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+JSON = "application/json"
+COLUMNAR = "application/vnd.nop.columns+json"  # {"field": [values...], ...}
+MSGPACK = "application/msgpack"
+ARROW = "application/vnd.apache.arrow.stream"
+
+ALIASES = {"application/x-msgpack": MSGPACK}
+
+# bodies below this size are not worth compressing
+MIN_COMPRESS = 512
+
+
+def rows_from_columns(columns):
+    names = list(columns)
+    return [dict(zip(names, values)) for values in zip(*columns.values())]
+
+
+def negotiate(request, tabular=False):
+    """(media type, content coding) to answer `request` with.
+
+    Compact types are opt-in: the first one listed in Accept that this server
+    can produce wins, otherwise plain row JSON. Arrow is only offered for
+    tabular data (a dict of equal-length columns). Brotli is preferred over
+    gzip when installed and accepted.
+    """
+    offered = [COLUMNAR]
+    if msgpack is not None:
+        offered.append(MSGPACK)
+    if tabular and pa is not None:
+        offered.append(ARROW)
+
+    media = JSON
+    for part in request.headers.get("accept", "").split(","):
+        candidate = part.split(";")[0].strip().lower()
+        candidate = ALIASES.get(candidate, candidate)
+        if candidate in offered:
+            media = candidate
+            break
+
+    codings = {p.split(";")[0].strip().lower() for p in request.headers.get("accept-encoding", "").split(",")}
+    if brotli is not None and "br" in codings:
+        coding = "br"
+    elif "gzip" in codings:
+        coding = "gzip"
+    else:
+        coding = None
+    return media, coding
+
+
+def serialize(data, media, tabular=False):
+    if media == COLUMNAR:
+        return json.dumps(data, separators=(",", ":"), default=str).encode()
+    if media == MSGPACK:
+        return msgpack.packb(data, use_bin_type=True, default=str)
+    if media == ARROW:
+        table = pa.table(data)
+        # repeated strings (IPs) are sent once per batch
+        table = pa.table([
+            col.dictionary_encode() if pa.types.is_string(col.type) else col
+            for col in table.columns
+        ], names=table.column_names)
+        sink = pa.BufferOutputStream()
+        with pa.ipc.new_stream(sink, table.schema) as writer:
+            writer.write_table(table)
+        return sink.getvalue().to_pybytes()
+
+    if tabular:
+        data = rows_from_columns(data)
+    return json.dumps(data, separators=(",", ":"), default=str).encode()
+
+
+def encode(data, media, coding, tabular=False):
+    """Serialize and compress `data`; returns (body, content coding or None, etag)."""
+    body = serialize(data, media, tabular)
+    digest = hashlib.blake2b(body, digest_size=8).hexdigest()
+
+    if coding is None or len(body) < MIN_COMPRESS:
+        return body, None, f'"{digest}"'
+    if coding == "br":
+        body = brotli.compress(body, quality=5)
+    else:
+        body = gzip.compress(body, compresslevel=6)
+    # each coding is its own representation, so it gets its own tag
+    return body, coding, f'"{digest}-{coding}"'
+
+
+def respond(request, media, body, coding, etag):
+    """The encoded body, or 304 when the client already holds this representation."""
+    # no-cache: browsers keep the body but revalidate with If-None-Match every time
+    headers = {"ETag": etag, "Vary": "Accept, Accept-Encoding", "Cache-Control": "no-cache"}
+    cached = request.headers.get("if-none-match", "")
+    tags = {t.strip().removeprefix("W/") for t in cached.split(",")}
+    if etag in tags or "*" in tags:
+        return Response(status_code=304, headers=headers)
+
+    if coding:
+        headers["Content-Encoding"] = coding
+    return Response(content=body, media_type=media, headers=headers)
+
+
+class EncodedCache:
+    """Encoded responses for one snapshot, built once per representation.
+
+    Every poller of an unchanged window shares the same encoded, compressed
+    body. The cache empties itself when asked about a different snapshot.
+    """
+
+    def __init__(self):
+        self.owner = None
+        self.bodies = {}
+
+    def get(self, owner, key, build):
+        if owner is not self.owner:
+            self.owner = owner
+            self.bodies = {}
+        if key not in self.bodies:
+            self.bodies[key] = build()
+        return self.bodies[key]
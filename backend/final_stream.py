@@ -1,18 +1,58 @@
-from fastapi import FastAPI, Query
+from fastapi import FastAPI, HTTPException, Query, Request
 from fastapi.middleware.cors import CORSMiddleware
-from storage import load_recent_flows
-from metrics import compute_metrics
-from ml_engine import AnomalyDetector
-from alert_engine import generate_alert
-import pandas as pd
+from fastapi.responses import StreamingResponse
+from contextlib import asynccontextmanager
+from broadcaster import Broadcaster, RESYNC
+from offload import Offload
+from encoding import EncodedCache, JSON, encode, negotiate, respond, rows_from_columns
+from storage import load_partitions, flows_generation, load_agent_stats
+import ingest
+from partitions import PartitionAggregator, WINDOWS, entity_features, merge, views
+from ml_engine import make_detector, EntityBaselines, FEATURES, MIN_TRAINING, TRAINING_WINDOW
+from alert_engine import entity_alerts, generate_alert
+from history_store import get_store, open_stores, sensor_path, DATA_DIR
+from migrate_history import read_history_csv, to_rows
+import asyncio
+import json
 import os
 import time
-from typing import List, Dict
-
-detector = AnomalyDetector()
-training_buffer = []
-
-app = FastAPI()
+from typing import Optional
+
+detector = make_detector()
+# a baseline per source host and subnet, next to the detector's network-wide one
+entities = EntityBaselines()
+history = get_store()
+# per-sensor summaries, recomputed only for sensors with new flows
+aggregator = PartitionAggregator()
+
+# blocking work never runs on the shared threadpool: one thread computes
+# windows, a small pool serves history reads
+window_worker = Offload("window", workers=1)
+history_reads = Offload("history", workers=2, limit=4)
+
+
+@asynccontextmanager
+async def lifespan(app):
+    global window_wakeup
+    # pushed flows start the next window early instead of waiting out the interval
+    window_wakeup = asyncio.Event()
+    ingest.buffer.listeners.append(window_wakeup.set)
+    scheduler = asyncio.create_task(window_scheduler())
+    yield
+    scheduler.cancel()
+    ingest.buffer.listeners.remove(window_wakeup.set)
+    ingest.decode_worker.shutdown()
+    window_worker.shutdown()
+    history_reads.shutdown()
+    aggregator.close()
+    for store in open_stores():
+        store.flush()
+    detector.close()
+    entities.close()
+
+
+app = FastAPI(lifespan=lifespan)
+app.include_router(ingest.router)
 
 app.add_middleware(
     CORSMiddleware,
@@ -22,14 +62,8 @@ app.add_middleware(
     allow_headers=["*"],
 )
 
-@app.get("/api/metrics/latest")
-def get_latest_metrics():
-    df = load_recent_flows(rows=200)
-    metrics = compute_metrics(df)
-
-    if not metrics:
-        return []
-
+def record_window(metrics):
+    """Feed a freshly computed window to the detector and the history store."""
     m = metrics[0]
 
     features = [[
@@ -38,35 +72,42 @@ def get_latest_metrics():
         m["avg_fan_out"]
     ]]
 
-    training_buffer.append(features[0])
-
-    if len(training_buffer) >= 50 and not detector.trained:
-        detector.train(training_buffer)
+    # bounded training window; refits run in the background
+    detector.update(features[0])
 
-    # persist to history CSV for historical queries
+    # persist to the history store for historical queries
     try:
-        history_path = os.path.join(os.path.dirname(os.path.dirname(__file__)), "data", "metrics_history.csv")
-        os.makedirs(os.path.dirname(history_path), exist_ok=True)
-        # metrics is a list of dicts; append the latest row
-        if metrics and isinstance(metrics, list):
-            row = metrics[0].copy()
-            # ensure consistent columns
-            cols = ["timestamp", "total_bytes", "throughput_mbps", "dst_ip_entropy", "avg_fan_out"]
-            df_row = pd.DataFrame([{k: row.get(k, None) for k in cols}])
-            header = not os.path.exists(history_path)
-            df_row.to_csv(history_path, mode="a", header=header, index=False)
+        history.append(m)
     except Exception as e:
         print("Failed to persist metrics history:", e)
 
-    return metrics
 
+HISTORY_CSV = os.path.join(DATA_DIR, "metrics_history.csv")
 
-@app.get("/api/alerts")
-def get_alerts():
-    df = load_recent_flows(rows=200)
-    metrics = compute_metrics(df)
 
-    if not metrics or not detector.trained:
+def warm_start_detector():
+    """Restore the saved detector, or fit one from stored history on first boot."""
+    if entities.load():
+        print(f"Loaded baselines of {len(entities)} entities")
+
+    if detector.load():
+        print(f"Loaded {detector.name} detector")
+        return
+
+    # first boot after the CSV era: import the old history so there is something to fit on
+    if history.count() < MIN_TRAINING and os.path.exists(HISTORY_CSV):
+        for chunk in read_history_csv(HISTORY_CSV):
+            history.append_many(to_rows(chunk))
+
+    rows = history.range(limit=TRAINING_WINDOW)
+    X = [[r[f] for f in FEATURES] for r in rows if all(r[f] is not None for f in FEATURES)]
+    detector.bootstrap(X)
+    print(f"Bootstrapped {detector.name} detector from {len(X)} history rows")
+
+
+def score_window(metrics, flagged=()):
+    """The detector's and the rules' alerts for the window, plus `flagged` entity alerts."""
+    if not metrics or (not detector.trained and not flagged):
         return []
 
     m = metrics[0]
@@ -77,129 +118,374 @@ def get_alerts():
         m["avg_fan_out"]
     ]]
 
-    score = detector.score(features)
+    score = detector.score(features) if detector.trained else None
 
     alerts = generate_alert(
         m,
-        score
+        score or 0.0
     )
 
-    return {"alerts": alerts, "score": score}
+    return {"alerts": alerts + list(flagged), "score": score}
+
+
+# entity alerts of the last window with new flows, which an idle window
+# repeats, and the flows generation last fed to the detector and history
+window_state = {"alerts": [], "recorded": None}
+
+
+def score_entities(summary, ts):
+    """Score every source host and subnet of the window against its own baseline in one batch."""
+    keys, kinds, X = entity_features(summary)
+    if len(keys):
+        scores = entities.score_update(keys, X)
+        window_state["alerts"] = entity_alerts(keys, kinds, X, scores, entities, FEATURES, ts)
+    else:
+        window_state["alerts"] = []
+    return window_state["alerts"]
+
+
+def empty_topology():
+    return {"src_ip": [], "dst_ip": [], "bytes": []}
+
+
+def record_sensor_windows(sensors, updated):
+    """Append the metrics of sensors with new flows to their own history stores."""
+    for sensor in updated:
+        metrics = sensors[sensor][2]["metrics"]
+        if not metrics:
+            continue
+        try:
+            get_store(sensor).append(metrics[0])
+        except Exception as e:
+            print(f"Failed to persist metrics history of sensor {sensor}:", e)
+
+
+def build_snapshot(generation):
+    """Compute everything the dashboard endpoints serve, for the network and for each sensor.
+
+    Each sensor's newest flows are summarized on their own (in parallel, and
+    only when they changed); the network-wide sections are built from the
+    merged summaries, so their cost grows with the distinct edges seen, not
+    with the number of sensors. Every source host and subnet seen by the
+    sensors with new flows is then scored against its own baseline.
+    """
+    partitions = load_partitions(rows=max(WINDOWS.values()), generation=generation)
+    sensors, updated = aggregator.run(partitions)
+    record_sensor_windows(sensors, updated)
+
+    merged = {
+        window: merge(summaries[window] for _, summaries, _ in sensors.values())
+        for window in WINDOWS
+    }
+    snap = views(merged)
+    metrics = snap["metrics"]
+    # an idle tick recomputes the same flows: don't train on or store them twice
+    if metrics and (generation is None or generation != window_state["recorded"]):
+        record_window(metrics)
+        window_state["recorded"] = generation
+
+    # baselines only learn from new flows: the sensors that sent some, not
+    # the cached rows of idle ones, which would be fed again every window
+    flagged = window_state["alerts"]
+    if updated and metrics:
+        try:
+            fresh = merge(sensors[sensor][1]["graph"] for sensor in updated)
+            flagged = score_entities(fresh, metrics[0]["timestamp"])
+        except Exception as e:
+            print("entity scoring error:", e)
+
+    # the agents' sampling rates and drop counters: how much of the traffic the numbers saw
+    agents = load_agent_stats() or {}
+    snap.update(
+        generation=generation,
+        alerts=score_window(metrics, flagged),
+        agent=agents or None,
+        sensors={
+            sensor: dict(sections, generation=token, agent={sensor: agents[sensor]} if sensor in agents else None)
+            for sensor, (token, _, sections) in sensors.items()
+        },
+    )
+    return snap
 
 
-def protocol_stats(df: pd.DataFrame) -> List[Dict]:
-    if df is None or df.empty:
-        return []
-    try:
-        df = df.copy()
-        df["bytes"] = pd.to_numeric(df["bytes"], errors="coerce").fillna(0)
-        grouped = df.groupby("protocol")["bytes"].sum().sort_values(ascending=False)
-        return [{"protocol": p, "bytes": int(b)} for p, b in grouped.items()]
-    except Exception as e:
-        print("protocol_stats error:", e)
-        return []
+# one window is computed per interval in the background; handlers only read
+# the latest snapshot, so request latency never includes training or disk I/O
+WINDOW_INTERVAL = 5.0
+# pushed flows wake the scheduler early, but windows are never closer than this
+WINDOW_MIN_GAP = 1.0
 
+# set by ingest when new flows land; created per event loop in lifespan
+window_wakeup = None
 
-def top_talkers(df: pd.DataFrame, top_n: int = 5) -> Dict:
-    if df is None or df.empty:
-        return {"src": [], "dst": []}
-    try:
-        df = df.copy()
-        df["bytes"] = pd.to_numeric(df["bytes"], errors="coerce").fillna(0)
-        src = df.groupby("src_ip")["bytes"].sum().sort_values(ascending=False).head(top_n)
-        dst = df.groupby("dst_ip")["bytes"].sum().sort_values(ascending=False).head(top_n)
-        return {"src": [{"ip": i, "bytes": int(b)} for i, b in src.items()],
-                "dst": [{"ip": i, "bytes": int(b)} for i, b in dst.items()]}
-    except Exception as e:
-        print("top_talkers error:", e)
-        return {"src": [], "dst": []}
+latest = {
+    "snapshot": {
+        "generation": None,
+        "metrics": [],
+        "alerts": [],
+        "protocols": [],
+        "top_talkers": {"src": [], "dst": []},
+        "topology": empty_topology(),
+        "alert_details": {},
+        "agent": None,
+        "sensors": {},
+    }
+}
 
 
-def topology(df: pd.DataFrame) -> List[Dict]:
-    if df is None or df.empty:
-        return []
-    try:
-        df = df.copy()
-        df["bytes"] = pd.to_numeric(df["bytes"], errors="coerce").fillna(0)
-        edges = (
-            df.groupby(["src_ip", "dst_ip"])["bytes"].sum().reset_index()
-            .sort_values(by="bytes", ascending=False)
-        )
-        return [{"src_ip": r["src_ip"], "dst_ip": r["dst_ip"], "bytes": int(r["bytes"])} for _, r in edges.iterrows()]
-    except Exception as e:
-        print("topology error:", e)
-        return []
+# encoded bodies of the current snapshot, shared by every poller
+encoded = EncodedCache()
 
 
-def alert_details(df: pd.DataFrame) -> Dict:
-    """Return an explanation for why anomaly/alert happened using top IPs, entropy, fanout"""
-    if df is None or df.empty:
-        return {}
-    try:
-        metrics = compute_metrics(df)
-        m = metrics[0] if metrics else {}
-        top = top_talkers(df, top_n=3)
-        proto = protocol_stats(df)
-
-        reasons = []
-        if m.get("dst_ip_entropy", 0) > 3.5:
-            reasons.append("High destination IP entropy suggests scanning or distributed sources.")
-        if m.get("avg_fan_out", 0) > 5:
-            reasons.append("High fan-out indicates many destinations from few sources (possible lateral spread).")
-        if m.get("throughput_mbps", 0) > 50:
-            reasons.append("Large throughput spike observed (possible exfiltration or bulk transfer).")
-        if not reasons:
-            reasons.append("No single clear cause; review top talkers and protocol mix.")
-
-        return {
-            "metrics": m,
-            "top_talkers": top,
-            "protocols": proto[:8],
-            "explanations": reasons
-        }
-    except Exception as e:
-        print("alert_details error:", e)
-        return {}
+def current_snapshot():
+    return latest["snapshot"]
+
+
+def snapshot_section(snap, sensor):
+    """The whole network's sections, or one sensor's; 404 for a sensor with no flows."""
+    if sensor is None:
+        return snap
+    if sensor not in snap["sensors"]:
+        raise HTTPException(status_code=404, detail=f"no flows from sensor {sensor!r}")
+    return snap["sensors"][sensor]
+
+
+def snapshot_response(request, name, sensor=None, tabular=False):
+    """One snapshot section in the representation the client asked for, encoded once per window."""
+    snap = current_snapshot()
+    section = snapshot_section(snap, sensor)
+    media, coding = negotiate(request, tabular)
+    body = encoded.get(snap, (name, sensor, media, coding),
+                       lambda: encode(section[name], media, coding, tabular))
+    return respond(request, media, *body)
+
+
+# every dashboard endpoint takes ?sensor=<agent id> to narrow it to one capture point
+SENSOR = Query(None, description="agent id; omitted for the whole network")
+
+
+@app.get("/api/sensors")
+async def api_sensors():
+    """Sensors with flows in the current window, and the generation of each."""
+    return {name: s["generation"] for name, s in current_snapshot()["sensors"].items()}
+
+
+@app.get("/api/metrics/latest")
+async def get_latest_metrics(request: Request, sensor: Optional[str] = SENSOR):
+    return snapshot_response(request, "metrics", sensor)
+
+
+@app.get("/api/alerts")
+async def get_alerts(request: Request, sensor: Optional[str] = SENSOR):
+    return snapshot_response(request, "alerts", sensor)
 
 
 @app.get("/api/protocols")
-def api_protocols():
-    df = load_recent_flows(rows=1000)
-    return protocol_stats(df)
+async def api_protocols(request: Request, sensor: Optional[str] = SENSOR):
+    return snapshot_response(request, "protocols", sensor)
 
 
 @app.get("/api/top-talkers")
-def api_top_talkers():
-    df = load_recent_flows(rows=1000)
-    return top_talkers(df, top_n=5)
+async def api_top_talkers(request: Request, sensor: Optional[str] = SENSOR):
+    return snapshot_response(request, "top_talkers", sensor)
 
 
 @app.get("/api/topology")
-def api_topology():
-    df = load_recent_flows(rows=2000)
-    return topology(df)
+async def api_topology(request: Request, sensor: Optional[str] = SENSOR):
+    return snapshot_response(request, "topology", sensor, tabular=True)
 
 
 @app.get("/api/alerts/details")
-def api_alert_details():
-    df = load_recent_flows(rows=2000)
-    return alert_details(df)
+async def api_alert_details(request: Request, sensor: Optional[str] = SENSOR):
+    return snapshot_response(request, "alert_details", sensor)
+
+
+HISTORY_MAX_POINTS = 500
+
+
+def history_points(minutes, step, max_points, sensor=None):
+    # filter last N minutes based on timestamp in ms
+    now_ms = int(time.time() * 1000)
+    span = minutes * 60 * 1000
+    cutoff = now_ms - span
+    step_ms = max((step or 0) * 1000, -(-span // max_points))
+    store = history if sensor is None else get_store(sensor)
+    columns, _ = store.series(cutoff, now_ms, step_ms)
+    return columns
+
+
+def history_body(minutes, step, max_points, sensor, media, coding):
+    return encode(history_points(minutes, step, max_points, sensor), media, coding, tabular=True)
+
+
+@app.get("/api/agent")
+async def api_agent(request: Request, sensor: Optional[str] = SENSOR):
+    return snapshot_response(request, "agent", sensor)
 
 
 @app.get("/api/metrics/history")
-def api_metrics_history(minutes: int = Query(60, ge=1, le=24 * 60)):
-    history_path = os.path.join(os.path.dirname(os.path.dirname(__file__)), "data", "metrics_history.csv")
-    if not os.path.exists(history_path):
-        return []
+async def api_metrics_history(
+    request: Request,
+    minutes: int = Query(60, ge=1, le=30 * 24 * 60),
+    step: Optional[int] = Query(None, ge=1, description="bucket size in seconds"),
+    max_points: int = Query(HISTORY_MAX_POINTS, ge=10, le=5000),
+    sensor: Optional[str] = SENSOR,
+):
+    """Bucketed history of the last N minutes, at most `max_points` buckets.
+
+    Without `step` the bucket size is chosen from the range and `max_points`;
+    a `step` smaller than that is widened so the response stays bounded.
+    Concurrent identical requests share one query. Each sensor's history is
+    kept in its own store.
+    """
+    if sensor is not None and sensor not in current_snapshot()["sensors"] and not os.path.exists(sensor_path(sensor)):
+        raise HTTPException(status_code=404, detail=f"no history for sensor {sensor!r}")
+    media, coding = negotiate(request, tabular=True)
     try:
-        hdf = pd.read_csv(history_path)
-        if hdf.empty:
-            return []
-        # filter last N minutes based on timestamp in ms
-        now_ms = int(time.time() * 1000)
-        cutoff = now_ms - (minutes * 60 * 1000)
-        hdf = hdf[hdf["timestamp"] >= cutoff]
-        return hdf.to_dict(orient="records")
+        body = await history_reads.run(
+            history_body, minutes, step, max_points, sensor, media, coding,
+            key=(minutes, step, max_points, sensor, media, coding),
+        )
     except Exception as e:
         print("history read error:", e)
-        return []
+        body = encode([], JSON, None)
+        media = JSON
+    return respond(request, media, *body)
+
+
+# ---------------- PUSH STREAM ----------------
+
+STREAM_KEEPALIVE = 15.0
+
+stream = Broadcaster()
+# latest full-state event, sent to new subscribers and to ones that fell behind
+stream_state = {"full": None}
+# ?sensor= streams, {sensor: {"stream": Broadcaster, "full": event}}; opened
+# by a sensor's first subscriber and closed with its last
+sensor_streams = {}
+
+
+def sse(event, payload):
+    return f"event: {event}\ndata: {json.dumps(payload, separators=(',', ':'), default=str)}\n\n"
+
+
+def topology_delta(old, new):
+    prev = dict(zip(zip(old["src_ip"], old["dst_ip"]), old["bytes"]))
+    cur = dict(zip(zip(new["src_ip"], new["dst_ip"]), new["bytes"]))
+    return {
+        "upsert": [[s, d, b] for (s, d), b in cur.items() if prev.get((s, d)) != b],
+        "remove": [[s, d] for (s, d) in prev if (s, d) not in cur],
+    }
+
+
+def window_message(snap, prev):
+    """One compact delta for a new window: small sections in full, topology as a diff."""
+    return {
+        "generation": snap["generation"],
+        "metrics": snap["metrics"],
+        "alerts": snap["alerts"],
+        "protocols": snap["protocols"],
+        "top_talkers": snap["top_talkers"],
+        "alert_details": snap["alert_details"],
+        "agent": snap["agent"],
+        "topology": topology_delta(prev["topology"] if prev else empty_topology(), snap["topology"]),
+    }
+
+
+def compute_window():
+    return build_snapshot(flows_generation())
+
+
+def encode_window(snap, prev):
+    """The full and delta SSE messages for a new window (or one sensor's part of it), encoded off the event loop."""
+    full = {k: v for k, v in snap.items() if k != "sensors"}
+    full["topology"] = rows_from_columns(snap["topology"])
+    return sse("snapshot", full), sse("delta", window_message(snap, prev))
+
+
+async def publish_sensors(snap, prev):
+    """Deltas for the sensors someone is streaming, when their flows changed."""
+    for sensor, state in list(sensor_streams.items()):
+        cur = snap["sensors"].get(sensor)
+        old = prev["sensors"].get(sensor) if prev else None
+        if cur is None or (old is not None and cur["generation"] == old["generation"]):
+            continue
+        state["full"], delta = await window_worker.run(encode_window, cur, old)
+        state["stream"].publish(delta)
+
+
+async def window_scheduler():
+    """Compute, persist and score one window per WINDOW_INTERVAL, then publish it.
+
+    Runs at a fixed rate regardless of how many clients are polling; the
+    blocking work (flow parsing, aggregation, scoring, history appends)
+    happens on the dedicated window thread so the event loop stays free.
+    """
+    try:
+        await window_worker.run(warm_start_detector)
+    except Exception as e:
+        print("detector warm start failed:", e)
+
+    prev = None
+    loop = asyncio.get_running_loop()
+    next_run = loop.time()
+    while True:
+        started = loop.time()
+        window_wakeup.clear()
+        try:
+            snap = await window_worker.run(compute_window)
+            latest["snapshot"] = snap
+            if prev is None or snap["generation"] != prev["generation"]:
+                full, delta = await window_worker.run(encode_window, snap, prev)
+                stream_state["full"] = full
+                stream.publish(delta)
+                await publish_sensors(snap, prev)
+                prev = snap
+        except Exception as e:
+            print("window scheduler error:", e)
+
+        # fixed cadence: a slow window shortens the next sleep instead of drifting
+        next_run = max(next_run + WINDOW_INTERVAL, loop.time())
+        try:
+            await asyncio.wait_for(window_wakeup.wait(), next_run - loop.time())
+        except asyncio.TimeoutError:
+            continue
+        # woken by an ingest: run soon, and count the cadence from there
+        await asyncio.sleep(max(0.0, started + WINDOW_MIN_GAP - loop.time()))
+        next_run = loop.time()
+
+
+@app.get("/api/stream")
+async def api_stream(request: Request, sensor: Optional[str] = SENSOR):
+    """Server-sent events: a `snapshot` event on connect, then one `delta` per window."""
+    if sensor is None:
+        broadcaster, state = stream, stream_state
+    else:
+        section = snapshot_section(current_snapshot(), sensor)
+        if sensor not in sensor_streams:
+            full, _ = await window_worker.run(encode_window, section, None)
+            sensor_streams.setdefault(sensor, {"stream": Broadcaster(), "full": full})
+        state = sensor_streams[sensor]
+        broadcaster = state["stream"]
+    q = broadcaster.subscribe()
+
+    async def events():
+        try:
+            if state["full"]:
+                yield state["full"]
+            while not await request.is_disconnected():
+                try:
+                    msg = await asyncio.wait_for(q.get(), timeout=STREAM_KEEPALIVE)
+                except asyncio.TimeoutError:
+                    yield ": keepalive\n\n"
+                    continue
+                yield state["full"] if msg is RESYNC else msg
+        finally:
+            broadcaster.unsubscribe(q)
+            if sensor is not None and not broadcaster.subscribers and sensor_streams.get(sensor) is state:
+                del sensor_streams[sensor]
+
+    return StreamingResponse(
+        events(),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+    )
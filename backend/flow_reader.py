@@ -0,0 +1,137 @@
+import csv
+import os
+import threading
+from collections import deque
+from itertools import islice
+
+import pandas as pd
+
+NUMERIC_COLUMNS = {
+    "timestamp", "protocol", "bytes", "packets", "src_port", "dst_port",
+    "rev_bytes", "rev_packets", "first_seen", "last_seen", "syn", "fin", "rst", "sampling",
+}
+BLOCK_SIZE = 64 * 1024
+
+
+def _to_number(value):
+    try:
+        return int(value)
+    except ValueError:
+        try:
+            return float(value)
+        except ValueError:
+            return None
+
+
+class FlowTailReader:
+    """Follow an append-only flows CSV and keep its last `capacity` rows in memory.
+
+    Each refresh reads only the bytes appended since the previous one. On first
+    open, and after the file is rotated or truncated, the file is scanned
+    backwards from EOF just far enough to fill the ring, so the cost of a
+    refresh does not depend on how large the file has grown.
+    """
+
+    def __init__(self, path, capacity=5000):
+        self.path = path
+        self.capacity = capacity
+        self.rows = deque(maxlen=capacity)
+        self.columns = None
+        self.offset = 0
+        self.file_id = None
+        # bumped every time new rows land in the ring
+        self.generation = 0
+        self.lock = threading.Lock()
+
+    def _reset(self):
+        self.rows = deque(maxlen=self.capacity)
+        self.columns = None
+        self.offset = 0
+        self.file_id = None
+
+    def _parse(self, data):
+        lines = data.decode("utf-8", errors="replace").splitlines()
+        numeric = [c in NUMERIC_COLUMNS for c in self.columns]
+        added = 0
+        for rec in csv.reader(lines):
+            if len(rec) != len(self.columns):
+                continue
+            self.rows.append(tuple(
+                _to_number(v) if is_num else v
+                for v, is_num in zip(rec, numeric)
+            ))
+            added += 1
+        return added
+
+    def _consume(self, start, data):
+        # only complete lines are consumed; a half-written last row is
+        # picked up on the next refresh
+        end = data.rfind(b"\n")
+        if end < 0:
+            return 0
+        self.offset = start + end + 1
+        return self._parse(data[:end + 1])
+
+    def _open(self, f, size):
+        header = f.readline()
+        if not header.endswith(b"\n"):
+            return 0
+        self.columns = next(csv.reader([header.decode("utf-8").strip()]))
+        header_end = f.tell()
+
+        # walk back from EOF until the ring can be filled
+        pos = size
+        data = b""
+        while pos > header_end and data.count(b"\n") <= self.capacity:
+            step = min(BLOCK_SIZE, pos - header_end)
+            pos -= step
+            f.seek(pos)
+            data = f.read(step) + data
+
+        if pos > header_end:
+            # drop the partial line we landed in the middle of
+            cut = data.find(b"\n") + 1
+            pos += cut
+            data = data[cut:]
+
+        self.offset = header_end
+        return self._consume(pos, data)
+
+    def refresh(self):
+        """Pull newly appended rows into the ring. Returns the number of rows added."""
+        with self.lock:
+            try:
+                st = os.stat(self.path)
+            except FileNotFoundError:
+                self._reset()
+                return 0
+
+            file_id = (st.st_dev, st.st_ino)
+            reopen = file_id != self.file_id or st.st_size < self.offset
+
+            if not reopen and st.st_size == self.offset:
+                return 0
+
+            with open(self.path, "rb") as f:
+                if reopen:
+                    self._reset()
+                    added = self._open(f, st.st_size)
+                    if self.columns is not None:
+                        self.file_id = file_id
+                else:
+                    f.seek(self.offset)
+                    added = self._consume(self.offset, f.read(st.st_size - self.offset))
+
+            if added:
+                self.generation += 1
+            return added
+
+    def tail(self, rows):
+        """Return the last `rows` rows as a DataFrame, or None if nothing is buffered."""
+        with self.lock:
+            if not self.rows:
+                return None
+            n = min(rows, len(self.rows))
+            data = list(islice(self.rows, len(self.rows) - n, None))
+            columns = self.columns
+        return pd.DataFrame(data, columns=columns)
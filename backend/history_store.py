@@ -0,0 +1,282 @@
+import hashlib
+import os
+import re
+import sqlite3
+import threading
+import time
+
+import numpy as np
+
+DATA_DIR = os.path.join(os.path.dirname(os.path.dirname(__file__)), "data")
+HISTORY_DB = os.environ.get("HISTORY_DB", os.path.join(DATA_DIR, "metrics_history.db"))
+
+COLUMNS = ["timestamp", "total_bytes", "throughput_mbps", "dst_ip_entropy", "avg_fan_out"]
+METRICS = COLUMNS[1:]
+
+# rollup resolutions (ms); each keeps count/sum/min/max per metric per bucket
+ROLLUPS = [60_000, 300_000, 3_600_000]
+
+# pending rows are written in one transaction once either limit is reached
+BATCH_SIZE = 20
+FLUSH_INTERVAL = 10.0
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS metrics_history (
+    timestamp INTEGER PRIMARY KEY,
+    total_bytes INTEGER,
+    throughput_mbps REAL,
+    dst_ip_entropy REAL,
+    avg_fan_out REAL
+) WITHOUT ROWID
+"""
+
+# rows of the current batch, staged so duplicates can be dropped before they
+# reach the raw table or the rollups
+PENDING_SCHEMA = """
+CREATE TEMP TABLE IF NOT EXISTS pending (
+    timestamp INTEGER PRIMARY KEY,
+    total_bytes INTEGER,
+    throughput_mbps REAL,
+    dst_ip_entropy REAL,
+    avg_fan_out REAL
+)
+"""
+
+# per-metric rollup columns: non-null count, sum, min, max
+AGGREGATES = ["n", "sum", "min", "max"]
+
+# columns of a bucketed series: the average keeps the metric's own name
+SERIES_COLUMNS = ["timestamp", "count"] + [
+    f"{m}{suffix}" for m in METRICS for suffix in ("", "_min", "_max", "_sum")
+]
+
+
+def rollup_table(step):
+    return f"metrics_rollup_{step // 1000}s"
+
+
+def rollup_schema(step):
+    cols = ",\n    ".join(f"{m}_{a} {'INTEGER' if a == 'n' else 'REAL'}" for m in METRICS for a in AGGREGATES)
+    return f"""
+CREATE TABLE IF NOT EXISTS {rollup_table(step)} (
+    bucket INTEGER PRIMARY KEY,
+    n INTEGER,
+    {cols}
+) WITHOUT ROWID
+"""
+
+
+def aggregate_sql(source, step):
+    """SELECT producing rollup rows at `step` from raw rows or from a finer rollup table."""
+    if source in ("metrics_history", "pending"):
+        cols = ["COUNT(*)"] + [
+            f"COUNT({m}), SUM({m}), MIN({m}), MAX({m})" for m in METRICS
+        ]
+        ts = "timestamp"
+    else:
+        cols = ["SUM(n)"] + [
+            f"SUM({m}_n), SUM({m}_sum), MIN({m}_min), MAX({m}_max)" for m in METRICS
+        ]
+        ts = "bucket"
+    return f"SELECT ({ts} / {step}) * {step} AS b, {', '.join(cols)} FROM {source} WHERE {{where}} GROUP BY b"
+
+
+def rollup_upsert_sql(step):
+    # scalar min()/max() return NULL if either side is NULL, hence the coalesces
+    sets = ["n = n + excluded.n"]
+    for m in METRICS:
+        sets += [
+            f"{m}_n = {m}_n + excluded.{m}_n",
+            f"{m}_sum = coalesce({m}_sum + excluded.{m}_sum, {m}_sum, excluded.{m}_sum)",
+            f"{m}_min = coalesce(min({m}_min, excluded.{m}_min), {m}_min, excluded.{m}_min)",
+            f"{m}_max = coalesce(max({m}_max, excluded.{m}_max), {m}_max, excluded.{m}_max)",
+        ]
+    select = aggregate_sql("pending", step).format(where="true")
+    return f"INSERT INTO {rollup_table(step)} {select} ON CONFLICT(bucket) DO UPDATE SET {', '.join(sets)}"
+
+
+def _nullable(values):
+    return np.where(np.isnan(values), None, values).tolist()
+
+
+class HistoryStore:
+    """Per-window metrics history in SQLite, clustered on timestamp (ms).
+
+    The table is keyed on timestamp, so a range query is an index seek plus a
+    scan of just the rows it returns, however long the history grows. Appends
+    are buffered and committed in batches; reads flush the buffer first so
+    callers always see their own writes. Re-inserting an existing timestamp is
+    a no-op, which keeps imports idempotent.
+
+    Each committed batch is also folded into 1 min / 5 min / 1 h rollup
+    tables in the same transaction, so `series` can answer a wide range from
+    a few hundred pre-aggregated buckets instead of every raw row.
+    """
+
+    def __init__(self, path=HISTORY_DB, batch_size=BATCH_SIZE, flush_interval=FLUSH_INTERVAL):
+        self.path = path
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.pending = []
+        self.flushed_at = time.time()
+        self.lock = threading.Lock()
+
+        os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        self.conn = sqlite3.connect(path, check_same_thread=False)
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        self.conn.execute("PRAGMA synchronous=NORMAL")
+        self.conn.execute(SCHEMA)
+        self.conn.execute(PENDING_SCHEMA)
+        for step in ROLLUPS:
+            self.conn.execute(rollup_schema(step))
+        self.conn.commit()
+        self._backfill_rollups()
+
+    def _backfill_rollups(self):
+        # a store created before the rollups existed gets them built once
+        with self.conn:
+            for step in ROLLUPS:
+                table = rollup_table(step)
+                if self.conn.execute(f"SELECT 1 FROM {table} LIMIT 1").fetchone():
+                    continue
+                select = aggregate_sql("metrics_history", step).format(where="true")
+                self.conn.execute(f"INSERT INTO {table} {select}")
+
+    def _flush(self):
+        if self.pending:
+            with self.conn:
+                self.conn.executemany("INSERT OR IGNORE INTO pending VALUES (?, ?, ?, ?, ?)", self.pending)
+                self.conn.execute("DELETE FROM pending WHERE timestamp IN (SELECT timestamp FROM metrics_history)")
+                self.conn.execute("INSERT INTO metrics_history SELECT * FROM pending")
+                for step in ROLLUPS:
+                    self.conn.execute(rollup_upsert_sql(step))
+                self.conn.execute("DELETE FROM pending")
+            self.pending = []
+        self.flushed_at = time.time()
+
+    def append(self, row):
+        with self.lock:
+            self.pending.append(tuple(row.get(c) for c in COLUMNS))
+            if len(self.pending) >= self.batch_size or time.time() - self.flushed_at >= self.flush_interval:
+                self._flush()
+
+    def append_many(self, rows):
+        """Bulk insert of (timestamp, total_bytes, throughput_mbps, dst_ip_entropy, avg_fan_out) tuples."""
+        with self.lock:
+            self.pending.extend(rows)
+            self._flush()
+
+    def flush(self):
+        with self.lock:
+            self._flush()
+
+    def range(self, start_ms=None, end_ms=None, limit=None):
+        """Rows with start_ms <= timestamp <= end_ms, oldest first; with `limit`, only the newest `limit`."""
+        where = []
+        args = []
+        if start_ms is not None:
+            where.append("timestamp >= ?")
+            args.append(int(start_ms))
+        if end_ms is not None:
+            where.append("timestamp <= ?")
+            args.append(int(end_ms))
+
+        sql = f"SELECT {', '.join(COLUMNS)} FROM metrics_history"
+        if where:
+            sql += " WHERE " + " AND ".join(where)
+        if limit is not None:
+            # newest first through the index, then put back in time order
+            sql = f"SELECT * FROM ({sql} ORDER BY timestamp DESC LIMIT ?) ORDER BY timestamp"
+            args.append(int(limit))
+        else:
+            sql += " ORDER BY timestamp"
+
+        with self.lock:
+            self._flush()
+            rows = self.conn.execute(sql, args).fetchall()
+        return [dict(zip(COLUMNS, r)) for r in rows]
+
+    def series(self, start_ms, end_ms, step_ms):
+        """Bucketed history: one bucket per `step_ms` with avg/min/max/sum of every metric.
+
+        Reads the coarsest rollup whose resolution fits in the step (raw rows
+        below one minute); the step is rounded up to a multiple of that
+        resolution so every source bucket lands in exactly one output bucket.
+        Returns (columns, step_ms actually used), where columns maps each of
+        SERIES_COLUMNS to a list with one value per bucket (None where a
+        metric had no values).
+        """
+        step_ms = max(1, int(step_ms))
+        fitting = [r for r in ROLLUPS if r <= step_ms]
+        if fitting:
+            res = fitting[-1]
+            step_ms = -(-step_ms // res) * res
+            source, ts = rollup_table(res), "bucket"
+        else:
+            source, ts = "metrics_history", "timestamp"
+
+        lo = int(start_ms) // step_ms * step_ms
+        sql = aggregate_sql(source, step_ms).format(where=f"{ts} >= ? AND {ts} <= ?") + " ORDER BY b"
+
+        with self.lock:
+            self._flush()
+            rows = self.conn.execute(sql, (lo, int(end_ms))).fetchall()
+
+        if not rows:
+            return {c: [] for c in SERIES_COLUMNS}, step_ms
+
+        # NULL aggregates become NaN here and None again on the way out
+        a = np.array(rows, dtype=np.float64).reshape(len(rows), -1)
+        columns = {
+            "timestamp": a[:, 0].astype(np.int64).tolist(),
+            "count": a[:, 1].astype(np.int64).tolist(),
+        }
+        for i, m in enumerate(METRICS):
+            n, total, lo_v, hi_v = (a[:, 2 + 4 * i + j] for j in range(4))
+            avg = np.divide(total, n, out=np.full(len(a), np.nan), where=n > 0)
+            columns[m] = _nullable(np.round(avg, 3))
+            columns[f"{m}_min"] = _nullable(lo_v)
+            columns[f"{m}_max"] = _nullable(hi_v)
+            columns[f"{m}_sum"] = _nullable(total)
+        return columns, step_ms
+
+    def count(self):
+        with self.lock:
+            self._flush()
+            return self.conn.execute("SELECT COUNT(*) FROM metrics_history").fetchone()[0]
+
+    def close(self):
+        with self.lock:
+            self._flush()
+            self.conn.close()
+
+
+_stores = {}
+_store_lock = threading.Lock()
+
+
+def sensor_path(sensor):
+    """History file of one sensor, next to the global one: metrics_history.<sensor>.db.
+
+    Ids that are not short, plain lower-case file names ("a/b", "Host" on a
+    case-insensitive disk) get a hash of the raw id after a "~", which a
+    plain id cannot contain, so no two sensors share a file.
+    """
+    base, ext = os.path.splitext(HISTORY_DB)
+    name = re.sub(r"[^a-z0-9_.-]", "_", sensor.lower())[:64]
+    if name != sensor:
+        name += "~" + hashlib.sha1(sensor.encode()).hexdigest()[:10]
+    return f"{base}.{name}{ext}"
+
+
+def get_store(sensor=None):
+    """Process-wide store (the whole network's, or one sensor's), opened on first use."""
+    with _store_lock:
+        if sensor not in _stores:
+            _stores[sensor] = HistoryStore(HISTORY_DB if sensor is None else sensor_path(sensor))
+        return _stores[sensor]
+
+
+def open_stores():
+    with _store_lock:
+        return list(_stores.values())
@@ -0,0 +1,282 @@
+import hmac
+import json
+import os
+import struct
+import threading
+import zlib
+from collections import deque
+
+import numpy as np
+import pandas as pd
+from fastapi import APIRouter, HTTPException, Request
+
+from offload import Offload
+
+MEDIA_TYPE = "application/vnd.nop.flows"
+MAGIC = b"NOPF"
+VERSION = 1
+
+# rows kept per sensor for the dashboard; matches storage.MAX_ROWS
+CAPACITY = 5000
+# distinct agents accepted; each one costs a partition and a history file
+MAX_SENSORS = int(os.environ.get("INGEST_MAX_SENSORS", "256"))
+# sequence state is kept for this many boots per agent
+BOOTS_KEPT = 4
+# request body as sent, and all of its frames once decompressed
+MAX_BODY = int(os.environ.get("INGEST_MAX_BODY_MB", "16")) * 1024 * 1024
+MAX_DECODED = int(os.environ.get("INGEST_MAX_DECODED_MB", "128")) * 1024 * 1024
+# shared secret agents send as "Authorization: Bearer <token>"; unset accepts anyone
+INGEST_TOKEN = os.environ.get("INGEST_TOKEN")
+
+# wire type of every column a frame carries besides timestamp and sensor;
+# must match agent/transport.py
+WIRE_TYPES = {
+    "src_ip": "dict", "dst_ip": "dict", "protocol": "<u1", "bytes": "<i8", "packets": "<i8",
+    "src_port": "<u2", "dst_port": "<u2", "rev_bytes": "<i8", "rev_packets": "<i8",
+    "first_seen": "<f8", "last_seen": "<f8", "syn": "<i4", "fin": "<i4", "rst": "<i4",
+    "sampling": "<f8",
+}
+
+decode_worker = Offload("ingest", workers=1, limit=4)
+
+
+def decode_frame(frame, max_size=MAX_DECODED):
+    """(header, DataFrame) from one agent frame; see agent/transport.py for the layout.
+
+    Raises ValueError for anything malformed, including a frame that
+    decompresses to more than `max_size` bytes.
+    """
+    if frame[:4] != MAGIC or len(frame) < 5:
+        raise ValueError("not a flow frame")
+    if frame[4] != VERSION:
+        raise ValueError(f"unsupported flow frame version {frame[4]}")
+    # zlib reads max_length=0 as "no limit"
+    if max_size <= 0:
+        raise ValueError("flow frames larger than the decoded size limit")
+
+    inflate = zlib.decompressobj()
+    try:
+        payload = inflate.decompress(frame[5:], max_size)
+    except zlib.error as e:
+        raise ValueError(f"corrupt flow frame: {e}")
+    if inflate.unconsumed_tail:
+        raise ValueError(f"flow frame larger than {max_size} bytes decompressed")
+    if not inflate.eof:
+        raise ValueError("truncated flow frame")
+    (size,) = struct.unpack_from("!I", payload)
+    header = json.loads(payload[4:4 + size])
+    n = header["rows"]
+    if not isinstance(header["agent"], str) or not header["agent"]:
+        raise ValueError("flow frame without an agent id")
+    for key in ("rows", "ts", "boot", "seq"):
+        if type(header[key]) is not int or header[key] < 0:
+            raise ValueError(f"flow frame {key} is not a non-negative integer")
+
+    # exactly the expected columns and types, or the window computation fails later
+    wires = header["columns"]
+    if (not isinstance(wires, list) or len(wires) != len(WIRE_TYPES)
+            or not all(isinstance(c, list) and len(c) == 2 and WIRE_TYPES.get(c[0]) == c[1] for c in wires)
+            or len({c[0] for c in wires}) != len(WIRE_TYPES)):
+        raise ValueError("flow frame columns do not match the flow record")
+
+    columns = {"timestamp": np.full(n, header["ts"], dtype=np.int64)}
+    pos = 4 + size
+    for name, wire in wires:
+        dtype = np.dtype("<u4" if wire == "dict" else wire)
+        values = np.frombuffer(payload, dtype=dtype, count=n, offset=pos)
+        pos += n * dtype.itemsize
+        if wire == "dict":
+            dictionary = header["dictionaries"][name]
+            if not isinstance(dictionary, list) or (n and int(values.max()) >= len(dictionary)):
+                raise ValueError(f"flow frame {name} codes outside its dictionary")
+            values = np.asarray(dictionary, dtype=object)[values]
+        columns[name] = values
+    if pos != len(payload):
+        raise ValueError("flow frame length does not match its header")
+    columns["sensor"] = np.full(n, header["agent"], dtype=object)
+    header["decoded"] = len(payload)
+
+    return header, pd.DataFrame(columns)
+
+
+def decode_frames(body, max_decoded=MAX_DECODED):
+    """Split a request body of length-prefixed frames and decode each one.
+
+    All frames together may decompress to at most `max_decoded` bytes.
+    """
+    frames = []
+    pos = 0
+    budget = max_decoded
+    while pos < len(body):
+        if pos + 4 > len(body):
+            raise ValueError("truncated frame length")
+        if budget <= 0:
+            raise ValueError(f"flow frames larger than {max_decoded} bytes decompressed")
+        (size,) = struct.unpack_from("!I", body, pos)
+        header, df = decode_frame(body[pos + 4:pos + 4 + size], budget)
+        budget -= header["decoded"]
+        frames.append((header, df))
+        pos += 4 + size
+    return frames
+
+
+class IngestBuffer:
+    """Recent flow rows pushed by agents, held in memory for the window computation.
+
+    Each agent (sensor) has its own partition: its frames are kept whole (one
+    DataFrame each) until its newest CAPACITY rows no longer need them, and
+    its own generation counts the frames it added, so the window computation
+    can skip sensors with nothing new. Per agent and boot, the highest
+    sequence number seen is tracked: repeats (a retry whose response was
+    lost) are dropped and gaps (windows the agent had to discard) are counted.
+    """
+
+    def __init__(self, capacity=CAPACITY, max_sensors=MAX_SENSORS):
+        self.capacity = capacity
+        self.max_sensors = max_sensors
+        self.partitions = {}
+        self.generation = 0
+        self.agents = {}
+        self.listeners = []
+        self.lock = threading.Lock()
+
+    def accept(self, header, df):
+        """Add one decoded frame; False if it was a duplicate.
+
+        Raises ValueError for a new agent once MAX_SENSORS are known.
+        """
+        return self.accept_many([(header, df)]) == 1
+
+    def accept_many(self, frames):
+        """Add a request's decoded frames, all or none; the number that were not duplicates.
+
+        Raises ValueError, before adding anything, if the frames would bring
+        in more than MAX_SENSORS agents.
+        """
+        with self.lock:
+            new = {header["agent"] for header, _ in frames} - self.agents.keys()
+            if new and len(self.agents) + len(new) > self.max_sensors:
+                raise ValueError(f"more than {self.max_sensors} sensors")
+            return sum(self._accept(header, df) for header, df in frames)
+
+    def _accept(self, header, df):
+        # called with the lock held
+        agent = self.agents.setdefault(header["agent"], {
+            "boots": {}, "frames": 0, "rows": 0, "duplicates": 0, "missing": 0,
+            "last_ts": None, "stats": None,
+        })
+        boots = agent["boots"]
+        last = boots.get(header["boot"], 0)
+        if header["seq"] <= last:
+            agent["duplicates"] += 1
+            return False
+        if last:
+            agent["missing"] += header["seq"] - last - 1
+        boots[header["boot"]] = header["seq"]
+        for old in sorted(boots)[:-BOOTS_KEPT]:
+            del boots[old]
+
+        agent["frames"] += 1
+        agent["rows"] += len(df)
+        agent["last_ts"] = header["ts"]
+        if header.get("stats") is not None:
+            agent["stats"] = header["stats"]
+
+        if len(df):
+            part = self.partitions.setdefault(header["agent"], {"frames": deque(), "rows": 0, "generation": 0})
+            frames = part["frames"]
+            frames.append(df)
+            part["rows"] += len(df)
+            while frames and part["rows"] - len(frames[0]) >= self.capacity:
+                part["rows"] -= len(frames.popleft())
+            part["generation"] += 1
+            self.generation += 1
+        return True
+
+    def _picked(self, frames, rows):
+        # newest frames covering `rows`; called with the lock held
+        picked = []
+        count = 0
+        for df in reversed(frames):
+            picked.append(df)
+            count += len(df)
+            if count >= rows:
+                break
+        picked.reverse()
+        return picked
+
+    def tails(self, rows):
+        """{sensor: (generation, DataFrame of its last `rows` rows)}."""
+        with self.lock:
+            picked = {
+                sensor: (part["generation"], self._picked(part["frames"], rows))
+                for sensor, part in self.partitions.items()
+            }
+        return {
+            sensor: (generation, pd.concat(frames, ignore_index=True).tail(rows))
+            for sensor, (generation, frames) in picked.items()
+        }
+
+    def agent_stats(self):
+        """Per agent: its overload counters plus what the ingest side saw of its stream."""
+        with self.lock:
+            return {
+                name: dict(a["stats"] or {}, ingest={
+                    k: a[k] for k in ("frames", "rows", "duplicates", "missing", "last_ts")
+                })
+                for name, a in self.agents.items()
+            }
+
+
+buffer = IngestBuffer()
+
+router = APIRouter()
+
+
+def check_token(request):
+    """401 without credentials, 403 with the wrong ones, when INGEST_TOKEN is set."""
+    if not INGEST_TOKEN:
+        return
+    scheme, _, token = request.headers.get("authorization", "").partition(" ")
+    if scheme.lower() != "bearer" or not token:
+        raise HTTPException(status_code=401, detail="ingest token required",
+                            headers={"WWW-Authenticate": "Bearer"})
+    if not hmac.compare_digest(token.strip().encode(), INGEST_TOKEN.encode()):
+        raise HTTPException(status_code=403, detail="bad ingest token")
+
+
+async def read_body(request, limit=MAX_BODY):
+    """The request body, or 413 as soon as it is known to exceed `limit` bytes."""
+    declared = request.headers.get("content-length")
+    if declared is not None and declared.isdigit() and int(declared) > limit:
+        raise HTTPException(status_code=413, detail=f"body larger than {limit} bytes")
+    body = bytearray()
+    async for chunk in request.stream():
+        body += chunk
+        if len(body) > limit:
+            raise HTTPException(status_code=413, detail=f"body larger than {limit} bytes")
+    return bytes(body)
+
+
+@router.post("/api/ingest")
+async def ingest(request: Request):
+    """Accept a batch of flow frames from an agent's push transport."""
+    check_token(request)
+    body = await read_body(request)
+    try:
+        frames = await decode_worker.run(decode_frames, body)
+    except (ValueError, KeyError, IndexError, TypeError, struct.error) as e:
+        # anything undecodable is the sender's fault: a 5xx would make it retry forever
+        raise HTTPException(status_code=400, detail=f"bad flow frames: {e}")
+
+    before = buffer.generation
+    try:
+        # all or nothing: a 4xx tells the agent to drop the whole batch
+        accepted = buffer.accept_many(frames)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    # heartbeats (stats-only frames) don't warrant a new window
+    if buffer.generation != before:
+        for notify in buffer.listeners:
+            notify()
+    return {"frames": len(frames), "accepted": accepted}
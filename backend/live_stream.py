@@ -1,18 +1,15 @@
 from scapy.all import sniff, IP, IPv6
 import time
 import pandas as pd
-import numpy as np
 from collections import deque
 from threading import Thread, Lock
+from window_engine import SlidingWindow
 
 WINDOW_SIZE = 5
+# packets captured since the processor last drained; swapped out, never copied
 buffer = deque(maxlen=50000)
 lock = Lock()
 
-def entropy(series):
-    probs = series.value_counts(normalize=True)
-    return -np.sum(probs * np.log2(probs + 1e-9))
-
 # ---------------- PACKET CAPTURE ----------------
 
 def packet_sniffer():
@@ -40,37 +37,32 @@ def packet_sniffer():
 # ---------------- STREAM PROCESSOR ----------------
 
 def stream_processor():
+    global buffer
     print("Starting real-time stream processor...")
 
+    window = SlidingWindow(WINDOW_SIZE)
+
     while True:
         time.sleep(1)
 
         with lock:
-            if len(buffer) < 10:
-                continue
-            data = list(buffer)
+            data = buffer
+            buffer = deque(maxlen=data.maxlen)
 
-        df = pd.DataFrame(data, columns=["timestamp", "src_ip", "dst_ip", "bytes"])
+        window.add_many(data)
 
-        df["timestamp"] = pd.to_datetime(df["timestamp"], unit="s")
-        now = pd.Timestamp.now()
+        now = time.time()
+        m = window.metrics(now)
 
-        df = df[df["timestamp"] >= now - pd.Timedelta(seconds=WINDOW_SIZE)]
-
-        if df.empty:
+        if m["conn_count"] == 0:
             continue
 
-        traffic = int(df["bytes"].sum())
-        conn_count = int(len(df))
-        fan_out = round(df.groupby("src_ip")["dst_ip"].nunique().mean(), 2)
-        dst_entropy = round(entropy(df["dst_ip"]), 3)
-
         print("\n[STREAM FEATURES]")
-        print("timestamp:", now)
-        print("total_bytes:", traffic)
-        print("conn_count:", conn_count)
-        print("avg_fan_out:", fan_out)
-        print("dst_ip_entropy:", dst_entropy)
+        print("timestamp:", pd.Timestamp.fromtimestamp(now))
+        print("total_bytes:", m["total_bytes"])
+        print("conn_count:", m["conn_count"])
+        print("avg_fan_out:", m["avg_fan_out"])
+        print("dst_ip_entropy:", m["dst_ip_entropy"])
 
 
 # ---------------- MAIN ----------------
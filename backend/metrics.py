@@ -1,61 +1,79 @@
-import math
-import time
+import os
+import numpy as np
 import pandas as pd
 
-def shannon_entropy(series):
-    counts = series.value_counts()
-    total = counts.sum()
-
-    if total == 0:
-        return 0.0
-
-    entropy = 0.0
-    for c in counts:
-        p = c / total
-        entropy -= p * math.log2(p)
-
-    return round(entropy, 3)
-
-
-def compute_metrics(df: pd.DataFrame):
-    if df is None or df.empty:
-        return []
-
-    try:
-        df = df.copy()
-
-        # Ensure numeric types
-        df["bytes"] = pd.to_numeric(df["bytes"], errors="coerce").fillna(0)
-        df["timestamp"] = pd.to_numeric(df["timestamp"], errors="coerce").fillna(0)
-
-        
-        timestamp = int(time.time() * 1000)
-
-
-        total_bytes = int(df["bytes"].sum())
-
-        # throughput over 5 second window (MB/s)
-        throughput_mbps = float(round((total_bytes / 5) / (1024 * 1024), 3))
-
-        entropy = shannon_entropy(df["dst_ip"])
-
-        fanout = (
-            df.groupby("src_ip")["dst_ip"]
-            .nunique()
-            .mean()
-        )
-
-        if pd.isna(fanout):
-            fanout = 0.0
-
-        return [{
-            "timestamp": timestamp,
-            "total_bytes": total_bytes,
-            "throughput_mbps": throughput_mbps,
-            "dst_ip_entropy": float(entropy),
-            "avg_fan_out": float(round(fanout, 2))
-        }]
-
-    except Exception as e:
-        print("METRICS COMPUTE ERROR:", e)
-        return []
+# "exact" (this kernel over per-edge totals) or "sketch" (HLL / heavy-hitter estimates)
+METRICS_MODE = os.environ.get("METRICS_MODE", "exact")
+
+def _codes(values):
+    # factorize to dense integer codes; missing values become -1
+    if not isinstance(values, pd.Series):
+        values = np.asarray(values)
+        if values.dtype.kind not in "iu":
+            values = values.astype(object)
+    codes, uniques = pd.factorize(values)
+    return codes.astype(np.int64), len(uniques)
+
+
+def _distinct(x, return_counts=False):
+    # sort-based distinct values (and run lengths) of an integer array
+    x = np.sort(x)
+    starts = np.flatnonzero(np.concatenate(([True], x[1:] != x[:-1]))) if len(x) else np.empty(0, dtype=np.int64)
+    if return_counts:
+        return x[starts], np.diff(np.append(starts, len(x)))
+    return x[starts]
+
+
+def grouped_window_kernel(groups, src, dst, bytes_, flows=None, n_groups=None):
+    """Per-window metrics in one pass; `groups` are window codes 0..G-1.
+
+    Each row is one flow, or with `flows` that many flows between the same
+    src and dst (a summary's edges), which weights the destination entropy
+    and connection count. Returns arrays indexed by window: total_bytes,
+    conn_count, avg_fan_out (mean distinct destinations per source) and
+    dst_ip_entropy.
+    """
+    g = np.asarray(groups, dtype=np.int64)
+    if n_groups is None:
+        n_groups = int(g.max()) + 1 if len(g) else 0
+    s, n_src = _codes(src)
+    d, n_dst = _codes(dst)
+    b = np.nan_to_num(np.asarray(bytes_, dtype=np.float64))
+    f = None if flows is None else np.asarray(flows, dtype=np.float64)
+
+    total = np.bincount(g, weights=b, minlength=n_groups)
+    count = np.bincount(g, weights=f, minlength=n_groups)
+
+    # entropy: flows to each (window, dst), normalized by the window's flows
+    ok = d >= 0
+    keys = g[ok] * max(n_dst, 1) + d[ok]
+    if f is None:
+        gd, c = _distinct(keys, return_counts=True)
+    else:
+        gd, inverse = np.unique(keys, return_inverse=True)
+        c = np.bincount(inverse, weights=f[ok], minlength=len(gd))
+    win = gd // max(n_dst, 1)
+    per_window = np.bincount(g[ok], weights=None if f is None else f[ok], minlength=n_groups)
+    p = c / per_window[win]
+    entropy = -np.bincount(win, weights=p * np.log2(p), minlength=n_groups)
+
+    # fan-out: distinct (window, src, dst) over distinct (window, src)
+    ok = (s >= 0) & (d >= 0)
+    triples = _distinct((g[ok] * max(n_src, 1) + s[ok]) * max(n_dst, 1) + d[ok])
+    ws = triples // max(n_dst, 1)
+    pairs_per_window = np.bincount(ws // max(n_src, 1), minlength=n_groups)
+    srcs_per_window = np.bincount(_distinct(ws) // max(n_src, 1), minlength=n_groups)
+    fan_out = np.divide(pairs_per_window, srcs_per_window,
+                        out=np.zeros(n_groups), where=srcs_per_window > 0)
+
+    return {
+        "total_bytes": total,
+        "conn_count": count,
+        "avg_fan_out": fan_out,
+        "dst_ip_entropy": entropy + 0.0,
+    }
+
+
+# the agent's port, flag and timing fields, behind max_dst_ports, half_open_flows
+# and avg_duration; older flow files lack them and get none of those metrics
+FLOW_DETAIL_COLUMNS = ("dst_port", "rev_packets", "syn", "first_seen", "last_seen")
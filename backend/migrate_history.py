@@ -0,0 +1,76 @@
+"""Import the old CSV metrics history into the SQLite history store.
+
+    python migrate_history.py                      # both CSVs under data/
+    python migrate_history.py --csv path/to/file.csv --db path/to/history.db
+
+Handles both layouts the backend has written:
+  - metrics_history.csv: header row, timestamp in milliseconds
+  - metrics_timeseries.csv: no header, (timestamp s, total_bytes, dst_ip_entropy, avg_fan_out)
+Timestamps already in the store are skipped, so the import can be re-run.
+"""
+import argparse
+import os
+
+import numpy as np
+import pandas as pd
+
+from history_store import COLUMNS, DATA_DIR, HISTORY_DB, HistoryStore
+
+TIMESERIES_COLUMNS = ["timestamp", "total_bytes", "dst_ip_entropy", "avg_fan_out"]
+CHUNK_ROWS = 100_000
+
+
+def read_history_csv(path):
+    """Yield chunks of the CSV normalised to COLUMNS with timestamps in ms."""
+    with open(path) as f:
+        first = f.readline()
+    has_header = "timestamp" in first
+
+    chunks = pd.read_csv(
+        path,
+        header=0 if has_header else None,
+        names=None if has_header else TIMESERIES_COLUMNS,
+        chunksize=CHUNK_ROWS,
+    )
+    for chunk in chunks:
+        chunk = chunk.apply(pd.to_numeric, errors="coerce").dropna(subset=["timestamp"])
+        ts = chunk["timestamp"].to_numpy(dtype=np.float64)
+        # second-resolution files are scaled up; anything past 1e11 is already ms
+        chunk["timestamp"] = np.where(ts < 1e11, ts * 1000, ts).astype(np.int64)
+        yield chunk.reindex(columns=COLUMNS)
+
+
+def to_rows(chunk):
+    cols = [chunk[c].astype(object).where(chunk[c].notna(), None) for c in COLUMNS]
+    return list(zip(*[c.tolist() for c in cols]))
+
+
+def migrate(paths, db=HISTORY_DB):
+    store = HistoryStore(db)
+    before = store.count()
+    for path in paths:
+        if not os.path.exists(path):
+            print("skipping missing", path)
+            continue
+        read = 0
+        for chunk in read_history_csv(path):
+            store.append_many(to_rows(chunk))
+            read += len(chunk)
+        print(f"{path}: {read} rows read")
+    after = store.count()
+    store.close()
+    print(f"{after - before} new rows, {after} total in {db}")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--csv", action="append", default=None,
+                        help="CSV to import (repeatable); defaults to both files under data/")
+    parser.add_argument("--db", default=HISTORY_DB)
+    args = parser.parse_args()
+
+    paths = args.csv or [
+        os.path.join(DATA_DIR, "metrics_history.csv"),
+        os.path.join(DATA_DIR, "metrics_timeseries.csv"),
+    ]
+    migrate(paths, args.db)
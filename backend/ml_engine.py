@@ -1,22 +1,406 @@
+import multiprocessing as mp
+import os
+import threading
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+
 import numpy as np
 from sklearn.ensemble import IsolationForest
 
+from model_store import load_model, save_model
+
+# "isolation_forest" (default) or "zscore"
+DETECTOR = os.environ.get("DETECTOR", "isolation_forest")
+
+MIN_TRAINING = 50       # windows needed before the first fit
+TRAINING_WINDOW = 2000  # most recent windows kept for (re)training
+RETRAIN_EVERY = 500     # new windows between background refits
+
+# feature vector layout; a persisted model with a different layout is not reused
+FEATURES = ["total_bytes", "dst_ip_entropy", "avg_fan_out"]
+
+# robust z-score that maps to the 0.8 "critical" alert threshold
+Z_CRITICAL = 4.0
+
+# per-entity (host, subnet) baselines kept at once; the least recently seen go first
+ENTITY_CAPACITY = int(os.environ.get("ENTITY_CAPACITY", "200000"))
+# windows an entity must have been seen in before it is scored
+ENTITY_MIN_WINDOWS = 20
+# smallest MAD per feature (FEATURES order) when scoring: one host's entropy and
+# fan-out are small integers-ish and often constant, which would make any change infinite
+ENTITY_MIN_SPREAD = (16 * 1024.0, 0.5, 1.0)
+
+
+def fit_model(X):
+    """Fit a fresh IsolationForest; runs in the training process."""
+    model = IsolationForest(
+        n_estimators=100,
+        contamination=0.05,
+        random_state=42
+    )
+    model.fit(X)
+    return model
+
+
 class AnomalyDetector:
-    def __init__(self):
-        self.model = IsolationForest(
-            n_estimators=100,
-            contamination=0.05,
-            random_state=42
-        )
+    """IsolationForest over a sliding window of recent feature vectors.
+
+    `update` adds one window's features; once enough have arrived, and then
+    every `retrain_every` windows, a new model is fitted in a background
+    process and swapped in with a single reference assignment. `score` always
+    uses whichever model is current and never waits on a fit, and the new
+    model is saved on a thread of its own.
+
+    Every fitted model is saved together with the window it was trained on,
+    so `load` can restore both after a restart; `bootstrap` fits straight
+    from stored history when there is nothing to load.
+    """
+
+    name = "isolation_forest"
+
+    def __init__(self, window=TRAINING_WINDOW, min_training=MIN_TRAINING, retrain_every=RETRAIN_EVERY):
+        self.model = None
         self.trained = False
+        self.version = 0
+        self.window = deque(maxlen=window)
+        self.min_training = min_training
+        self.retrain_every = retrain_every
+        self.since_fit = 0
+        self.pending = None
+        self.pool = None
+        # one thread, so saves land in the order the models were fitted
+        self.saver = ThreadPoolExecutor(max_workers=1, thread_name_prefix="detector-save")
+        self.lock = threading.Lock()
 
     def train(self, X):
-        self.model.fit(X)
+        X = np.asarray(X, dtype=np.float64)
+        model = fit_model(X)
+        self._swap(model)
+        self._save(model, X)
+
+    def _swap(self, model):
+        self.model = model
         self.trained = True
 
+    def _save(self, model, X):
+        try:
+            self.version = save_model(self.name, {"model": model, "window": X},
+                                      {"features": FEATURES, "samples": len(X)})
+        except Exception as e:
+            print("Failed to save detector:", e)
+
+    def load(self):
+        payload, meta = load_model(self.name)
+        if payload is None or meta.get("features") != FEATURES:
+            return False
+        with self.lock:
+            self.window.extend(payload["window"].tolist())
+            self.model = payload["model"]
+            self.trained = True
+            self.version = meta["version"]
+        return True
+
+    def bootstrap(self, X):
+        """Seed the training window from past feature vectors and fit on them if there are enough."""
+        with self.lock:
+            for x in X[-self.window.maxlen:]:
+                self.window.append(list(x))
+            X = np.array(self.window, dtype=np.float64)
+        if len(X) >= self.min_training:
+            self.train(X)
+
+    def update(self, features):
+        with self.lock:
+            self.window.append(list(features))
+            self.since_fit += 1
+            if self.pending is not None:
+                return
+            if self.trained:
+                due = self.since_fit >= self.retrain_every
+            else:
+                due = len(self.window) >= self.min_training
+            if not due:
+                return
+            self.since_fit = 0
+            X = np.array(self.window, dtype=np.float64)
+            self.pending = X
+        # submitted outside the lock: a future that is already done runs
+        # its callback inline, and _fitted takes the lock
+        self._retrain(X)
+
+    def _retrain(self, X):
+        try:
+            if self.pool is None:
+                # spawn, not fork: the server process has threads running
+                self.pool = ProcessPoolExecutor(max_workers=1, mp_context=mp.get_context("spawn"))
+            future = self.pool.submit(fit_model, X)
+        except Exception as e:
+            print("detector retrain failed:", e)
+            self._failed()
+            return
+        future.add_done_callback(lambda future: self._fitted(future, X))
+
+    def _fitted(self, future, X):
+        try:
+            model = future.result()
+        except Exception as e:
+            print("detector retrain failed:", e)
+            self._failed()
+            return
+        self._swap(model)
+        try:
+            # not on the pool's callback thread: dumping the model and window takes a while
+            self.saver.submit(self._save, model, X)
+        except RuntimeError:
+            print("detector closed, fitted model not saved")
+        with self.lock:
+            self.pending = None
+
+    def _failed(self):
+        """Drop a (possibly broken) pool so the next due window starts a fresh one."""
+        pool, self.pool = self.pool, None
+        if pool is not None:
+            pool.shutdown(wait=False, cancel_futures=True)
+        with self.lock:
+            self.pending = None
+
     def score(self, X):
-        if not self.trained:
+        model = self.model
+        if model is None:
             return 0.0
 
-        score = -self.model.decision_function(X)[0]
+        score = -model.decision_function(X)[0]
         return round(float(score), 3)
+
+    def close(self):
+        if self.pool is not None:
+            self.pool.shutdown(wait=False, cancel_futures=True)
+        # the last fitted model is still worth keeping
+        self.saver.shutdown(wait=True)
+
+
+class RobustZScore:
+    """Streaming per-feature robust z-score with O(1) updates and constant memory.
+
+    Median and MAD are tracked by stochastic approximation: every window nudges
+    each estimate one step toward the new value, the step scaled by the current
+    spread. The score is the largest per-feature |z|, scaled so Z_CRITICAL
+    lands on the 0.8 threshold generate_alert uses for IsolationForest scores.
+    The estimates are saved every `save_every` updates and on close.
+    """
+
+    name = "zscore"
+
+    def __init__(self, min_training=MIN_TRAINING, rate=0.02, save_every=100):
+        self.min_training = min_training
+        self.save_every = save_every
+        self.rate = rate
+        self.count = 0
+        self.median = None
+        self.mad = None
+        self.trained = False
+        self.version = 0
+
+    def update(self, features):
+        self._step(features)
+        if self.count % self.save_every == 0:
+            self.save()
+
+    def _step(self, features):
+        x = np.asarray(features, dtype=np.float64)
+        self.count += 1
+        if self.median is None:
+            self.median = x.copy()
+            self.mad = np.maximum(np.abs(x) * 0.1, 1e-6)
+            return
+
+        # larger steps while warming up so the estimates settle quickly
+        rate = max(self.rate, 1.0 / self.count)
+        dev = np.abs(x - self.median)
+        self.median += rate * self.mad * np.sign(x - self.median)
+        self.mad = np.maximum(self.mad + rate * self.mad * np.sign(dev - self.mad), 1e-6)
+        self.trained = self.count >= self.min_training
+
+    def save(self):
+        if self.median is None:
+            return
+        try:
+            self.version = save_model(self.name, {"median": self.median, "mad": self.mad, "count": self.count},
+                                      {"features": FEATURES, "samples": self.count})
+        except Exception as e:
+            print("Failed to save detector:", e)
+
+    def load(self):
+        payload, meta = load_model(self.name)
+        if payload is None or meta.get("features") != FEATURES:
+            return False
+        self.median = payload["median"]
+        self.mad = payload["mad"]
+        self.count = payload["count"]
+        self.trained = self.count >= self.min_training
+        self.version = meta["version"]
+        return True
+
+    def bootstrap(self, X):
+        for x in X:
+            self._step(x)
+        self.save()
+
+    def score(self, X):
+        if not self.trained:
+            return 0.0
+        x = np.asarray(X[0], dtype=np.float64)
+        z = 0.6745 * np.abs(x - self.median) / self.mad
+        return round(float(z.max()) * 0.8 / Z_CRITICAL, 3)
+
+    def close(self):
+        self.save()
+
+
+class EntityBaselines:
+    """RobustZScore for many entities at once, in flat arrays.
+
+    One row per entity (a source IP or a subnet) holds the median and MAD of
+    its FEATURES plus how often and when it was last seen; a dict maps entity
+    keys to rows. `score_update` takes every entity of a window, scores the
+    whole batch against its own baselines in one vectorized pass, then folds
+    the window into them. Entities seen in fewer than `min_windows` windows
+    score 0, and no feature's MAD counts as less than `min_spread`. When the
+    arrays are full, the least recently seen entities are evicted, at least
+    1/16 of the capacity at a time so eviction stays rare.
+    """
+
+    name = "entities"
+
+    def __init__(self, capacity=ENTITY_CAPACITY, min_windows=ENTITY_MIN_WINDOWS, min_spread=ENTITY_MIN_SPREAD,
+                 rate=0.02, save_every=100):
+        self.capacity = capacity
+        self.min_windows = min_windows
+        self.min_spread = np.asarray(min_spread, dtype=np.float32)
+        self.rate = rate
+        self.save_every = save_every
+        self.windows = 0
+        self.evictions = 0
+        self.version = 0
+        self.index = {}
+        self.keys = np.full(capacity, None, dtype=object)
+        self.median = np.zeros((capacity, len(FEATURES)), dtype=np.float32)
+        self.mad = np.zeros((capacity, len(FEATURES)), dtype=np.float32)
+        self.count = np.zeros(capacity, dtype=np.int32)
+        self.last_seen = np.zeros(capacity, dtype=np.int64)
+        # free rows, taken from the end
+        self.free = np.arange(capacity, dtype=np.int64)[::-1]
+
+    def __len__(self):
+        return len(self.index)
+
+    def _evict(self, count):
+        # least recently seen first; entities of the current window are never evicted
+        candidates = np.flatnonzero((self.count > 0) & (self.last_seen < self.windows))
+        if count < len(candidates):
+            candidates = candidates[np.argpartition(self.last_seen[candidates], count)[:count]]
+        for key in self.keys[candidates]:
+            del self.index[key]
+        self.keys[candidates] = None
+        self.count[candidates] = 0
+        self.free = np.concatenate((self.free, candidates))
+        self.evictions += len(candidates)
+
+    def _allocate(self, keys):
+        if len(keys) > len(self.free):
+            self._evict(max(len(keys) - len(self.free), self.capacity // 16))
+        # a window with more new entities than fit leaves the rest untracked
+        take = min(len(keys), len(self.free))
+        rows = self.free[len(self.free) - take:]
+        self.free = self.free[:len(self.free) - take]
+        self.index.update(zip(keys[:take], rows.tolist()))
+        self.keys[rows] = keys[:take]
+        rows = np.concatenate((rows, np.full(len(keys) - take, -1, dtype=np.int64)))
+        return rows
+
+    def score_update(self, keys, X):
+        """Scores for one window's distinct entities (`keys`, FEATURES rows in `X`), then learn from them."""
+        keys = np.asarray(keys, dtype=object)
+        X = np.asarray(X, dtype=np.float32).reshape(len(keys), len(FEATURES))
+        self.windows += 1
+
+        index = self.index
+        rows = np.fromiter((index.get(k, -1) for k in keys), dtype=np.int64, count=len(keys))
+        known = rows >= 0
+        self.last_seen[rows[known]] = self.windows
+
+        scores = np.zeros(len(keys))
+        trained = known.copy()
+        trained[known] = self.count[rows[known]] >= self.min_windows
+        r, x = rows[trained], X[trained]
+        z = 0.6745 * np.abs(x - self.median[r]) / np.maximum(self.mad[r], self.min_spread)
+        scores[trained] = np.round(z.max(axis=1).astype(np.float64) * 0.8 / Z_CRITICAL, 3)
+
+        # known entities: one stochastic-approximation step each, as in RobustZScore._step
+        r, x = rows[known], X[known]
+        count = self.count[r] + 1
+        self.count[r] = count
+        rate = np.maximum(self.rate, 1.0 / count)[:, None].astype(np.float32)
+        median, mad = self.median[r], self.mad[r]
+        self.median[r] = median + rate * mad * np.sign(x - median)
+        self.mad[r] = np.maximum(mad + rate * mad * np.sign(np.abs(x - median) - mad), 1e-6)
+
+        # new entities start from this window
+        new = self._allocate(keys[~known])
+        ok = new >= 0
+        r, x = new[ok], X[~known][ok]
+        self.median[r] = x
+        self.mad[r] = np.maximum(np.abs(x) * 0.1, 1e-6)
+        self.count[r] = 1
+        self.last_seen[r] = self.windows
+
+        if self.windows % self.save_every == 0:
+            self.save()
+        return scores
+
+    def baseline(self, key):
+        """(median, MAD as used for scoring) of one entity's features, or None if it is not tracked."""
+        row = self.index.get(key)
+        if row is None:
+            return None
+        return self.median[row], np.maximum(self.mad[row], self.min_spread)
+
+    def save(self):
+        rows = np.flatnonzero(self.count > 0)
+        try:
+            self.version = save_model(self.name, {
+                "keys": self.keys[rows], "median": self.median[rows], "mad": self.mad[rows],
+                "count": self.count[rows], "last_seen": self.last_seen[rows], "windows": self.windows,
+            }, {"features": FEATURES, "entities": len(rows)})
+        except Exception as e:
+            print("Failed to save entity baselines:", e)
+
+    def load(self):
+        payload, meta = load_model(self.name)
+        if payload is None or meta.get("features") != FEATURES:
+            return False
+        n = min(len(payload["keys"]), self.capacity)
+        # keep the most recently seen if the capacity shrank
+        order = np.argsort(payload["last_seen"])[::-1][:n]
+        self.keys[:n] = payload["keys"][order]
+        self.median[:n] = payload["median"][order]
+        self.mad[:n] = payload["mad"][order]
+        self.count[:n] = payload["count"][order]
+        self.last_seen[:n] = payload["last_seen"][order]
+        self.windows = payload["windows"]
+        self.index = {k: i for i, k in enumerate(self.keys[:n].tolist())}
+        self.free = np.arange(n, self.capacity, dtype=np.int64)[::-1]
+        self.version = meta["version"]
+        return True
+
+    def close(self):
+        self.save()
+
+
+def make_detector(kind=None):
+    kind = kind or DETECTOR
+    if kind == "zscore":
+        return RobustZScore()
+    if kind == "isolation_forest":
+        return AnomalyDetector()
+    raise ValueError(f"unknown DETECTOR {kind!r}")
@@ -1,76 +1,174 @@
+import multiprocessing as mp
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+
 import pandas as pd
-import numpy as np
 from sklearn.ensemble import IsolationForest
+from metrics import grouped_window_kernel
+from model_store import load_model, save_model
+from persistence import delete_alerts, upsert_alerts, upsert_windows
 
-# -------------------------
-# Helper: entropy
-# -------------------------
-def entropy(series):
-    probs = series.value_counts(normalize=True)
-    return -np.sum(probs * np.log2(probs + 1e-9))
+# resource is Unix-only; on Windows the peak comes from psutil when installed
+try:
+    import resource
+except ImportError:
+    resource = None
 
-# -------------------------
-# MAIN PIPELINE FUNCTION
-# -------------------------
-def run_pipeline(db, csv_path="flows.csv"):
-    # Import models here to avoid circular imports
-    from models import FlowWindow, Alert
+try:
+    import psutil
+except ImportError:
+    psutil = None
 
-    # -------------------------
-    # Load & preprocess data
-    # -------------------------
-    df = pd.read_csv(csv_path)
+PIPELINE_FEATURES = ["total_bytes", "conn_count", "avg_fan_out", "dst_ip_entropy"]
 
-    df["timestamp"] = pd.to_datetime(df["timestamp"], unit="s")
-    df["time_window"] = df["timestamp"].dt.floor("5s")  # fixed warning
+# rows per chunk in streaming mode
+CHUNK_ROWS = 1_000_000
+FLOW_COLUMNS = ["timestamp", "src_ip", "dst_ip", "bytes"]
 
-    # -------------------------
-    # Feature extraction
-    # -------------------------
-    traffic = df.groupby("time_window")["bytes"].sum()
-    conn_count = df.groupby("time_window").size()
-
-    fan_out = (
-        df.groupby(["time_window", "src_ip"])["dst_ip"]
-          .nunique()
-          .groupby("time_window")
-          .mean()
-    )
 
-    dst_entropy = (
-        df.groupby("time_window")["dst_ip"]
-          .apply(entropy)
-    )
+def window_features(df):
+    """One feature row per 5 second window of `df`, from the shared metrics kernel."""
+    df = df.copy()
+    df["timestamp"] = pd.to_datetime(df["timestamp"], unit="s")
+    df["time_window"] = df["timestamp"].dt.floor("5s")  # fixed warning
 
-    features = pd.concat(
-        [traffic, conn_count, fan_out, dst_entropy],
-        axis=1
+    windows, window_index = pd.factorize(df["time_window"], sort=True)
+    k = grouped_window_kernel(windows, df["src_ip"], df["dst_ip"], df["bytes"])
+
+    return pd.DataFrame(
+        {
+            "total_bytes": k["total_bytes"],
+            "conn_count": k["conn_count"],
+            "avg_fan_out": k["avg_fan_out"],
+            "dst_ip_entropy": k["dst_ip_entropy"],
+        },
+        index=pd.Index(window_index, name="time_window"),
     ).fillna(0)
 
-    features.columns = [
-        "total_bytes",
-        "conn_count",
-        "avg_fan_out",
-        "dst_ip_entropy"
-    ]
 
-    # -------------------------
-    # ML (IMPORTANT FIX)
-    # -------------------------
-    X = features[[
-        "total_bytes",
-        "conn_count",
-        "avg_fan_out",
-        "dst_ip_entropy"
-    ]]
+def window_chunks(csv_path, chunk_rows=CHUNK_ROWS):
+    """Read a time-ordered flows CSV in chunks that never split a window.
+
+    The rows of the newest window in each chunk may continue in the next
+    chunk, so they are carried over and prepended to it; everything older is
+    complete and yielded. Rows that arrive for a window already yielded (out
+    of order by more than a chunk) cannot be merged back and are dropped with
+    a warning.
+    """
+    carry = None
+    last = None
+    late = 0
+    for chunk in pd.read_csv(csv_path, usecols=FLOW_COLUMNS, chunksize=chunk_rows):
+        window = (chunk["timestamp"] // 5) * 5
+        if last is not None:
+            stale = window <= last
+            if stale.any():
+                late += int(stale.sum())
+                chunk, window = chunk[~stale], window[~stale]
+
+        if carry is not None:
+            chunk = pd.concat([carry, chunk], ignore_index=True)
+            window = (chunk["timestamp"] // 5) * 5
+        if chunk.empty:
+            continue
+
+        newest = window.max()
+        open_ = (window == newest).to_numpy()
+        carry = chunk[open_]
+        if not open_.all():
+            done = chunk[~open_]
+            last = window[~open_].max()
+            yield done
+
+    if carry is not None and len(carry):
+        yield carry
+    if late:
+        print(f"window_chunks: dropped {late} out-of-order rows")
+
+
+def stream_window_features(csv_path, chunk_rows=CHUNK_ROWS, workers=1):
+    """Window features for a flows file too large for memory.
+
+    Only one chunk plus one carried window of raw rows is held at a time
+    (a few chunks in flight with `workers` > 1); the per-window feature rows
+    are all that accumulate.
+    """
+    chunks = window_chunks(csv_path, chunk_rows)
+    if workers <= 1:
+        parts = [window_features(c) for c in chunks]
+    else:
+        parts = []
+        # spawn, not fork: the server process has threads running
+        with ProcessPoolExecutor(max_workers=workers, mp_context=mp.get_context("spawn")) as pool:
+            pending = deque()
+            for c in chunks:
+                pending.append(pool.submit(window_features, c))
+                # bound the chunks in flight so reading cannot outrun the workers
+                if len(pending) >= 2 * workers:
+                    parts.append(pending.popleft().result())
+            parts.extend(f.result() for f in pending)
+
+    if not parts:
+        return pd.DataFrame(columns=PIPELINE_FEATURES, index=pd.DatetimeIndex([], name="time_window"))
+    return pd.concat(parts).sort_index()
+
+
+def peak_rss_mb():
+    """Peak resident set size, in MB, over this process's lifetime and its finished children's; None if unknown.
+
+    Not the cost of one run: in the server it is the largest the whole
+    process (or a worker) has ever been.
+    """
+    if resource is not None:
+        own = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        children = resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss
+        # ru_maxrss is in KB on Linux
+        return round(max(own, children) / 1024, 1)
+    if psutil is not None:
+        info = psutil.Process().memory_info()
+        # peak_wset is the Windows peak working set
+        return round(getattr(info, "peak_wset", info.rss) / (1024 * 1024), 1)
+    return None
+
+
+def pipeline_model(X, refit=False):
+    """The saved batch model, or a freshly fitted (and saved) one when asked or none fits."""
+    if not refit:
+        model, meta = load_model("pipeline")
+        if model is not None and meta.get("features") == PIPELINE_FEATURES:
+            return model
 
     model = IsolationForest(
         n_estimators=200,
         contamination=0.03,
         random_state=42
     )
-
     model.fit(X)
+    try:
+        save_model("pipeline", model, {"features": PIPELINE_FEATURES, "samples": len(X)})
+    except Exception as e:
+        print("Failed to save pipeline model:", e)
+    return model
+
+
+# -------------------------
+# MAIN PIPELINE FUNCTION
+# -------------------------
+def run_pipeline(db, csv_path="flows.csv", refit=False, streaming=False, chunk_rows=CHUNK_ROWS, workers=1):
+    # -------------------------
+    # Load & feature extraction
+    # -------------------------
+    if streaming:
+        features = stream_window_features(csv_path, chunk_rows=chunk_rows, workers=workers)
+    else:
+        features = window_features(pd.read_csv(csv_path))
+
+    # -------------------------
+    # ML (IMPORTANT FIX)
+    # -------------------------
+    X = features[PIPELINE_FEATURES]
+
+    model = pipeline_model(X, refit=refit)
     features["anomaly_score"] = model.decision_function(X)
 
     # -------------------------
@@ -83,29 +181,32 @@ def run_pipeline(db, csv_path="flows.csv"):
     # -------------------------
     # Store results in DB
     # -------------------------
-    for ts, row in features.iterrows():
-        db.merge(
-            FlowWindow(
-                timestamp=ts,
-                total_bytes=row["total_bytes"],
-                conn_count=row["conn_count"],
-                avg_fan_out=row["avg_fan_out"],
-                dst_ip_entropy=row["dst_ip_entropy"],
-                anomaly_score=row["anomaly_score"],
-                severity=row["severity"],
-            )
-        )
-
-        if row["severity"] in ["high", "critical"]:
-            db.add(
-                Alert(
-                    timestamp=ts,
-                    severity=row["severity"],
-                    reason=(
-                        f"entropy={row['dst_ip_entropy']:.2f}, "
-                        f"fanout={row['avg_fan_out']:.1f}"
-                    )
-                )
-            )
+    out = features.reset_index()
+    out["timestamp"] = pd.Series(out["time_window"].dt.to_pydatetime(), dtype=object)
+    windows = out[["timestamp", *PIPELINE_FEATURES, "anomaly_score", "severity"]].to_dict("records")
+
+    # one pipeline alert per flagged window; a rerun that now scores a window
+    # normal removes the alert it raised before
+    out["alert_key"] = [f"pipeline:{t.isoformat()}" for t in out["timestamp"]]
+    is_flagged = out["severity"].isin(["high", "critical"])
+    alerts = [
+        {
+            "alert_key": r["alert_key"],
+            "timestamp": r["timestamp"],
+            "severity": r["severity"],
+            "reason": (
+                f"entropy={r['dst_ip_entropy']:.2f}, "
+                f"fanout={r['avg_fan_out']:.1f}"
+            ),
+        }
+        for r in out[is_flagged].to_dict("records")
+    ]
 
+    upsert_windows(db, windows)
+    upsert_alerts(db, alerts)
+    delete_alerts(db, out.loc[~is_flagged, "alert_key"])
     db.commit()
+
+    stats = {"windows": len(features), "process_peak_rss_mb": peak_rss_mb()}
+    print(f"pipeline: {stats['windows']} windows, process peak RSS so far {stats['process_peak_rss_mb']} MB")
+    return stats
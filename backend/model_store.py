@@ -0,0 +1,77 @@
+import json
+import os
+import threading
+import time
+
+import joblib
+
+DATA_DIR = os.path.join(os.path.dirname(os.path.dirname(__file__)), "data")
+MODEL_DIR = os.environ.get("MODEL_DIR", os.path.join(DATA_DIR, "models"))
+
+# versions kept on disk per model name; older ones are pruned on save
+KEEP_VERSIONS = 5
+
+_lock = threading.Lock()
+
+
+def _path(name):
+    return os.path.join(MODEL_DIR, name)
+
+
+def _write_json(path, data):
+    tmp = path + ".tmp"
+    with open(tmp, "w") as f:
+        json.dump(data, f)
+    os.replace(tmp, path)
+
+
+def _read_json(path):
+    try:
+        with open(path) as f:
+            return json.load(f)
+    except FileNotFoundError:
+        return None
+
+
+def save_model(name, payload, meta=None):
+    """Write `payload` as the next version of model `name` and point `name.json` at it.
+
+    Files are written to a temp name and renamed, so a reader never sees a
+    half-written model. Returns the new version number.
+    """
+    with _lock:
+        os.makedirs(MODEL_DIR, exist_ok=True)
+        current = _read_json(_path(f"{name}.json"))
+        version = current["version"] + 1 if current else 1
+
+        file = f"{name}-v{version}.joblib"
+        tmp = _path(file + ".tmp")
+        joblib.dump(payload, tmp)
+        os.replace(tmp, _path(file))
+
+        meta = dict(meta or {}, name=name, version=version, file=file, saved_at=time.time())
+        _write_json(_path(f"{name}-v{version}.json"), meta)
+        _write_json(_path(f"{name}.json"), meta)
+
+        for old in range(version - KEEP_VERSIONS, 0, -1):
+            stale = [_path(f"{name}-v{old}.joblib"), _path(f"{name}-v{old}.json")]
+            if not os.path.exists(stale[0]):
+                break
+            for p in stale:
+                if os.path.exists(p):
+                    os.remove(p)
+
+        return version
+
+
+def load_model(name, version=None):
+    """Return (payload, meta) for the latest (or given) version of `name`, or (None, None)."""
+    pointer = f"{name}-v{version}.json" if version else f"{name}.json"
+    meta = _read_json(_path(pointer))
+    if meta is None:
+        return None, None
+    try:
+        return joblib.load(_path(meta["file"])), meta
+    except Exception as e:
+        print(f"Failed to load model {name} v{meta.get('version')}:", e)
+        return None, None
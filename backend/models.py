@@ -16,7 +16,10 @@ class Alert(Base):
     __tablename__ = "alerts"
 
     id = Column(Integer, primary_key=True, index=True)
-    timestamp = Column(DateTime)
+    timestamp = Column(DateTime, index=True)
     severity = Column(String)
     reason = Column(String)
     status = Column(String, default="open")
+    # stable identity of an alert (source + window), so re-running the
+    # pipeline updates existing alerts instead of adding duplicates
+    alert_key = Column(String, unique=True, index=True)
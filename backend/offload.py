@@ -0,0 +1,53 @@
+import asyncio
+import functools
+from concurrent.futures import ThreadPoolExecutor
+
+
+class Offload:
+    """Run blocking work for async handlers on a dedicated, bounded executor.
+
+    Each kind of work (window computation, history queries, database pages,
+    pipeline runs) gets its own Offload, so a slow one can only exhaust its
+    own threads, never the shared threadpool other requests use. At most
+    `limit` calls run or queue on the executor at once; the rest wait on the
+    event loop. Calls made with the same `key` while one is in flight share
+    that computation instead of starting their own.
+    """
+
+    def __init__(self, name, workers=2, limit=None):
+        self.name = name
+        self.executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix=name)
+        self.limit = limit or workers
+        self.inflight = {}
+        self.semaphore = None
+        self.loop = None
+
+    def _semaphore(self):
+        # created on first use, and again if the app is run on a new loop
+        loop = asyncio.get_running_loop()
+        if self.loop is not loop:
+            self.loop = loop
+            self.semaphore = asyncio.Semaphore(self.limit)
+            self.inflight = {}
+        return self.semaphore
+
+    async def _call(self, fn, args, kwargs):
+        async with self._semaphore():
+            return await asyncio.get_running_loop().run_in_executor(
+                self.executor, functools.partial(fn, *args, **kwargs)
+            )
+
+    async def run(self, fn, *args, key=None, **kwargs):
+        self._semaphore()
+        if key is not None and key in self.inflight:
+            return await asyncio.shield(self.inflight[key])
+
+        task = asyncio.ensure_future(self._call(fn, args, kwargs))
+        if key is not None:
+            self.inflight[key] = task
+            task.add_done_callback(lambda _: self.inflight.pop(key, None))
+        # shielded: a caller that disconnects does not cancel work others wait on
+        return await asyncio.shield(task)
+
+    def shutdown(self):
+        self.executor.shutdown(wait=False, cancel_futures=True)
@@ -0,0 +1,482 @@
+import ipaddress
+import multiprocessing as mp
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+import pandas as pd
+
+from alert_engine import explain_metrics, generate_alert
+from metrics import FLOW_DETAIL_COLUMNS, METRICS_MODE, grouped_window_kernel
+from sketches import TOP_K, HyperLogLog, hash64, heavy_entropy
+
+# newest rows of each sensor behind each view: metrics over 200, traffic mix
+# and top talkers over 1000, topology and alert details over 2000. Per sensor
+# in every FLOW_FORMAT: with a shared flows file the sensors' windows are cut
+# from its newest 2000 rows, so the merged metrics cover up to 200 per sensor
+WINDOWS = {"metrics": 200, "traffic": 1000, "graph": 2000}
+
+AGG_WORKERS = int(os.environ.get("AGG_WORKERS", min(4, os.cpu_count() or 1)))
+# fewer changed partitions than this are summarized inline: a pool round trip costs more
+POOL_MIN = 8
+
+EDGE_KEYS = ["src_ip", "dst_ip"]
+
+# METRICS_MODE=sketch bounds every summary, merged ones included: the heaviest
+# edges and (src, dst, port) triples up to these caps, the rest of the edges
+# folded into one unaddressed row, and HyperLogLogs and top-K counts for the
+# metrics the caps would distort (fan-out, entropy, top talkers)
+SKETCH_EDGES = int(os.environ.get("SKETCH_EDGES", "2000"))
+SKETCH_PORTS = int(os.environ.get("SKETCH_PORTS", "2000"))
+SKETCH_TOP = 4 * TOP_K
+
+
+def _numeric(df, col):
+    return pd.to_numeric(df[col], errors="coerce")
+
+
+def _factorize(values):
+    # sorted codes with missing values as code 0, so NaN survives as a key
+    codes, uniques = pd.factorize(np.asarray(values, dtype=object), sort=True)
+    return codes.astype(np.int64) + 1, np.concatenate(([np.nan], uniques.astype(object)))
+
+
+def _edges(s, d, n_dst, b):
+    # distinct (src, dst) code pairs come out of np.unique in (src, dst) order
+    pairs, inverse = np.unique(s * n_dst + d, return_inverse=True)
+    return pairs, np.bincount(inverse, weights=b, minlength=len(pairs)), np.bincount(inverse, minlength=len(pairs))
+
+
+def _per_key(keys, totals):
+    seen = totals[1:] > 0
+    return pd.Series(totals[1:][seen], index=keys[1:][seen])
+
+
+class _Columns:
+    """One partition's flow columns as codes and arrays, read once for every window size."""
+
+    def __init__(self, df, mode=None):
+        self.s, self.src = _factorize(df["src_ip"])
+        self.d, self.dst = _factorize(df["dst_ip"])
+        self.sketch = (mode or METRICS_MODE) == "sketch"
+        if self.sketch:
+            # every address hashed once, as TrafficSketch.update does per row
+            self.hs = hash64(self.src)
+            self.hd = hash64(self.dst)
+        self.b = _numeric(df, "bytes").fillna(0).to_numpy(np.float64)
+        if "protocol" in df.columns:
+            self.p, self.protocols = pd.factorize(df["protocol"])
+        else:
+            self.p, self.protocols = np.full(len(df), -1), pd.Index([])
+        self.detail = all(c in df.columns for c in FLOW_DETAIL_COLUMNS)
+        if self.detail:
+            self.port = _numeric(df, "dst_port").fillna(-1).to_numpy(np.int64)
+            syn = _numeric(df, "syn").fillna(0).to_numpy()
+            replies = _numeric(df, "rev_packets").fillna(0).to_numpy()
+            self.half_open = (_numeric(df, "protocol").to_numpy() == 6) & (syn > 0) & (replies == 0)
+            self.duration = (_numeric(df, "last_seen") - _numeric(df, "first_seen")).to_numpy()
+
+    def summarize(self, rows):
+        """Summary of the newest `rows` flows."""
+        tail = slice(-rows, None) if rows < len(self.b) else slice(None)
+        s, d, b = self.s[tail], self.d[tail], self.b[tail]
+        n_dst = len(self.dst)
+
+        pairs, edge_bytes, edge_flows = _edges(s, d, n_dst, b)
+        edges = pd.DataFrame({
+            "src_ip": self.src[pairs // n_dst],
+            "dst_ip": self.dst[pairs % n_dst],
+            "bytes": edge_bytes,
+            "flows": edge_flows,
+        })
+
+        p = self.p[tail]
+        ok = p >= 0
+        protocols = pd.Series(np.bincount(p[ok], weights=b[ok], minlength=len(self.protocols)),
+                              index=self.protocols)
+
+        summary = {"rows": len(b), "edges": edges, "protocols": protocols[protocols.index.notna()],
+                   "detail": None, "sketch": None}
+        if self.detail:
+            port = self.port[tail]
+            ok = (s > 0) & (d > 0) & (port >= 0)
+            triples = np.unique((s[ok] * n_dst + d[ok]) * 65536 + port[ok])
+            duration = self.duration[tail]
+            duration = duration[~np.isnan(duration)]
+            summary["detail"] = {
+                "ports": pd.DataFrame({
+                    "src_ip": self.src[triples // 65536 // n_dst],
+                    "dst_ip": self.dst[triples // 65536 % n_dst],
+                    "dst_port": triples % 65536,
+                }),
+                "half_open": int(self.half_open[tail].sum()),
+                "duration_sum": float(duration.sum()),
+                "duration_n": len(duration),
+            }
+        if self.sketch:
+            summary["sketch"] = self._sketch(s, d, b)
+            _bound(summary)
+        return summary
+
+    def _sketch(self, s, d, b):
+        pair = (s > 0) & (d > 0)
+        with np.errstate(over="ignore"):
+            hp = pd.util.hash_array(self.hs[s[pair]] * np.uint64(0x9E3779B97F4A7C15) ^ self.hd[d[pair]])
+        sketch = {"src": HyperLogLog(), "dst": HyperLogLog(), "pair": HyperLogLog(), "dst_rows": int((d > 0).sum())}
+        sketch["src"].add_hashes(self.hs[s[s > 0]])
+        sketch["dst"].add_hashes(self.hd[d[d > 0]])
+        sketch["pair"].add_hashes(hp)
+        # per-address totals, code 0 (missing) left out
+        sketch["dst_flows"] = _per_key(self.dst, np.bincount(d, minlength=len(self.dst)))
+        sketch["src_bytes"] = _per_key(self.src, np.bincount(s, weights=b, minlength=len(self.src)))
+        sketch["dst_bytes"] = _per_key(self.dst, np.bincount(d, weights=b, minlength=len(self.dst)))
+        return sketch
+
+
+def summarize(df, windows=None, mode=None):
+    """Mergeable summary of one partition's flows, or None for no flows.
+
+    Holds everything the dashboard views need: bytes and flow counts per
+    (src, dst) edge, bytes per protocol and, when the flows carry ports and
+    flags, the distinct (src, dst, port) triples, half-open TCP flows and
+    flow durations. Summaries of disjoint flow sets merge exactly. In
+    sketch mode (`mode` or METRICS_MODE) the summary is bounded instead;
+    see SKETCH_EDGES.
+
+    With `windows` ({name: rows}), one summary per entry, each over the
+    newest `rows` flows, all from a single pass of factorizing the columns.
+    """
+    if df is None or df.empty:
+        return None if windows is None else dict.fromkeys(windows)
+    columns = _Columns(df, mode)
+    if windows is None:
+        return columns.summarize(len(df))
+    return {name: columns.summarize(rows) for name, rows in windows.items()}
+
+
+def _merged_hll(hlls):
+    out = HyperLogLog()
+    for h in hlls:
+        out.merge(h)
+    return out
+
+
+def _capped(series, k):
+    return series.nlargest(k) if len(series) > k else series
+
+
+def _bound(summary):
+    """Cut a sketch-mode summary back to its caps, in place."""
+    edges = summary["edges"]
+    if len(edges) > SKETCH_EDGES:
+        order = np.argsort(-edges["bytes"].to_numpy(), kind="stable")
+        kept, rest = edges.iloc[np.sort(order[:SKETCH_EDGES])], edges.iloc[order[SKETCH_EDGES:]]
+        # what is cut still counts toward the totals, under no address
+        other = pd.DataFrame({"src_ip": [np.nan], "dst_ip": [np.nan],
+                              "bytes": [rest["bytes"].sum()], "flows": [rest["flows"].sum()]})
+        summary["edges"] = (pd.concat([kept, other], ignore_index=True)
+                            .groupby(EDGE_KEYS, dropna=False, sort=False).sum().reset_index())
+
+    detail = summary["detail"]
+    if detail is not None and len(detail["ports"]) > SKETCH_PORTS:
+        # keep whole pairs, those probing the most ports first, so max_dst_ports holds
+        ports = detail["ports"]
+        per_pair = ports.groupby(EDGE_KEYS, sort=False)["dst_port"].transform("size")
+        order = np.argsort(-per_pair.to_numpy(), kind="stable")[:SKETCH_PORTS]
+        detail["ports"] = ports.iloc[np.sort(order)].reset_index(drop=True)
+
+    sketch = summary["sketch"]
+    for name in ("dst_flows", "src_bytes", "dst_bytes"):
+        sketch[name] = _capped(sketch[name], SKETCH_TOP)
+
+
+def merge(summaries):
+    """One summary covering all of `summaries` (None entries are skipped).
+
+    Sensors are taken to see disjoint flows: bytes, flows and counters add
+    up, and the (src, dst, port) triples, being distinct values, are the
+    union of every sensor's set.
+    """
+    summaries = [s for s in summaries if s is not None]
+    if len(summaries) <= 1:
+        return summaries[0] if summaries else None
+
+    edges = (pd.concat([s["edges"] for s in summaries], ignore_index=True)
+             .groupby(EDGE_KEYS, dropna=False).sum().reset_index())
+    protocols = pd.concat([s["protocols"] for s in summaries]).groupby(level=0).sum()
+
+    details = [s["detail"] for s in summaries if s["detail"] is not None]
+    detail = None
+    if details:
+        detail = {
+            "ports": pd.concat([d["ports"] for d in details], ignore_index=True).drop_duplicates(),
+            "half_open": sum(d["half_open"] for d in details),
+            "duration_sum": sum(d["duration_sum"] for d in details),
+            "duration_n": sum(d["duration_n"] for d in details),
+        }
+
+    merged = {
+        "rows": sum(s["rows"] for s in summaries),
+        "edges": edges,
+        "protocols": protocols,
+        "detail": detail,
+        "sketch": None,
+    }
+
+    sketches = [s["sketch"] for s in summaries]
+    if all(sk is not None for sk in sketches):
+        merged["sketch"] = {name: _merged_hll(sk[name] for sk in sketches) for name in ("src", "dst", "pair")}
+        merged["sketch"]["dst_rows"] = sum(sk["dst_rows"] for sk in sketches)
+        for name in ("dst_flows", "src_bytes", "dst_bytes"):
+            merged["sketch"][name] = pd.concat([sk[name] for sk in sketches]).groupby(level=0).sum()
+        _bound(merged)
+    return merged
+
+
+def _addressed(edges):
+    return edges["src_ip"].notna().to_numpy() & edges["dst_ip"].notna().to_numpy()
+
+
+def _totals(keys, weights=None):
+    # groupby-sum without the groupby: (distinct non-missing keys, their summed weights)
+    codes, uniques = pd.factorize(keys)
+    ok = codes >= 0
+    weights = None if weights is None else np.asarray(weights, dtype=np.float64)[ok]
+    return uniques, np.bincount(codes[ok], weights=weights, minlength=len(uniques))
+
+
+def metrics_view(summary):
+    """The window's metrics row, from a summary."""
+    if summary is None:
+        return []
+
+    edges = summary["edges"]
+    total_bytes = int(edges["bytes"].sum())
+
+    sketch = summary["sketch"]
+    if sketch is not None:
+        # HLL fan-out, heavy-hitter entropy
+        entropy = heavy_entropy(sketch["dst_flows"].tolist(), sketch["dst_rows"], sketch["dst"].estimate())
+        sources = sketch["src"].estimate()
+        fan_out = sketch["pair"].estimate() / sources if sources >= 1 else 0.0
+    else:
+        # one window over the edges, each weighted by its flow count
+        k = grouped_window_kernel(np.zeros(len(edges), dtype=np.int64), edges["src_ip"], edges["dst_ip"],
+                                  edges["bytes"], flows=edges["flows"], n_groups=1)
+        entropy, fan_out = k["dst_ip_entropy"][0], k["avg_fan_out"][0]
+
+    m = {
+        "timestamp": int(time.time() * 1000),
+        "total_bytes": total_bytes,
+        "throughput_mbps": float(round((total_bytes / 5) / (1024 * 1024), 3)),
+        "dst_ip_entropy": float(round(entropy, 3)),
+        "avg_fan_out": float(round(fan_out, 2)),
+    }
+
+    detail = summary["detail"]
+    if detail is not None:
+        # ports holds distinct (src, dst, port) triples: count them per (src, dst)
+        s, _ = pd.factorize(detail["ports"]["src_ip"])
+        d, dst = pd.factorize(detail["ports"]["dst_ip"])
+        _, per_pair = np.unique(s.astype(np.int64) * max(len(dst), 1) + d, return_counts=True)
+        m["max_dst_ports"] = int(per_pair.max()) if len(per_pair) else 0
+        m["half_open_flows"] = detail["half_open"]
+        m["avg_duration"] = (float(round(detail["duration_sum"] / detail["duration_n"], 3))
+                             if detail["duration_n"] else 0.0)
+    return [m]
+
+
+def protocols_view(summary):
+    if summary is None:
+        return []
+    grouped = summary["protocols"].sort_values(ascending=False)
+    return [{"protocol": p, "bytes": int(b)} for p, b in grouped.items()]
+
+
+def _top(keys, weights, top_n):
+    ips, sums = _totals(keys, weights)
+    order = np.argsort(-sums, kind="stable")[:top_n]
+    return [{"ip": ips[i], "bytes": int(sums[i])} for i in order]
+
+
+def top_talkers_view(summary, top_n=5):
+    if summary is None:
+        return {"src": [], "dst": []}
+    sketch = summary["sketch"]
+    if sketch is not None:
+        return {"src": _top(sketch["src_bytes"].index, sketch["src_bytes"].to_numpy(), top_n),
+                "dst": _top(sketch["dst_bytes"].index, sketch["dst_bytes"].to_numpy(), top_n)}
+    edges = summary["edges"]
+    return {"src": _top(edges["src_ip"], edges["bytes"], top_n),
+            "dst": _top(edges["dst_ip"], edges["bytes"], top_n)}
+
+
+def topology_view(summary):
+    """Edges as columns (src_ip, dst_ip, bytes), heaviest first."""
+    if summary is None:
+        return {"src_ip": [], "dst_ip": [], "bytes": []}
+    # edges come out of the groupby ordered by (src, dst); ties keep that order
+    edges = summary["edges"]
+    edges = edges[_addressed(edges)].sort_values("bytes", ascending=False, kind="stable")
+    return {
+        "src_ip": edges["src_ip"].tolist(),
+        "dst_ip": edges["dst_ip"].tolist(),
+        "bytes": edges["bytes"].to_numpy().astype("int64").tolist(),
+    }
+
+
+def details_view(summary):
+    if summary is None:
+        return {}
+    metrics = metrics_view(summary)
+    m = metrics[0] if metrics else {}
+    return {
+        "metrics": m,
+        "top_talkers": top_talkers_view(summary, top_n=3),
+        "protocols": protocols_view(summary)[:8],
+        "explanations": explain_metrics(m),
+    }
+
+
+def views(summaries):
+    """The dashboard sections (all but alerts) from one summary per WINDOWS entry."""
+    return {
+        "metrics": metrics_view(summaries["metrics"]),
+        "protocols": protocols_view(summaries["traffic"]),
+        "top_talkers": top_talkers_view(summaries["traffic"], top_n=5),
+        "topology": topology_view(summaries["graph"]),
+        "alert_details": details_view(summaries["graph"]),
+    }
+
+
+def subnets(ips):
+    """The /24 of each IPv4 address and /64 of each IPv6 one; None for anything else ("other")."""
+    ips = pd.Series(ips, dtype=object)
+    out = pd.Series(None, index=ips.index, dtype=object)
+    v4 = ips.str.fullmatch(r"\d{1,3}\.\d{1,3}\.\d{1,3}\.\d{1,3}").fillna(False).astype(bool)
+    out[v4] = ips[v4].str.rpartition(".")[0] + ".0/24"
+    v6 = ips.str.contains(":", regex=False).fillna(False)
+    out[v6] = [_subnet64(ip) for ip in ips[v6]]
+    return out.to_numpy()
+
+
+def _subnet64(ip):
+    try:
+        return str(ipaddress.ip_network(f"{ip}/64", strict=False))
+    except ValueError:
+        return None
+
+
+def entity_features(summary):
+    """Per-entity FEATURES from a summary: one row per source IP and per source subnet.
+
+    Returns (keys, kinds, X) with kinds "host" or "subnet" and X rows of
+    (total_bytes, dst_ip_entropy, avg_fan_out), each defined as for the whole
+    window but over the entity's own edges: a host's fan-out is its distinct
+    destinations, a subnet's the mean over its hosts.
+    """
+    if summary is None:
+        return np.empty(0, dtype=object), np.empty(0, dtype=object), np.empty((0, 3))
+
+    edges = summary["edges"]
+    edges = edges[_addressed(edges)]
+    s, hosts = pd.factorize(edges["src_ip"])
+
+    # anything but an address (the agent's "other" row) is no entity
+    host_subnet = subnets(hosts)
+    valid = pd.notna(host_subnet)
+    sub, nets = pd.factorize(host_subnet)
+    keep = valid[s]
+    s, edges = s[keep], edges[keep]
+    d, _ = pd.factorize(edges["dst_ip"])
+
+    # the window metrics kernel with entities for windows: a subnet's
+    # fan-out comes out as the mean over its hosts, as avg_fan_out is
+    host_x = _entity_features(s, s, d, edges, len(hosts))[valid]
+    net_x = _entity_features(sub[s], s, d, edges, len(nets))
+
+    keys = np.concatenate((np.asarray(hosts, dtype=object)[valid], np.asarray(nets, dtype=object)))
+    kinds = np.array(["host"] * len(host_x) + ["subnet"] * len(net_x), dtype=object)
+    return keys, kinds, np.vstack((host_x, net_x))
+
+
+def _entity_features(g, s, d, edges, n):
+    # g maps each edge to its entity 0..n-1; s and d are its address codes
+    k = grouped_window_kernel(g, s, d, edges["bytes"], flows=edges["flows"], n_groups=n)
+    return np.column_stack((k["total_bytes"], k["dst_ip_entropy"], k["avg_fan_out"]))
+
+
+def aggregate(df, windows=WINDOWS):
+    """Summaries and views of one sensor's flows; runs in a pool worker.
+
+    A sensor's alerts come from the rules alone: the detector's baseline is
+    the whole network, so it only scores the merged view.
+    """
+    summaries = summarize(df, windows)
+    sections = views(summaries)
+    metrics = sections["metrics"]
+    sections["alerts"] = {"alerts": generate_alert(metrics[0], 0.0), "score": None} if metrics else []
+    return summaries, sections
+
+
+def aggregate_many(frames, windows=WINDOWS):
+    return [aggregate(df, windows) for df in frames]
+
+
+class PartitionAggregator:
+    """Per-sensor aggregation, cached by partition and spread over a process pool.
+
+    `run` takes {sensor: (token, flows)} and returns {sensor: (token,
+    summaries, views)} plus the sensors it recomputed. A partition whose token is unchanged since the last
+    call is not recomputed, so a window only pays for the sensors that sent
+    something. Changed partitions are summarized inline when there are few of
+    them, otherwise in `workers` spawned processes, a chunk of sensors each.
+    """
+
+    def __init__(self, windows=WINDOWS, workers=AGG_WORKERS, pool_min=POOL_MIN):
+        self.windows = windows
+        self.workers = workers
+        self.pool_min = pool_min
+        self.pool = None
+        self.cache = {}
+
+    def _aggregate(self, frames):
+        if self.workers <= 1 or len(frames) < self.pool_min:
+            return aggregate_many(frames, self.windows)
+
+        if self.pool is None:
+            # spawn, not fork: the server process has threads running
+            self.pool = ProcessPoolExecutor(max_workers=self.workers, mp_context=mp.get_context("spawn"))
+        chunks = [frames[i::self.workers] for i in range(self.workers)]
+        try:
+            results = list(self.pool.map(aggregate_many, chunks, [self.windows] * len(chunks)))
+        except Exception as e:
+            print("partition pool failed, aggregating inline:", e)
+            self.close()
+            return aggregate_many(frames, self.windows)
+
+        # undo the round-robin chunking
+        out = [None] * len(frames)
+        for i, chunk in enumerate(results):
+            out[i::self.workers] = chunk
+        return out
+
+    def run(self, partitions):
+        stale = [
+            (sensor, token, df) for sensor, (token, df) in partitions.items()
+            if token is None or sensor not in self.cache or self.cache[sensor][0] != token
+        ]
+        results = self._aggregate([df for _, _, df in stale])
+
+        # sensors that disappeared from the partitions are forgotten
+        cache = {s: self.cache[s] for s in partitions if s in self.cache}
+        for (sensor, token, _), (summaries, sections) in zip(stale, results):
+            cache[sensor] = (token, summaries, sections)
+        self.cache = cache
+        return cache, [sensor for sensor, _, _ in stale]
+
+    def close(self):
+        if self.pool is not None:
+            self.pool.shutdown(wait=False, cancel_futures=True)
+            self.pool = None
@@ -0,0 +1,69 @@
+from sqlalchemy import inspect, text
+from sqlalchemy.dialects import postgresql, sqlite
+
+import models
+from database import engine
+
+# rows per INSERT statement; well under SQLite's bound-parameter limit
+BATCH_SIZE = 2000
+
+
+def ensure_schema(bind=engine):
+    """Create missing tables, then add columns and indexes newer than an existing database."""
+    models.Base.metadata.create_all(bind=bind)
+
+    columns = {c["name"] for c in inspect(bind).get_columns("alerts")}
+    if "alert_key" not in columns:
+        with bind.begin() as conn:
+            conn.execute(text("ALTER TABLE alerts ADD COLUMN alert_key VARCHAR"))
+
+    # create_all skips tables that already exist, so their indexes are checked
+    # one by one; NULL alert keys (pre-existing alerts) never collide
+    for table in models.Base.metadata.sorted_tables:
+        for index in table.indexes:
+            index.create(bind=bind, checkfirst=True)
+
+
+def _insert(db, table):
+    dialect = db.get_bind().dialect.name
+    if dialect == "sqlite":
+        return sqlite.insert(table)
+    if dialect == "postgresql":
+        return postgresql.insert(table)
+    raise RuntimeError(f"bulk upsert not supported for {dialect}")
+
+
+def _chunks(rows, size):
+    for i in range(0, len(rows), size):
+        yield rows[i:i + size]
+
+
+def upsert_windows(db, rows, batch_size=BATCH_SIZE):
+    """Insert or update FlowWindow rows (dicts keyed by column name) by timestamp."""
+    table = models.FlowWindow.__table__
+    stmt = _insert(db, table)
+    stmt = stmt.on_conflict_do_update(
+        index_elements=[table.c.timestamp],
+        set_={c.name: stmt.excluded[c.name] for c in table.columns if c.name != "timestamp"},
+    )
+    for chunk in _chunks(rows, batch_size):
+        db.execute(stmt, chunk)
+
+
+def upsert_alerts(db, rows, batch_size=BATCH_SIZE):
+    """Insert Alert rows keyed by `alert_key`; a rerun refreshes severity and reason but keeps status."""
+    table = models.Alert.__table__
+    stmt = _insert(db, table)
+    stmt = stmt.on_conflict_do_update(
+        index_elements=[table.c.alert_key],
+        set_={"severity": stmt.excluded.severity, "reason": stmt.excluded.reason},
+    )
+    for chunk in _chunks(rows, batch_size):
+        db.execute(stmt, chunk)
+
+
+def delete_alerts(db, keys, batch_size=BATCH_SIZE):
+    """Delete the Alert rows with these `alert_key`s (ones a rerun no longer raises)."""
+    table = models.Alert.__table__
+    for chunk in _chunks(list(keys), batch_size):
+        db.execute(table.delete().where(table.c.alert_key.in_(chunk)))
@@ -0,0 +1,195 @@
+import heapq
+import math
+
+import numpy as np
+import pandas as pd
+
+# default error bounds for the sketch metrics mode
+HLL_ERROR = 0.01        # relative standard error of distinct counts
+CMS_EPSILON = 0.0005    # count-min overestimate <= epsilon * total weight ...
+CMS_DELTA = 0.01        # ... with probability 1 - delta
+TOP_K = 64              # heavy hitters tracked per key type
+
+
+def hash64(values):
+    """Vectorized 64-bit hash of an array of strings (or anything hashable by pandas)."""
+    return pd.util.hash_array(np.asarray(values, dtype=object))
+
+
+def heavy_entropy(heavy, n, distinct):
+    """Entropy of `n` items from the counts of the heaviest keys, the rest of
+    the mass spread evenly over the other `distinct` - len(heavy) keys."""
+    if n == 0:
+        return 0.0
+    heavy = [min(c, n) for c in heavy]
+    h = 0.0
+    for c in heavy:
+        if c > 0:
+            p = c / n
+            h -= p * math.log2(p)
+    rest_mass = max(0.0, n - sum(heavy))
+    rest_keys = max(1.0, distinct - len(heavy))
+    if rest_mass > 0:
+        p = rest_mass / n
+        h -= p * math.log2(p / rest_keys)
+    return h
+
+
+class HyperLogLog:
+    def __init__(self, error=HLL_ERROR):
+        self.p = max(4, min(18, math.ceil(math.log2((1.04 / error) ** 2))))
+        self.m = 1 << self.p
+        self.registers = np.zeros(self.m, dtype=np.uint8)
+
+    def add_hashes(self, h):
+        if len(h) == 0:
+            return
+        h = np.asarray(h, dtype=np.uint64)
+        idx = (h >> np.uint64(64 - self.p)).astype(np.int64)
+        rest = h & np.uint64((1 << (64 - self.p)) - 1)
+        # rank = position of the leftmost 1-bit in the remaining 64-p bits
+        _, bit_length = np.frexp(rest.astype(np.float64))
+        rank = np.where(rest == 0, 64 - self.p + 1, 64 - self.p - bit_length + 1).astype(np.uint8)
+        np.maximum.at(self.registers, idx, rank)
+
+    def merge(self, other):
+        np.maximum(self.registers, other.registers, out=self.registers)
+
+    def estimate(self):
+        m = self.m
+        alpha = 0.7213 / (1 + 1.079 / m)
+        raw = alpha * m * m / np.sum(np.exp2(-self.registers.astype(np.float64)))
+        zeros = int(np.count_nonzero(self.registers == 0))
+        if raw <= 2.5 * m and zeros:
+            return m * math.log(m / zeros)
+        return float(raw)
+
+
+class CountMinSketch:
+    def __init__(self, epsilon=CMS_EPSILON, delta=CMS_DELTA, seed=7):
+        self.width = math.ceil(math.e / epsilon)
+        self.depth = math.ceil(math.log(1 / delta))
+        self.table = np.zeros((self.depth, self.width), dtype=np.float64)
+        rng = np.random.default_rng(seed)
+        self.salts = rng.integers(1, 2 ** 63, self.depth, dtype=np.uint64) | np.uint64(1)
+        self.total = 0.0
+
+    def _columns(self, h):
+        with np.errstate(over="ignore"):
+            return [((h * s) >> np.uint64(32)) % np.uint64(self.width) for s in self.salts]
+
+    def add(self, h, weights):
+        for row, cols in zip(self.table, self._columns(h)):
+            row += np.bincount(cols.astype(np.int64), weights=weights, minlength=self.width)
+        self.total += float(np.sum(weights))
+
+    def estimate(self, h):
+        est = [row[cols.astype(np.int64)] for row, cols in zip(self.table, self._columns(h))]
+        return np.min(est, axis=0)
+
+
+class TopK:
+    """Count-Min sketch plus a bounded candidate set of the heaviest keys."""
+
+    def __init__(self, k=TOP_K, epsilon=CMS_EPSILON, delta=CMS_DELTA):
+        self.k = k
+        self.cms = CountMinSketch(epsilon, delta)
+        self.candidates = {}
+
+    def add(self, h, weights, keys):
+        """Add `weights` for items with hashes `h`; `keys` are the printable items."""
+        if len(h) == 0:
+            return
+        # collapse the batch first so the candidate set is touched once per key
+        codes, uniq = pd.factorize(h)
+        summed = np.bincount(codes, weights=weights, minlength=len(uniq))
+        first = np.full(len(uniq), len(codes))
+        np.minimum.at(first, codes, np.arange(len(codes)))
+        self.cms.add(uniq, summed)
+
+        # only keys that could make the candidate set need their estimates
+        limit = 4 * self.k
+        est = self.cms.estimate(uniq)
+        if len(uniq) > limit:
+            best = np.argpartition(est, -limit)[-limit:]
+        else:
+            best = np.arange(len(uniq))
+
+        merged = dict(self.candidates)
+        batch_keys = keys[first[best]]
+        for key, e in zip(batch_keys, est[best]):
+            merged[key] = e
+
+        # refresh old candidates' estimates, which grow as the stream continues
+        seen = set(batch_keys)
+        old = [k for k in merged if k not in seen]
+        if old:
+            for key, e in zip(old, self.cms.estimate(hash64(old))):
+                merged[key] = e
+
+        if len(merged) > limit:
+            merged = dict(heapq.nlargest(limit, merged.items(), key=lambda kv: kv[1]))
+        self.candidates = merged
+
+    def top(self, n):
+        return heapq.nlargest(n, self.candidates.items(), key=lambda kv: kv[1])
+
+
+class TrafficSketch:
+    """Bounded-memory stand-in for the exact pandas window metrics.
+
+    Fan-out is distinct (src, dst) pairs over distinct sources, each from a
+    HyperLogLog, which equals the mean of per-source distinct destinations.
+    Destination entropy is estimated from the heavy-hitter destinations plus
+    the remaining mass spread evenly over the rest of the distinct destinations.
+    """
+
+    def __init__(self, error=HLL_ERROR, epsilon=CMS_EPSILON, delta=CMS_DELTA, k=TOP_K):
+        self.src_hll = HyperLogLog(error)
+        self.dst_hll = HyperLogLog(error)
+        self.pair_hll = HyperLogLog(error)
+        # a deeper heavy-hitter set for entropy: the head carries most of it
+        self.dst_rows = TopK(4 * k, epsilon, delta)
+        self.src_bytes = TopK(k, epsilon, delta)
+        self.dst_bytes = TopK(k, epsilon, delta)
+        self.total_bytes = 0
+        self.count = 0
+
+    def update(self, df):
+        src = df["src_ip"].to_numpy(dtype=object)
+        dst = df["dst_ip"].to_numpy(dtype=object)
+        b = pd.to_numeric(df["bytes"], errors="coerce").fillna(0).to_numpy(dtype=np.float64)
+
+        # each column is hashed once and the hashes shared by every sketch
+        hs = hash64(src)
+        hd = hash64(dst)
+        with np.errstate(over="ignore"):
+            hp = pd.util.hash_array(hs * np.uint64(0x9E3779B97F4A7C15) ^ hd)
+
+        self.src_hll.add_hashes(hs)
+        self.dst_hll.add_hashes(hd)
+        self.pair_hll.add_hashes(hp)
+        self.dst_rows.add(hd, np.ones(len(dst)), dst)
+        self.src_bytes.add(hs, b, src)
+        self.dst_bytes.add(hd, b, dst)
+        self.total_bytes += int(b.sum())
+        self.count += len(df)
+        return self
+
+    def entropy(self):
+        if self.count == 0:
+            return 0.0
+        heavy = [c for _, c in self.dst_rows.top(self.dst_rows.k)]
+        return heavy_entropy(heavy, self.count, self.dst_hll.estimate())
+
+    def fan_out(self):
+        sources = self.src_hll.estimate()
+        if sources < 1:
+            return 0.0
+        return self.pair_hll.estimate() / sources
+
+    def top_talkers(self, top_n=5):
+        return {
+            "src": [{"ip": ip, "bytes": int(b)} for ip, b in self.src_bytes.top(top_n)],
+            "dst": [{"ip": ip, "bytes": int(b)} for ip, b in self.dst_bytes.top(top_n)],
+        }
@@ -1,21 +1,212 @@
-import pandas as pd
+import json
 import os
 
-CSV_PATH = r"C:\VENOM\Coding\NOP\network-observability\data\flows.csv"
+import pandas as pd
+
+import ingest
+from flow_reader import FlowTailReader
+
+try:
+    import pyarrow as pa
+except ImportError:
+    pa = None
+
+DATA_DIR = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "data")
+CSV_PATH = os.environ.get("FLOWS_CSV", os.path.join(DATA_DIR, "flows.csv"))
+SEGMENT_DIR = os.path.join(DATA_DIR, "flow_segments")
+
+# "csv" or "arrow" (files shared with the agent) or "push" (agents POST to
+# /api/ingest); must match the agent's FLOW_FORMAT
+FLOW_FORMAT = os.environ.get("FLOW_FORMAT", "csv")
+
+# largest window any endpoint asks for; bigger requests are clamped
+MAX_ROWS = 5000
+
+_reader = FlowTailReader(CSV_PATH, capacity=MAX_ROWS)
+
+AGENT_STATS_PATH = os.path.join(DATA_DIR, "agent_stats.json")
+
+# volume columns an overloaded agent under-reports by its sampling rate
+SAMPLED_COLUMNS = ["bytes", "packets", "rev_bytes", "rev_packets"]
+
+# sensor of rows written before the agent recorded one
+DEFAULT_SENSOR = "local"
+
+
+def _read_manifest():
+    path = os.path.join(SEGMENT_DIR, "manifest.json")
+    if not os.path.exists(path):
+        return []
+    with open(path) as f:
+        return json.load(f)["segments"]
+
+
+def _read_segment(seg):
+    path = os.path.join(SEGMENT_DIR, seg["file"])
+    if not seg["file"].endswith(".arrows"):
+        # an older agent's IPC file, never written again: memory-mapped, so
+        # column buffers are read straight from the page cache
+        with pa.memory_map(path, "r") as source:
+            return pa.ipc.open_file(source).read_all()
+
+    # a stream the agent may still be appending to: read (not mapped, which
+    # would keep the file locked on Windows) up to its last complete batch
+    batches = []
+    with pa.OSFile(path, "r") as source:
+        reader = pa.ipc.open_stream(source)
+        while True:
+            try:
+                batches.append(reader.read_next_batch())
+            except StopIteration:
+                break
+            except (OSError, pa.ArrowInvalid):
+                # the batch the agent is writing right now
+                break
+    return pa.Table.from_batches(batches, schema=reader.schema)
+
+
+def load_segment_flows(start_ts=None, end_ts=None, rows=None):
+    """Read flows from the Arrow segment log, skipping segments outside [start_ts, end_ts].
+
+    With `rows`, segments are read newest first and only until that many rows are
+    collected, and just the last `rows` rows are returned.
+    """
+    if pa is None:
+        raise RuntimeError("pyarrow is required to read arrow flow segments")
+
+    segments = [
+        s for s in _read_manifest()
+        if (start_ts is None or s["max_ts"] >= start_ts)
+        and (end_ts is None or s["min_ts"] <= end_ts)
+    ]
+    segments.sort(key=lambda s: s["min_ts"])
+
+    tables = []
+    count = 0
+    for seg in reversed(segments):
+        try:
+            table = _read_segment(seg)
+        except FileNotFoundError:
+            # deleted by the agent's retention since the manifest was read
+            continue
+        tables.append(table)
+        count += table.num_rows
+        if rows is not None and count >= rows:
+            break
+
+    if not tables:
+        return None
+
+    # segments written before the flow record gained ports/flags get null columns
+    table = pa.concat_tables(reversed(tables), promote_options="default")
+    if rows is not None and table.num_rows > rows:
+        table = table.slice(table.num_rows - rows)
+
+    df = table.to_pandas()
+    if start_ts is not None:
+        df = df[df["timestamp"] >= start_ts]
+    if end_ts is not None:
+        df = df[df["timestamp"] <= end_ts]
+    return df
+
 
-def load_recent_flows(rows=200):
+def scale_sampled(df):
+    """Scale sampled flow records back up to estimated totals (rows without a rate count once)."""
+    if df is None or "sampling" not in df.columns:
+        return df
+    rate = pd.to_numeric(df["sampling"], errors="coerce").fillna(1.0)
+    if (rate == 1.0).all():
+        return df
+    df = df.copy()
+    for col in SAMPLED_COLUMNS:
+        if col in df.columns:
+            df[col] = (pd.to_numeric(df[col], errors="coerce") * rate).round()
+    return df
+
+
+def load_agent_stats():
+    """Latest overload counters (sampling rate, drops) per agent, or None."""
+    if FLOW_FORMAT == "push":
+        return ingest.buffer.agent_stats() or None
     try:
-        if not os.path.exists(CSV_PATH):
-            print("CSV not found:", CSV_PATH)
-            return None
+        with open(AGENT_STATS_PATH) as f:
+            stats = json.load(f)
+            return {stats.pop("sensor", DEFAULT_SENSOR): stats}
+    except (FileNotFoundError, json.JSONDecodeError):
+        return None
 
-        df = pd.read_csv(CSV_PATH)
-        if df.empty:
-            print("CSV empty")
-            return None
 
-        return df.tail(rows)
+def with_sensor(df):
+    """`df` with its `sensor` column filled in (DEFAULT_SENSOR where the agent did not record one)."""
+    if df is None:
+        return None
+    if "sensor" not in df.columns:
+        return df.assign(sensor=DEFAULT_SENSOR)
+    if df["sensor"].isna().any():
+        return df.assign(sensor=df["sensor"].fillna(DEFAULT_SENSOR))
+    return df
+
+
+def load_partitions(rows=200, generation=None):
+    """Recent flows split by sensor: {sensor: (token, newest `rows` rows of it)}.
+
+    The token changes whenever that sensor's rows may have. Pushed flows are
+    partitioned on arrival, each with its own token; a shared flows file is
+    split by its `sensor` column after reading its newest `rows` rows, and
+    every partition carries the file's `generation`. Either way the windows
+    (partitions.WINDOWS) are then cut per sensor, so with a shared file too
+    the metrics cover up to 200 rows of each sensor, not 200 in all.
+    """
+    try:
+        if FLOW_FORMAT == "push":
+            return {sensor: (token, scale_sampled(df)) for sensor, (token, df) in ingest.buffer.tails(rows).items()}
+
+        df = with_sensor(load_file_flows(rows))
+        if df is None:
+            return {}
+        return {sensor: (generation, part) for sensor, part in df.groupby("sensor", sort=False)}
 
     except Exception as e:
         print("CSV read error:", e)
+        return {}
+
+
+def load_file_flows(rows):
+    """Newest `rows` flows from the files the agent writes (CSV or Arrow segments), or None."""
+    if FLOW_FORMAT == "arrow":
+        df = load_segment_flows(rows=rows)
+        if df is None or df.empty:
+            print("No flow segments in", SEGMENT_DIR)
+            return None
+        return scale_sampled(df)
+
+    if not os.path.exists(CSV_PATH):
+        print("CSV not found:", CSV_PATH)
+        return None
+
+    _reader.refresh()
+    df = _reader.tail(rows)
+    if df is None or df.empty:
+        print("CSV empty")
         return None
+
+    return scale_sampled(df)
+
+
+def flows_generation():
+    """Pick up any newly flushed rows and return a token that changes with the data."""
+    if FLOW_FORMAT == "push":
+        return ingest.buffer.generation
+
+    if FLOW_FORMAT == "arrow":
+        # the agent rewrites the manifest on every flush
+        try:
+            return os.stat(os.path.join(SEGMENT_DIR, "manifest.json")).st_mtime_ns
+        except FileNotFoundError:
+            return None
+
+    try:
+        _reader.refresh()
+    except Exception as e:
+        print("CSV read error:", e)
+    return _reader.generation
@@ -0,0 +1,121 @@
+import math
+from collections import Counter, deque
+
+
+def _clogc(c):
+    return c * math.log2(c) if c > 0 else 0.0
+
+
+class _Bucket:
+    __slots__ = ("second", "bytes", "count", "dst", "pairs")
+
+    def __init__(self, second):
+        self.second = second
+        self.bytes = 0
+        self.count = 0
+        self.dst = Counter()
+        self.pairs = Counter()
+
+
+class SlidingWindow:
+    """Incremental stream metrics over the last `window` seconds.
+
+    Packets are added to per-second buckets and folded into running totals as
+    they arrive; when a bucket falls out of the window its contributions are
+    subtracted again. Entropy is kept as S = sum(c * log2 c) over destination
+    counts, so H = log2(N) - S / N and each count change is O(1). Fan-out
+    (mean distinct destinations per source) is distinct (src, dst) pairs over
+    distinct sources, both maintained as counts change.
+    """
+
+    def __init__(self, window=5):
+        self.window = window
+        self.buckets = deque()
+        self.total_bytes = 0
+        self.count = 0
+        self.dst_counts = {}
+        self.sum_clogc = 0.0
+        self.pair_counts = {}
+        self.src_fanout = {}
+
+    def _bump_dst(self, dst, k):
+        c = self.dst_counts.get(dst, 0)
+        n = c + k
+        self.sum_clogc += _clogc(n) - _clogc(c)
+        if n:
+            self.dst_counts[dst] = n
+        else:
+            del self.dst_counts[dst]
+
+    def _bump_pair(self, pair, k):
+        c = self.pair_counts.get(pair, 0)
+        n = c + k
+        if n:
+            self.pair_counts[pair] = n
+        else:
+            del self.pair_counts[pair]
+
+        src = pair[0]
+        if c == 0 and n:
+            self.src_fanout[src] = self.src_fanout.get(src, 0) + 1
+        elif c and n == 0:
+            left = self.src_fanout[src] - 1
+            if left:
+                self.src_fanout[src] = left
+            else:
+                del self.src_fanout[src]
+
+    def add(self, ts, src, dst, size):
+        second = int(ts)
+        # late records are charged to the newest bucket so buckets stay in order
+        if not self.buckets or self.buckets[-1].second < second:
+            self.buckets.append(_Bucket(second))
+        b = self.buckets[-1]
+        b.bytes += size
+        b.count += 1
+        b.dst[dst] += 1
+        b.pairs[(src, dst)] += 1
+
+        self.total_bytes += size
+        self.count += 1
+        self._bump_dst(dst, 1)
+        self._bump_pair((src, dst), 1)
+
+    def add_many(self, records):
+        for ts, src, dst, size in records:
+            self.add(ts, src, dst, size)
+
+    def expire(self, now):
+        cutoff = int(now) - self.window
+        while self.buckets and self.buckets[0].second <= cutoff:
+            b = self.buckets.popleft()
+            self.total_bytes -= b.bytes
+            self.count -= b.count
+            for dst, c in b.dst.items():
+                self._bump_dst(dst, -c)
+            for pair, c in b.pairs.items():
+                self._bump_pair(pair, -c)
+
+        if self.count == 0:
+            # drop accumulated float error whenever the window empties
+            self.sum_clogc = 0.0
+
+    def entropy(self):
+        n = self.count
+        if n == 0:
+            return 0.0
+        return max(0.0, math.log2(n) - self.sum_clogc / n)
+
+    def fan_out(self):
+        if not self.src_fanout:
+            return 0.0
+        return len(self.pair_counts) / len(self.src_fanout)
+
+    def metrics(self, now):
+        self.expire(now)
+        return {
+            "total_bytes": self.total_bytes,
+            "conn_count": self.count,
+            "avg_fan_out": round(self.fan_out(), 2),
+            "dst_ip_entropy": round(self.entropy(), 3),
+        }
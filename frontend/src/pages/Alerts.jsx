@@ -1,6 +1,6 @@
 import React, { useEffect, useState } from "react";
 import Layout from "../layout/Layout";
-import { getAlerts, getAlertDetails } from "../api";
+import { subscribeStream } from "../stores/streamStore";
 import AlertDetails from "../components/AlertDetails";
 
 export default function Alerts() {
@@ -8,26 +8,17 @@ export default function Alerts() {
   const [score, setScore] = useState(0);
   const [details, setDetails] = useState({});
 
-  useEffect(() => {
-    fetchAll();
-    const id = setInterval(fetchAll, 5000);
-    return () => clearInterval(id);
-  }, []);
+  useEffect(() => subscribeStream(onWindow), []);
 
-  async function fetchAll() {
-    try {
-      const a = await getAlerts();
-      const d = await getAlertDetails();
+  function onWindow(s) {
+    const a = s.alerts;
 
-      // ✅ IMPORTANT FIX
-      const alertList = Array.isArray(a?.alerts) ? a.alerts : [];
+    // ✅ IMPORTANT FIX
+    const alertList = Array.isArray(a?.alerts) ? a.alerts : [];
 
-      setAlerts(alertList);
-      setScore(a?.score ?? 0);
-      setDetails(d || {});
-    } catch (e) {
-      console.error("Alert fetch error", e);
-    }
+    setAlerts(alertList);
+    setScore(a?.score ?? 0);
+    setDetails(s.alert_details || {});
   }
 
   return (
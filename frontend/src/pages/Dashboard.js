@@ -5,6 +5,7 @@ import ProtocolChart from "../components/ProtocolChart";
 import TopologyGraph from "../components/TopologyGraph";
 import TopTalkers from "../components/TopTalkers";
 import AlertDetails from "../components/AlertDetails";
+import { subscribeStream } from "../stores/streamStore";
 import "./Dashboard.css";
 
 /* ---------- Helpers ---------- */
@@ -56,16 +57,33 @@ export default function Dashboard() {
     }
   }, []);
 
+  // live windows pushed by the backend stream (replaces the 5s poll)
+  const applyWindow = useCallback((s) => {
+    const mData = s.metrics || [];
+    if (mData.length > 0) {
+      setMetrics((prev) => {
+        const seen = new Set(prev.map((x) => x.timestamp));
+        const fresh = mData.filter((x) => !seen.has(x.timestamp)).map((x) => ({ ...x }));
+        return fresh.length ? [...prev, ...fresh].slice(-120) : prev;
+      });
+    }
+    setAlerts(Array.isArray(s.alerts) ? s.alerts : []);
+    setProtocols(s.protocols || []);
+    setTopTalkers(s.top_talkers || { src: [], dst: [] });
+    setTopology(s.topology || []);
+    setAlertDetails(s.alert_details || {});
+  }, []);
+
   useEffect(() => {
     mounted.current = true;
     fetchAll();
-    let id = null;
-    if (autoMode) id = setInterval(fetchAll, 5000);
+    let unsub = null;
+    if (autoMode) unsub = subscribeStream(applyWindow);
     return () => {
       mounted.current = false;
-      if (id) clearInterval(id);
+      if (unsub) unsub();
     };
-  }, [autoMode, fetchAll]);
+  }, [autoMode, fetchAll, applyWindow]);
 
   // Prepare chart-friendly dataset; attach unit fields used by tooltip
   const chartData = metrics.map((m) => {
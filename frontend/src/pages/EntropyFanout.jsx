@@ -1,8 +1,8 @@
 import React, { useEffect, useState } from "react";
 import Layout from "../layout/Layout";
 import LineChartCard from "../components/LineChartCard";
-import { getMetrics } from "../api";
-import { getStoredMetrics, pushMetricsBatch, subscribe } from "../stores/metricsStore";
+import { getStoredMetrics, subscribe } from "../stores/metricsStore";
+import { subscribeStream } from "../stores/streamStore";
 
 export default function EntropyFanout() {
   const [metrics, setMetrics] = useState([]);
@@ -12,20 +12,14 @@ export default function EntropyFanout() {
     setMetrics(getStoredMetrics().slice(-120));
     const unsub = subscribe((all) => setMetrics(all.slice(-120)));
 
-    // also fetch and push live batches (so store stays populated)
-    fetchAll();
-    const id = setInterval(fetchAll, 5000);
+    // keep the live stream open so the store stays populated
+    const unsubStream = subscribeStream(() => {});
     return () => {
-      clearInterval(id);
+      unsubStream();
       unsub();
     };
   }, []);
 
-  async function fetchAll() {
-    const m = await getMetrics();
-    if (m.data) pushMetricsBatch(m.data);
-  }
-
   const chartEntropy = metrics.map((m) => ({ time: new Date(m.timestamp).toLocaleTimeString(), entropy: m.dst_ip_entropy }));
   const chartFanout = metrics.map((m) => ({ time: new Date(m.timestamp).toLocaleTimeString(), fanout: m.avg_fan_out }));
 
@@ -2,7 +2,7 @@ import React, { useEffect, useMemo, useRef, useState } from "react";
 import Layout from "../layout/Layout";
 import TopologyGraph from "../components/TopologyGraph";
 import TopTalkers, { formatBytes } from "../components/TopTalkers";
-import { getTopology } from "../api";
+import { subscribeStream } from "../stores/streamStore";
 
 export default function FlowExplorer() {
   const [edges, setEdges] = useState([]);
@@ -19,17 +19,10 @@ export default function FlowExplorer() {
   useEffect(() => {
     if (isFrozen) return;
 
-    // fetch immediately then poll while not frozen
-    fetchTopo();
-    const id = setInterval(fetchTopo, 5000);
-    return () => clearInterval(id);
+    // follow the live topology while not frozen
+    return subscribeStream((s) => setEdges(s.topology || []));
   }, [isFrozen]);
 
-  async function fetchTopo() {
-    const t = await getTopology();
-    setEdges(t || []);
-  }
-
   // derive top talkers separately for sources and destinations
   const { aggregatedSrc, aggregatedDst } = useMemo(() => {
     const srcMap = {};
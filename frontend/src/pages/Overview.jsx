@@ -1,6 +1,6 @@
 import { useEffect, useState } from "react";
-import { getMetrics, getAlerts } from "../api";
-import { getStoredMetrics, pushMetricsBatch, subscribe } from "../stores/metricsStore";
+import { getStoredMetrics, subscribe } from "../stores/metricsStore";
+import { subscribeStream } from "../stores/streamStore";
 import Layout from "../layout/Layout";
 import {
   LineChart, Line, XAxis, YAxis, Tooltip,
@@ -15,42 +15,26 @@ export default function Overview() {
   const [alertsObj, setAlertsObj] = useState({});
   const [internetSpeed, setInternetSpeed] = useState("--");
 
-  /* ---------------- Fetch Loop ---------------- */
+  /* ---------------- Live Updates ---------------- */
 
   useEffect(() => {
     // initialize from store and subscribe to live updates
     setMetrics(getStoredMetrics().slice(-120));
     const unsub = subscribe((all) => setMetrics(all.slice(-120)));
 
-    fetchData();
-    fetchInternetSpeed();
+    // metrics reach the shared store through the stream; alerts come with each window
+    const unsubStream = subscribeStream((s) => setAlertsObj(s.alerts || {}));
 
-    const id = setInterval(fetchData, 5000);
+    fetchInternetSpeed();
     const sid = setInterval(fetchInternetSpeed, 15000);
 
     return () => {
-      clearInterval(id);
       clearInterval(sid);
       unsub();
+      unsubStream();
     };
   }, []);
 
-  const fetchData = async () => {
-    try {
-      const m = await getMetrics();
-      const a = await getAlerts();
-
-      if (m.data?.length) {
-        // push into shared store (deduped) and update local view via subscription
-        pushMetricsBatch(m.data);
-      }
-
-      setAlertsObj(a.data || {});
-    } catch (e) {
-      console.error(e);
-    }
-  };
-
   /* ---------------- Internet Speed (working) ---------------- */
 
   async function fetchInternetSpeed() {
@@ -3,8 +3,8 @@ import Layout from "../layout/Layout";
 import ProtocolChart from "../components/ProtocolChart";
 import TopTalkers from "../components/TopTalkers";
 import LineChartCard from "../components/LineChartCard";
-import { getMetrics, getProtocols, getTopTalkers } from "../api";
-import { getStoredMetrics, pushMetricsBatch, subscribe } from "../stores/metricsStore";
+import { getStoredMetrics, subscribe } from "../stores/metricsStore";
+import { subscribeStream } from "../stores/streamStore";
 
 export default function TrafficAnalysis() {
   const [metrics, setMetrics] = useState([]);
@@ -16,23 +16,16 @@ export default function TrafficAnalysis() {
     setMetrics(getStoredMetrics().slice(-120));
     const unsub = subscribe((all) => setMetrics(all.slice(-120)));
 
-    fetchAll();
-    const id = setInterval(fetchAll, 5000);
+    const unsubStream = subscribeStream((s) => {
+      setProtocols(s.protocols || []);
+      setTop(s.top_talkers || { src: [], dst: [] });
+    });
     return () => {
-      clearInterval(id);
+      unsubStream();
       unsub();
     };
   }, []);
 
-  async function fetchAll() {
-    const m = await getMetrics();
-    const p = await getProtocols();
-    const t = await getTopTalkers();
-    if (m.data) pushMetricsBatch(m.data);
-    setProtocols(p || []);
-    setTop(t || { src: [], dst: [] });
-  }
-
   const [unit, setUnit] = useState("MB");
 
   const chartData = metrics.map((m) => {
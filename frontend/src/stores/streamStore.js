@@ -0,0 +1,88 @@
+import { pushMetricsBatch } from "./metricsStore";
+
+const STREAM_URL = "http://127.0.0.1:8000/api/stream";
+
+// one EventSource per tab, shared by every page; opened by the first
+// subscriber and closed when the last one leaves
+const store = {
+  source: null,
+  subscribers: 0,
+  generation: null,
+  state: {
+    metrics: [],
+    alerts: {},
+    protocols: [],
+    top_talkers: { src: [], dst: [] },
+    topology: [],
+    alert_details: {},
+  },
+};
+
+function edgeKey(src, dst) {
+  return `${src}|${dst}`;
+}
+
+function applyTopology(current, delta) {
+  const edges = new Map(current.map((e) => [edgeKey(e.src_ip, e.dst_ip), e]));
+  for (const [src, dst] of delta.remove || []) edges.delete(edgeKey(src, dst));
+  for (const [src, dst, bytes] of delta.upsert || []) {
+    edges.set(edgeKey(src, dst), { src_ip: src, dst_ip: dst, bytes });
+  }
+  return [...edges.values()].sort((a, b) => b.bytes - a.bytes);
+}
+
+function apply(msg, full) {
+  if (!full && store.generation !== null && msg.generation <= store.generation) return;
+  store.generation = msg.generation;
+
+  const { topology, ...rest } = msg;
+  store.state = {
+    ...store.state,
+    ...rest,
+    topology: full ? topology || [] : applyTopology(store.state.topology, topology || {}),
+  };
+
+  if (Array.isArray(msg.metrics) && msg.metrics.length) pushMetricsBatch(msg.metrics);
+
+  try {
+    window.dispatchEvent(new CustomEvent("streamUpdated"));
+  } catch (e) {}
+}
+
+function open() {
+  const source = new EventSource(STREAM_URL);
+  source.addEventListener("snapshot", (e) => apply(JSON.parse(e.data), true));
+  source.addEventListener("delta", (e) => apply(JSON.parse(e.data), false));
+  // EventSource reconnects on its own; the server sends a fresh snapshot on reconnect
+  store.source = source;
+}
+
+export function getStreamState() {
+  return store.state;
+}
+
+export function subscribeStream(cb) {
+  const handler = () => cb(getStreamState());
+  window.addEventListener("streamUpdated", handler);
+
+  store.subscribers += 1;
+  if (!store.source) open();
+  else if (store.generation !== null) handler();
+
+  return () => {
+    window.removeEventListener("streamUpdated", handler);
+    store.subscribers -= 1;
+    if (store.subscribers === 0 && store.source) {
+      store.source.close();
+      store.source = null;
+      store.generation = null;
+    }
+  };
+}
+
+const streamStore = {
+  getStreamState,
+  subscribeStream,
+};
+
+export default streamStore;